@@ -0,0 +1,36 @@
+# admission.py — control de admisión de conexiones (servidor y modo host)
+#
+# Después de un reinicio del servidor todos los escritorios reconectan a la vez
+# y cada uno pide su historial. Dos frenos:
+#   - ritmo de aceptación: cubeta de `rate` conexiones/s con ráfaga de `burst`
+#     (GCRA); la que se pasa se cierra con RETRY_CLOSE y una espera sugerida;
+#   - reenvíos de historial simultáneos acotados (semáforo en Hub.handler).
+# Las esperas sugeridas se reparten: cada rechazo reserva el turno siguiente,
+# así los rechazados vuelven escalonados a `rate` por segundo y no en otra ola.
+import time
+
+
+class Admission:
+    """Ritmo de aceptación de conexiones; `rate=0` acepta todo."""
+
+    def __init__(self, rate=100.0, burst=200):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tat = 0.0        # instante teórico en que la cubeta queda vacía
+        self._promised = 0.0   # último turno prometido a un rechazado
+        self.rejected = 0
+
+    def admit(self, now=None) -> float:
+        """0 si la conexión entra ya; si no, los segundos sugeridos antes de reintentar."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        step = 1.0 / self.rate
+        tat = max(self._tat, now)
+        if tat - now <= (self.burst - 1) * step:
+            self._tat = tat + step
+            return 0.0
+        self.rejected += 1
+        free = tat - (self.burst - 1) * step   # cuándo vuelve a haber lugar
+        self._promised = max(self._promised + step, free)
+        return self._promised - now
@@ -0,0 +1,122 @@
+"""Costo de serializar y leer el JSON del protocolo con cada backend de codec.py.
+
+Mide dumps (dict → bytes del frame) y loads (frame → dict) sobre payloads
+representativos, con cada backend instalado (orjson, msgspec, json) y con lo
+que se hacía antes de codec.py: `json.dumps(..., ensure_ascii=False).encode()`
+y `json.loads` del str que entrega websockets.
+
+  text     mensaje de chat corto, tal como sale del servidor (seq, id, canal)
+  paste    texto pegado largo (logs, mails) con acentos
+  image    mensaje con un adjunto por referencia y su miniatura inline (base64)
+  chunk    trozo de subida en base64 (cliente sin modo binario)
+  history  frame de historial de 30 mensajes (mezcla de los anteriores)
+
+    python bench/bench_codec.py
+    python bench/bench_codec.py --seconds 0.5 --json out.json
+"""
+import argparse, base64, json, pathlib, random, sys, time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import codec  # noqa: E402
+from history import History  # noqa: E402
+from uploads import UPLOAD_CHUNK  # noqa: E402
+
+WORDS = ("hola buen día ya reinicié el servidor de impresión alguien vio el ticket "
+         "del cliente la vpn está caída paso en cinco minutos gracias ok dale listo").split()
+
+
+def payloads(seed=1, thumb_bytes=9000):
+    rnd = random.Random(seed)
+    base = {"from": "Soporte", "ts": "2025-01-01T10:00:00", "channel": "general", "attachments": []}
+
+    def msg(i, **kw):
+        return {"type": "msg", **base, "seq": 1000 + i, "id": "%032x" % rnd.getrandbits(128), **kw}
+
+    text = msg(0, text=" ".join(rnd.choices(WORDS, k=10)))
+    paste = msg(1, text="\n".join(" ".join(rnd.choices(WORDS, k=14)) for _ in range(40)))
+    image = msg(2, type="image", text="", attachments=[{
+        "type": "image", "hash": "%064x" % rnd.getrandbits(256), "name": "captura.png", "mime": "image/png",
+        "size": 412_345, "thumb": base64.b64encode(rnd.randbytes(thumb_bytes)).decode("ascii"),
+        "thumb_mime": "image/jpeg", "w": 1920, "h": 1080}])
+    chunk = {"type": "upload_chunk", "upload": "%032x" % rnd.getrandbits(128), "offset": 0,
+             "data": base64.b64encode(rnd.randbytes(UPLOAD_CHUNK)).decode("ascii")}
+    ring = History(30, epoch="a1b2c3d4e5f6")
+    for i in range(30):
+        ring.append({**rnd.choices((text, paste, image), weights=(8, 1, 1))[0], "seq": 2000 + i})
+    history = codec.loads(ring.frame())
+    return {"text": text, "paste": paste, "image": image, "chunk": chunk, "history": history}
+
+
+def before():
+    # lo que había antes de codec.py en hub.py, history.py y cliente.py
+    return (lambda o: json.dumps(o, ensure_ascii=False).encode("utf-8"),
+            lambda b: json.loads(b.decode("utf-8")))
+
+
+def timeit(calls, seconds, rounds=20):
+    """Microsegundos por llamada de cada `(fn, arg)` de `calls`.
+
+    Las funciones se turnan en tandas cortas y se toma la mejor tanda de cada
+    una: en una máquina compartida la velocidad varía de un segundo al otro, y
+    medirlas una después de la otra compararía momentos, no codecs.
+    """
+    sizes = []
+    for fn, arg in calls:   # calibrar: cada tanda dura ~seconds / rounds / len(calls)
+        n, t0 = 0, time.perf_counter()
+        while time.perf_counter() - t0 < seconds / rounds / len(calls) / 4:
+            fn(arg)
+            n += 1
+        sizes.append(max(1, n * 4))
+    best = [float("inf")] * len(calls)
+    for _ in range(rounds):
+        for i, ((fn, arg), n) in enumerate(zip(calls, sizes)):
+            t0 = time.perf_counter()
+            for _ in range(n):
+                fn(arg)
+            best[i] = min(best[i], (time.perf_counter() - t0) / n)
+    return [b * 1e6 for b in best]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--seconds", type=float, default=1.0, help="tiempo aproximado por codec y payload")
+    ap.add_argument("--thumb-bytes", type=int, default=9000, help="tamaño de la miniatura JPEG (antes de base64)")
+    ap.add_argument("--json", help="guardar resultados en este archivo")
+    args = ap.parse_args()
+
+    cases = payloads(thumb_bytes=args.thumb_bytes)
+    codecs = [("antes", *before())]
+    for name in codec.BACKENDS:
+        try:
+            codecs.append((name, *codec.backend(name)))
+        except ImportError:
+            print(f"({name} no está instalado)")
+
+    results = []
+    for case, obj in cases.items():
+        data = codecs[0][1](obj)
+        # los frames llegan como bytes (history, bus, diario); "antes" además decodificaba el str
+        assert all(loads(dumps(obj)) == obj for _, dumps, loads in codecs)
+        times = timeit([(f, arg) for _, dumps, loads in codecs for f, arg in ((dumps, obj), (loads, data))],
+                       args.seconds * len(codecs))
+        for k, (name, dumps, _) in enumerate(codecs):
+            results.append({"payload": case, "codec": name, "bytes": len(dumps(obj)),
+                            "dumps_us": round(times[2 * k], 2), "loads_us": round(times[2 * k + 1], 2)})
+
+    print(f"codec elegido: {codec.NAME}")
+    print(f"{'payload':<8} {'codec':<8} {'bytes':>8} {'dumps µs':>10} {'loads µs':>10} {'x antes':>8}")
+    ref = {}
+    for r in results:
+        total = r["dumps_us"] + r["loads_us"]
+        ref.setdefault(r["payload"], total)
+        r["speedup"] = round(ref[r["payload"]] / total, 2)
+        print(f"{r['payload']:<8} {r['codec']:<8} {r['bytes']:>8} {r['dumps_us']:>10.2f} "
+              f"{r['loads_us']:>10.2f} {r['speedup']:>8.2f}")
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps({"bench": "codec", "args": vars(args), "selected": codec.NAME,
+                                                       "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
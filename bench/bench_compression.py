@@ -0,0 +1,127 @@
+"""CPU vs. bytes en el cable para los modos de compresión del servidor.
+
+Simula el envío de la mezcla de mensajes a N destinatarios pasando cada frame
+por la extensión permessage-deflate negociada (sin red), igual que haría
+websockets al mandar un broadcast o un historial a cada conexión.
+
+    python bench/bench_compression.py --clients 50
+    python bench/bench_compression.py --journal %TEMP%/fastchat.jsonl --json out.json
+
+Con --journal se usa el historial real (fastchat.jsonl) como mezcla de mensajes.
+"""
+import argparse, json, pathlib, random, sys, time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from websockets import frames  # noqa: E402
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory  # noqa: E402
+from compression import TunedDeflateFactory  # noqa: E402
+from history import History, encode  # noqa: E402
+
+WORDS = ("hola buen día ya reinicié el servidor de impresión alguien vio el ticket "
+         "del cliente la vpn está caída paso en cinco minutos gracias ok dale listo").split()
+
+
+def synthetic_mix(n=300, seed=1):
+    rnd = random.Random(seed)
+    users = ["Ana", "Bruno", "Carla", "Diego", "Soporte"]
+    out = []
+    for i in range(n):
+        r = rnd.random()
+        msg = {"type": "msg", "from": rnd.choice(users), "attachments": [],
+               "ts": f"2025-01-01T10:{i // 60 % 60:02d}:{i % 60:02d}"}
+        if r < 0.80:      # líneas cortas de chat
+            msg["text"] = " ".join(rnd.choices(WORDS, k=rnd.randint(2, 12)))
+        elif r < 0.92:    # texto pegado (logs, mails)
+            msg["text"] = "\n".join(" ".join(rnd.choices(WORDS, k=14)) for _ in range(rnd.randint(10, 60)))
+        else:             # imagen por referencia (desde el almacén de blobs)
+            msg.update(type="image", text="", attachments=[{
+                "type": "image", "hash": "%064x" % rnd.getrandbits(256),
+                "name": "image.png", "mime": "image/png", "size": rnd.randint(20_000, 900_000)}])
+        out.append(msg)
+    return out
+
+
+def journal_mix(path):
+    items = []
+    for line in pathlib.Path(path).read_text(encoding="utf-8").splitlines():
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            pass
+    return items
+
+
+def wire_frames(mix, history_every=20, history_max=30):
+    """Payloads tal cual los manda el servidor: cada mensaje + un historial cada tanto (reconexiones)."""
+    hist = History(history_max)
+    out = []
+    for i, msg in enumerate(mix):
+        data = encode(msg)
+        hist.append(msg, data)
+        out.append(data)
+        if i and i % history_every == 0:
+            out.append(hist.frame())
+    return out
+
+
+def make_exts(factory, n):
+    return [factory.process_request_params([], [])[1] for _ in range(n)] if factory else [None] * n
+
+
+def run(name, factory, payloads, clients):
+    exts = make_exts(factory, clients)
+    raw = wire = 0
+    t0 = time.process_time()
+    for data in payloads:
+        for ext in exts:
+            f = frames.Frame(frames.OP_TEXT, data)
+            if ext is not None:
+                f = ext.encode(f)
+            raw += len(data)
+            wire += len(f.data) + (2 if len(f.data) < 126 else 4 if len(f.data) < 65536 else 10)
+    cpu = time.process_time() - t0
+    cache = getattr(factory, "cache", None)
+    return {"mode": name, "clients": clients, "frames": len(payloads) * clients,
+            "cpu_s": round(cpu, 4), "raw_bytes": raw, "wire_bytes": wire,
+            "ratio": round(wire / raw, 3) if raw else 0,
+            "cache_hits": cache.hits if cache else None}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--clients", type=int, default=50)
+    ap.add_argument("--messages", type=int, default=300)
+    ap.add_argument("--journal", help="fastchat.jsonl real para usar como mezcla")
+    ap.add_argument("--min-size", type=int, default=512)
+    ap.add_argument("--window-bits", type=int, default=12)
+    ap.add_argument("--mem-level", type=int, default=5)
+    ap.add_argument("--json", help="guardar resultados en este archivo")
+    args = ap.parse_args()
+
+    mix = journal_mix(args.journal) if args.journal else synthetic_mix(args.messages)
+    payloads = wire_frames(mix)
+    tuning = dict(window_bits=args.window_bits, mem_level=args.mem_level, min_size=args.min_size)
+    configs = [
+        ("off", None),
+        # lo que hacía websockets.serve por defecto antes
+        ("default", ServerPerMessageDeflateFactory(server_max_window_bits=12, client_max_window_bits=12,
+                                                   compress_settings={"memLevel": 5})),
+        ("on", TunedDeflateFactory("on", **tuning)),
+        ("shared", TunedDeflateFactory("shared", **tuning)),
+    ]
+    results = [run(name, f, payloads, args.clients) for name, f in configs]
+
+    print(f"{len(payloads)} payloads x {args.clients} clientes "
+          f"({'journal' if args.journal else 'mezcla sintética'})")
+    print(f"{'modo':<8} {'cpu s':>8} {'MB crudos':>10} {'MB cable':>9} {'ratio':>6} {'cache hits':>10}")
+    for r in results:
+        print(f"{r['mode']:<8} {r['cpu_s']:>8.3f} {r['raw_bytes'] / 1e6:>10.2f} {r['wire_bytes'] / 1e6:>9.2f} "
+              f"{r['ratio']:>6.3f} {r['cache_hits'] if r['cache_hits'] is not None else '-':>10}")
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps({"bench": "compression", "args": vars(args),
+                                                       "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+"""Prueba de carga de servidor.py: fan-out, throughput, recursos y reconexión masiva.
+
+Levanta el servidor (subproceso, o en el mismo proceso con --inproc) en
+localhost con un directorio temporal propio, conecta N clientes simulados y
+hace que `--senders` de ellos manden `--rate` mensajes/s en total con la
+mezcla texto/imagen pedida. Al final corta todas las conexiones a la vez y
+mide cuánto tardan en volver a tener el historial (reconnect storm). Con
+--restart además mata el servidor, lo vuelve a levantar y mide cuánto tarda
+cada cliente en recuperarse. Los clientes reintentan como cliente.py
+(--reconnect jitter: Backoff + retry-after) o como antes (fixed: 1→2→4→10 s).
+
+    python bench/bench_load.py --clients 500 --rate 50 --duration 20
+    python bench/bench_load.py --clients 2000 --image-ratio 0.1 --binary --json out.json
+    python bench/bench_load.py --inproc --clients 200 --env FASTCHAT_STORE=sqlite
+    python bench/bench_load.py --workers 4 --clients 2000 --rate 200
+    python bench/bench_load.py --clients 800 --channels 40 --senders 40 --rate 200
+    python bench/bench_load.py --clients 1000 --rate 500 --batch --env FASTCHAT_BATCH_WINDOW_MS=5
+    python bench/bench_load.py --clients 1000 --restart --no-storm
+    python bench/bench_load.py --clients 1000 --restart --no-storm --reconnect fixed \
+        --env FASTCHAT_ACCEPT_RATE=0 --env FASTCHAT_REPLAYS_MAX=0      # sin protección, para comparar
+
+Reporta latencia de fan-out (p50/p95/p99, desde que el emisor manda hasta que
+cada receptor recibe), mensajes y entregas por segundo, RSS y CPU del
+servidor, tiempo de persistencia del historial (con --inproc) y el
+comportamiento de la reconexión (con --inproc la CPU y el RSS incluyen a los
+clientes simulados; para números del servidor solo, usar el modo subproceso). --json guarda todo junto con el commit
+actual para comparar entre versiones.
+"""
+import argparse, asyncio, json, os, pathlib, random, subprocess, sys, tempfile, time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import websockets  # noqa: E402
+from protocol import BINARY_SUBPROTOCOL, resume_url, retry_after, Backoff  # noqa: E402
+
+TAG = "bench"
+
+
+def pct(values, p):
+    if not values:
+        return None
+    v = sorted(values)
+    return v[min(len(v) - 1, int(round(p / 100 * (len(v) - 1))))]
+
+
+def summary_ms(values) -> dict:
+    return {"n": len(values),
+            **{f"p{p}": round(pct(values, p) * 1000, 2) if values else None for p in (50, 95, 99)},
+            "max": round(max(values) * 1000, 2) if values else None}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except Exception:
+        pass
+
+
+# ---------- recursos del servidor ----------
+def _children(pid) -> list:
+    try:
+        kids = [int(c) for c in pathlib.Path(f"/proc/{pid}/task/{pid}/children").read_text().split()]
+    except OSError:
+        return []
+    return kids + [g for k in kids for g in _children(k)]
+
+
+class ProcSampler:
+    """Muestrea RSS y tiempo de CPU de un pid y sus hijos (psutil si está, si no /proc en Linux).
+
+    Los hijos cuentan para `--workers N`: el trabajo lo hacen los procesos worker.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.rss_max = 0
+        self.samples = []
+        try:
+            import psutil
+            self._p = psutil.Process(pid)
+        except Exception:
+            self._p = None
+
+    def read(self):
+        if self._p is not None:
+            try:
+                procs = [self._p] + self._p.children(recursive=True)
+                rss = cpu = 0
+                for p in procs:
+                    t = p.cpu_times()
+                    rss += p.memory_info().rss
+                    cpu += t.user + t.system
+                return rss, cpu
+            except Exception:
+                return None, None
+        try:
+            rss = cpu = 0
+            for pid in [self.pid] + _children(self.pid):
+                stat = pathlib.Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+                cpu += (int(stat[11]) + int(stat[12])) / os.sysconf("SC_CLK_TCK")
+                rss += int(stat[21]) * os.sysconf("SC_PAGE_SIZE")
+            return rss, cpu
+        except Exception:
+            return None, None
+
+    async def run(self, every=0.5):
+        while True:
+            rss, cpu = self.read()
+            if rss is not None:
+                self.rss_max = max(self.rss_max, rss)
+                self.samples.append((time.perf_counter(), rss, cpu))
+            await asyncio.sleep(every)
+
+    def mark(self) -> float:
+        """Muestra puntual para delimitar una fase; devuelve el instante."""
+        t = time.perf_counter()
+        rss, cpu = self.read()
+        if rss is not None:
+            self.samples.append((t, rss, cpu))
+        return t
+
+    def cpu_percent(self, t0, t1):
+        pts = [s for s in self.samples if t0 <= s[0] <= t1]
+        if len(pts) < 2:
+            return None
+        return round(100 * (pts[-1][2] - pts[0][2]) / (pts[-1][0] - pts[0][0]), 1)
+
+
+# ---------- cliente simulado ----------
+class SimClient:
+    def __init__(self, idx, url, binary, stats, channel=None, batch=False):
+        self.idx = idx
+        self.batch = batch
+        self.channel = channel
+        self.url = url
+        self.binary = binary
+        self.stats = stats
+        self.ws = None
+        self._reader = None
+        self.history_at = None
+
+    async def connect(self):
+        t0 = time.perf_counter()
+        self.history_at = asyncio.get_running_loop().create_future()
+        # since=0: el servidor siempre contesta con el historial (aunque esté vacío)
+        self.ws = await websockets.connect(
+            resume_url(self.url, 0, None, self.channel, batch=self.batch), max_size=None, open_timeout=60, ping_interval=None,
+            subprotocols=[BINARY_SUBPROTOCOL] if self.binary else None)
+        self._reader = asyncio.create_task(self._read(self.ws, self.history_at))
+        return t0
+
+    async def _read(self, ws, history_at):
+        try:
+            async for raw in ws:
+                now = time.perf_counter()
+                if isinstance(raw, bytes):
+                    continue
+                msg = json.loads(raw)
+                t = msg.get("type")
+                self.stats["frames"] += 1
+                if t == "history":
+                    if not history_at.done():
+                        history_at.set_result(now)
+                    continue
+                for m in msg.get("items", []) if t == "batch" else [msg]:
+                    if m.get("type") in ("msg", "image"):
+                        text = m.get("text", "")
+                        if text.startswith(TAG):
+                            self.stats["lat"].append(now - float(text.split()[1]))
+                            self.stats["delivered"] += 1
+        except websockets.ConnectionClosed as e:
+            if not history_at.done():   # cerró antes del historial (p.ej. 1013 retry-after)
+                history_at.set_exception(e)
+        except asyncio.CancelledError:
+            pass
+
+    async def reconnect(self, policy="jitter", after_close=False, deadline=120):
+        """Conecta y espera el historial, reintentando como TrayClient._receiver.
+
+        policy "jitter": Backoff con el retry-after del servidor (y, si la conexión
+        anterior se cerró, una espera antes del primer intento); "fixed": 1→2→4→10 s
+        sin jitter e ignorando retry-after. Devuelve (instante del primer intento, intentos).
+        """
+        backoff = Backoff(1.0, 15.0, random.Random(self.idx))
+        fixed = 1
+        if after_close and policy == "jitter":
+            await asyncio.sleep(backoff.next())
+        t_first = time.perf_counter()
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                await self.connect()
+                await asyncio.wait_for(self.history_at, 60)
+                return t_first, attempts
+            except Exception as e:
+                if self.ws is not None:
+                    await self.ws.close()
+                if time.perf_counter() - t_first > deadline:
+                    raise
+                if policy == "fixed":
+                    delay, fixed = fixed, min(fixed * 2, 10)
+                else:
+                    delay = backoff.next(retry_after(e))
+                await asyncio.sleep(delay)
+
+    async def send(self, text, image: bytes | None):
+        msg = {"from": f"bot{self.idx}", "text": text}
+        if self.channel:
+            msg["channel"] = self.channel
+        if image is None:
+            await self.ws.send(json.dumps(msg))
+        elif self.binary:
+            meta = {"type": "image", "name": "bench.png", "mime": "image/png"}
+            await self.ws.send(json.dumps({**msg, "attachments": [meta], "binary": 1}))
+            await self.ws.send(image)
+        else:
+            import base64
+            att = {"type": "image", "name": "bench.png", "mime": "image/png",
+                   "data": base64.b64encode(image).decode("ascii")}
+            await self.ws.send(json.dumps({**msg, "attachments": [att]}))
+        self.stats["sent"] += 1
+
+    async def close(self):
+        if self.ws:
+            await self.ws.close()
+        if self._reader:
+            await self._reader
+
+
+async def connect_all(clients, concurrency, policy="jitter"):
+    sem = asyncio.Semaphore(concurrency)
+    times, errors = [], 0
+
+    async def one(c):
+        nonlocal errors
+        async with sem:
+            try:
+                t0, _ = await c.reconnect(policy)
+            except Exception:
+                errors += 1
+                return
+        times.append(c.history_at.result() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(c) for c in clients))
+    return time.perf_counter() - t0, times, errors
+
+
+# ---------- servidor ----------
+async def start_server(args, workdir):
+    env = dict(os.environ, TMPDIR=str(workdir), TEMP=str(workdir), TMP=str(workdir),
+               FASTCHAT_DATA_DIR=str(workdir / "data"), FASTCHAT_HOST="127.0.0.1",
+               FASTCHAT_PORT=str(args.port))
+    for kv in args.env:
+        k, _, v = kv.partition("=")
+        env[k] = v
+    if not args.inproc:
+        cmd = [sys.executable, str(ROOT / "servidor.py"), "--workers", str(args.workers)]
+        proc = subprocess.Popen(cmd, env=env, cwd=ROOT,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        await wait_port(args.port)
+        return proc, proc.pid, None
+
+    os.environ.update(env)
+    tempfile.tempdir = str(workdir)
+    import logging
+    logging.disable(logging.INFO)
+    import servidor
+    task = asyncio.create_task(servidor.main("127.0.0.1", args.port))
+    await wait_port(args.port)
+    return task, os.getpid(), servidor
+
+
+async def wait_port(port, timeout=30):
+    t_end = time.monotonic() + timeout
+    while time.monotonic() < t_end:
+        try:
+            async with websockets.connect(f"ws://127.0.0.1:{port}", open_timeout=5):
+                return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"el servidor no abrió el puerto {port}")
+
+
+def scrape(port, name):
+    """Valor de una métrica del servidor (GET /metrics), o None."""
+    import urllib.request
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as r:
+            for line in r.read().decode().splitlines():
+                if line.startswith(name + " "):
+                    return float(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def instrument_persist(servidor) -> list:
+    """Con --inproc: mide cada escritura por lotes del historial (diario o SQLite)."""
+    durations = []
+    store = servidor.HUB.store
+    name = "_insert" if hasattr(store, "_insert") else "_write"
+    orig = getattr(store, name)
+
+    def timed(*a, **kw):
+        t0 = time.perf_counter()
+        try:
+            return orig(*a, **kw)
+        finally:
+            durations.append(time.perf_counter() - t0)
+
+    setattr(store, name, timed)
+    return durations
+
+
+# ---------- corrida ----------
+async def run(args):
+    raise_fd_limit()
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix="fastchat-bench-"))
+    server, pid, servidor = await start_server(args, workdir)
+    persist = instrument_persist(servidor) if servidor else None
+    sampler = ProcSampler(pid)
+    sampler_task = asyncio.create_task(sampler.run())
+    stats = {"lat": [], "delivered": 0, "sent": 0, "frames": 0}
+    url = f"ws://127.0.0.1:{args.port}"
+    rnd = random.Random(args.seed)
+    image = rnd.randbytes(args.image_kb * 1024) if args.image_ratio > 0 else None
+    result = {"bench": "load", "commit": git_commit(), "args": vars(args)}
+
+    try:
+        # con --channels K los clientes se reparten en K canales y cada mensaje va sólo a su canal
+        channel_of = (lambda i: f"c{i % args.channels}") if args.channels > 1 else (lambda i: None)
+        clients = [SimClient(i, url, args.binary, stats, channel_of(i), args.batch) for i in range(args.clients)]
+        audience = {}
+        for c in clients:
+            audience[c.channel] = audience.get(c.channel, 0) + 1
+        t_conn, _, conn_errors = await connect_all(clients, args.connect_concurrency, args.reconnect)
+        result["connect"] = {"seconds": round(t_conn, 3), "errors": conn_errors}
+        print(f"{args.clients} clientes conectados en {t_conn:.2f}s ({conn_errors} errores)")
+
+        # --- fase estable ---
+        senders = clients[:max(1, min(args.senders, len(clients)))]
+        expected = 0
+        interval = 1.0 / args.rate if args.rate > 0 else 0
+        t0 = sampler.mark()
+        frames0 = stats["frames"]
+        n = 0
+        while time.perf_counter() - t0 < args.duration:
+            c = senders[n % len(senders)]
+            img = image if image is not None and rnd.random() < args.image_ratio else None
+            try:
+                await c.send(f"{TAG} {time.perf_counter():.6f} {n}", img)
+                expected += audience[c.channel] - 1
+            except websockets.ConnectionClosed:
+                pass
+            n += 1
+            target = t0 + n * interval
+            await asyncio.sleep(max(0.0, target - time.perf_counter()))
+        t_send = time.perf_counter() - t0
+        await asyncio.sleep(args.drain)
+        t1 = sampler.mark()
+        result["steady"] = {
+            "seconds": round(t1 - t0, 3),
+            "sent": stats["sent"], "sent_per_s": round(stats["sent"] / t_send, 1),
+            "delivered": stats["delivered"], "expected": expected,
+            "frames_in": stats["frames"] - frames0,   # con --batch, menos que las entregas
+            "delivered_per_s": round(stats["delivered"] / (t1 - t0), 1),
+            "delivery_ratio": round(stats["delivered"] / expected, 4) if expected else None,
+            "fanout_latency_ms": summary_ms(stats["lat"]),
+            "server_cpu_percent": sampler.cpu_percent(t0, t1),
+            "server_rss_max_mb": round(sampler.rss_max / 2**20, 1) if sampler.rss_max else None,
+        }
+        if persist is not None:
+            result["steady"]["persist_ms"] = summary_ms(persist)
+
+        # --- reconnect storm ---
+        if args.storm:
+            await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+            ts = sampler.mark()
+            total, times, errors = await connect_all(clients, args.clients, args.reconnect)   # todos a la vez
+            result["storm"] = {"seconds_all_connected": round(total, 3), "errors": errors,
+                               "history_latency_ms": summary_ms(times),
+                               "server_cpu_percent": sampler.cpu_percent(ts, sampler.mark())}
+
+        # --- reinicio del servidor: todos caen juntos y reintentan según --reconnect ---
+        if args.restart and servidor is None:
+            server.terminate()
+            server.wait(10)
+            recon = [asyncio.create_task(c.reconnect(args.reconnect, after_close=True)) for c in clients]
+            await asyncio.sleep(args.restart_downtime)
+            sampler_task.cancel()
+            server, pid, _ = await start_server(args, workdir)
+            sampler = ProcSampler(pid)
+            sampler_task = asyncio.create_task(sampler.run())
+            t_up = sampler.mark()
+            done = await asyncio.gather(*recon, return_exceptions=True)
+            ok = [(c, d) for c, d in zip(clients, done) if not isinstance(d, BaseException)]
+            result["restart"] = {
+                "downtime_s": args.restart_downtime,
+                "seconds_all_recovered": round(time.perf_counter() - t_up, 3),
+                "errors": len(clients) - len(ok),
+                "attempts": sum(a for _, (_, a) in ok),
+                "rejected": scrape(args.port, "fastchat_connections_rejected_total"),
+                "recovery_ms": summary_ms([max(0.0, c.history_at.result() - t_up) for c, _ in ok]),
+                "server_cpu_percent": sampler.cpu_percent(t_up, sampler.mark()),
+            }
+        elif args.restart:
+            print("--restart necesita el servidor en un subproceso (sin --inproc)")
+        await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+    finally:
+        sampler_task.cancel()
+        if servidor:
+            server.cancel()
+            try: await server
+            except BaseException: pass
+        else:
+            server.terminate()
+            server.wait(10)
+    result["server_rss_max_mb"] = round(sampler.rss_max / 2**20, 1) if sampler.rss_max else None
+    return result
+
+
+def print_report(r):
+    s = r["steady"]
+    lat = s["fanout_latency_ms"]
+    print(f"enviados {s['sent']} ({s['sent_per_s']}/s) · entregas {s['delivered']}/{s['expected']} "
+          f"({s['delivered_per_s']}/s) en {s['frames_in']} frames")
+    print(f"fan-out ms: p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+    print(f"servidor: CPU {s['server_cpu_percent']}%  RSS máx {s['server_rss_max_mb']} MB")
+    if "persist_ms" in s:
+        p = s["persist_ms"]
+        print(f"persistencia ms (por lote): p50 {p['p50']}  p99 {p['p99']}  lotes {p['n']}")
+    if "storm" in r:
+        st = r["storm"]
+        h = st["history_latency_ms"]
+        print(f"reconnect storm: todos conectados en {st['seconds_all_connected']}s, errores {st['errors']}, "
+              f"historial p50 {h['p50']} p99 {h['p99']} ms, CPU {st['server_cpu_percent']}%")
+    if "restart" in r:
+        rs = r["restart"]
+        h = rs["recovery_ms"]
+        print(f"reinicio ({rs['downtime_s']}s caído): todos recuperados {rs['seconds_all_recovered']}s después de "
+              f"levantar, errores {rs['errors']}, intentos {rs['attempts']}, rechazados {rs['rejected']}, "
+              f"recuperación p50 {h['p50']} p99 {h['p99']} ms, CPU {rs['server_cpu_percent']}%")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--clients", type=int, default=200)
+    ap.add_argument("--senders", type=int, default=10, help="cuántos de los clientes mandan")
+    ap.add_argument("--channels", type=int, default=1, help="repartir los clientes en K canales")
+    ap.add_argument("--rate", type=float, default=20, help="mensajes por segundo (total)")
+    ap.add_argument("--duration", type=float, default=10, help="segundos de la fase estable")
+    ap.add_argument("--drain", type=float, default=2, help="espera final para entregas pendientes")
+    ap.add_argument("--image-ratio", type=float, default=0.05, help="fracción de mensajes con imagen")
+    ap.add_argument("--image-kb", type=int, default=200)
+    ap.add_argument("--binary", action="store_true", help="subir imágenes en frames binarios")
+    ap.add_argument("--batch", action="store_true", help="clientes con ?batch=1 (ráfagas en frames batch)")
+    ap.add_argument("--no-storm", dest="storm", action="store_false")
+    ap.add_argument("--restart", action="store_true", help="al final, reiniciar el servidor y medir la recuperación")
+    ap.add_argument("--restart-downtime", type=float, default=2, help="segundos con el servidor caído")
+    ap.add_argument("--reconnect", choices=("jitter", "fixed"), default="jitter",
+                    help="política de reintento de los clientes (fixed = la de antes)")
+    ap.add_argument("--connect-concurrency", type=int, default=200)
+    ap.add_argument("--inproc", action="store_true", help="servidor en este mismo proceso")
+    ap.add_argument("--workers", type=int, default=1, help="servidor.py --workers N (modo subproceso)")
+    ap.add_argument("--port", type=int, default=18765)
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VAL",
+                    help="variables para el servidor (p.ej. FASTCHAT_DEFLATE=off)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="guardar resultados en este archivo")
+    args = ap.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
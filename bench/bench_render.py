@@ -0,0 +1,104 @@
+"""Costo de pintar el historial del diálogo de respuesta según su largo.
+
+Para cada largo N llena un `ReplyDialog` con N mensajes (texto y, cada
+`--image-every`, una miniatura) y mide cuánto tarda en mostrar cada uno de
+`--appends` mensajes nuevos que llegan después, layout incluido:
+
+  full         lo de antes: armar el HTML entero y `setHtml` en cada mensaje
+  incremental  `ReplyDialog.set_history`: insertar sólo lo nuevo al final
+
+Corre sin pantalla (plataforma offscreen de Qt):
+
+    python bench/bench_render.py
+    python bench/bench_render.py --lengths 30 100 300 1000 --appends 50 --json out.json
+"""
+import argparse, json, os, pathlib, statistics, sys, tempfile, time, types
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+# cliente.py es para Windows; el sonido no participa de la medición
+sys.modules.setdefault("winsound", types.ModuleType("winsound"))
+
+from PyQt6 import QtGui, QtWidgets  # noqa: E402
+from cliente import ReplyDialog, _esc, _thumb_html_for_file  # noqa: E402
+
+WORDS = ("hola buen día ya reinicié el servidor de impresión alguien vio el ticket "
+         "del cliente la vpn está caída paso en cinco minutos gracias ok dale listo").split()
+
+
+def make_thumb_file(tmp: pathlib.Path) -> str:
+    img = QtGui.QImage(640, 480, QtGui.QImage.Format.Format_RGB32)
+    img.fill(QtGui.QColor("#FF9A2D"))
+    path = tmp / "bench.png"
+    img.save(str(path))
+    return str(path)
+
+
+def make_messages(n, start, thumb, image_every):
+    out = []
+    for i in range(start, start + n):
+        text = _esc(" ".join(WORDS[(i * 7 + k) % len(WORDS)] for k in range(4 + i % 9)))
+        if image_every and i % image_every == 0:
+            text += "<br>" + _thumb_html_for_file(thumb, "bench.png")
+        out.append((f"user{i % 5}", text))
+    return out
+
+
+def full_render(dlg, msgs, max):
+    # set_history tal como era: todo el documento en cada mensaje
+    html_hist = "".join(f"<b> - {_esc(s)}: </b> {h}<br>" for s, h in msgs[-max:])
+    dlg.history_box.setHtml(html_hist)
+    dlg.history_box.verticalScrollBar().setValue(dlg.history_box.verticalScrollBar().maximum())
+
+
+def run(app, mode, length, appends, thumb, image_every):
+    dlg = ReplyDialog()
+    dlg.show()
+    render = full_render if mode == "full" else ReplyDialog.set_history
+    msgs = make_messages(length, 0, thumb, image_every)
+    render(dlg, msgs, length)
+    app.processEvents()
+    times = []
+    for m in make_messages(appends, length, thumb, image_every):
+        msgs.append(m)
+        t0 = time.perf_counter()
+        render(dlg, msgs, length)
+        dlg.history_box.document().size()   # forzar el layout dentro de la medición
+        app.processEvents()
+        times.append(time.perf_counter() - t0)
+        del msgs[:-length]
+    dlg.close()
+    dlg.deleteLater()
+    app.processEvents()
+    times.sort()
+    return {"mode": mode, "length": length, "appends": appends,
+            "mean_ms": round(statistics.fmean(times) * 1000, 3),
+            "p95_ms": round(times[int(len(times) * 0.95) - 1] * 1000, 3),
+            "max_ms": round(times[-1] * 1000, 3)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--lengths", type=int, nargs="+", default=[30, 100, 300, 1000])
+    ap.add_argument("--appends", type=int, default=50)
+    ap.add_argument("--image-every", type=int, default=5, help="una miniatura cada N mensajes (0 = sin imágenes)")
+    ap.add_argument("--json", help="guardar resultados en este archivo")
+    args = ap.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv[:1])
+    with tempfile.TemporaryDirectory() as tmp:
+        thumb = make_thumb_file(pathlib.Path(tmp))
+        results = [run(app, mode, n, args.appends, thumb, args.image_every)
+                   for n in args.lengths for mode in ("full", "incremental")]
+
+    print(f"{args.appends} mensajes nuevos por largo ({QtGui.QGuiApplication.platformName()})")
+    print(f"{'largo':>6} {'modo':<12} {'media ms':>9} {'p95 ms':>8} {'máx ms':>8}")
+    for r in results:
+        print(f"{r['length']:>6} {r['mode']:<12} {r['mean_ms']:>9.3f} {r['p95_ms']:>8.3f} {r['max_ms']:>8.3f}")
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps({"bench": "render", "args": vars(args),
+                                                       "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Escalado del fan-out con `servidor.py --workers N`.
+
+Para cada cantidad de workers levanta el servidor, reparte `--clients`
+receptores entre `--procs` procesos (para que el generador de carga no sea el
+cuello de botella) y manda mensajes lo más rápido que el servidor acepte
+durante `--duration` segundos. Reporta entregas por segundo y la aceleración
+respecto de 1 worker; en una máquina con P núcleos libres debería acercarse
+a lineal hasta ~P-1 workers (el proceso principal secuencia y persiste).
+
+    python bench/bench_workers.py --workers 1 2 4 --clients 1000 --procs 4
+    python bench/bench_workers.py --workers 1 2 4 8 --json out.json
+"""
+import argparse, asyncio, json, multiprocessing as mp, os, pathlib, subprocess, sys, tempfile, time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import websockets  # noqa: E402
+from bench_load import ROOT, git_commit, raise_fd_limit, summary_ms, wait_port  # noqa: E402
+from protocol import resume_url  # noqa: E402
+
+TAG, STOP = "bench", "bench-stop"
+
+
+# ---------- receptores (en procesos aparte) ----------
+def receiver_proc(url, n, ready, results):
+    raise_fd_limit()
+    results.put(asyncio.run(_receivers(url, n, ready)))
+
+
+async def _receivers(url, n, ready):
+    lat, count, last = [], [0], [0.0]
+
+    async def one():
+        async with websockets.connect(resume_url(url, 0, None), max_size=None, open_timeout=60,
+                                      ping_interval=None) as ws:
+            first = True
+            async for raw in ws:
+                if first:            # historial
+                    first = False
+                    conns.release()
+                    continue
+                msg = json.loads(raw)
+                text = msg.get("text", "")
+                if text == STOP:
+                    return
+                if text.startswith(TAG):
+                    count[0] += 1
+                    last[0] = time.perf_counter()
+                    if count[0] % 16 == 0:   # muestra de latencias, sin inflar la memoria
+                        lat.append(time.perf_counter() - float(text.split()[1]))
+
+    conns = asyncio.Semaphore(0)
+    tasks = [asyncio.create_task(one()) for _ in range(n)]
+    for _ in range(n):
+        await conns.acquire()
+    ready.release()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return count[0], lat, last[0]
+
+
+# ---------- una corrida ----------
+async def _send(url, duration, senders, window):
+    """Cada emisor mantiene hasta `window` mensajes sin ack (lazo cerrado: no inunda el servidor)."""
+    sent = [0]
+
+    async def sender(i, t_end):
+        async with websockets.connect(resume_url(url, 0, None), max_size=None, ping_interval=None) as ws:
+            await ws.recv()   # historial
+            credit = asyncio.Semaphore(window)
+
+            async def acks():
+                async for raw in ws:
+                    if json.loads(raw).get("type") == "ack":
+                        credit.release()
+
+            reader = asyncio.create_task(acks())
+            await ready.wait()
+            while time.perf_counter() < t_end:
+                await credit.acquire()
+                await ws.send(json.dumps({"from": f"bench{i}", "text": f"{TAG} {time.perf_counter():.6f}"}))
+                sent[0] += 1
+            for _ in range(window):   # esperar los acks pendientes
+                await asyncio.wait_for(credit.acquire(), 30)
+            await ws.send(json.dumps({"from": f"bench{i}", "text": STOP}))
+            reader.cancel()
+
+    ready = asyncio.Event()
+    t0 = time.perf_counter()
+    tasks = [asyncio.create_task(sender(i, t0 + 1 + duration)) for i in range(senders)]
+    await asyncio.sleep(1)    # conectar los emisores
+    ready.set()
+    await asyncio.gather(*tasks)
+    return sent[0], t0 + 1
+
+
+def run_one(workers, args):
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix="fastchat-bench-"))
+    env = dict(os.environ, TMPDIR=str(workdir), TEMP=str(workdir), TMP=str(workdir),
+               FASTCHAT_DATA_DIR=str(workdir / "data"), FASTCHAT_METRICS="0")
+    cmd = [sys.executable, str(ROOT / "servidor.py"), "--workers", str(workers),
+           "--host", "127.0.0.1", "--port", str(args.port)]
+    server = subprocess.Popen(cmd, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"ws://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(wait_port(args.port))
+        time.sleep(0.5 + 0.2 * workers)   # que todos los workers estén escuchando
+
+        ctx = mp.get_context("spawn")
+        ready, results = ctx.Semaphore(0), ctx.Queue()
+        per = [args.clients // args.procs + (i < args.clients % args.procs) for i in range(args.procs)]
+        procs = [ctx.Process(target=receiver_proc, args=(url, n, ready, results)) for n in per if n]
+        for p in procs:
+            p.start()
+        for _ in procs:
+            ready.acquire()
+
+        sent, t_start = asyncio.run(_send(url, args.duration, args.senders, args.window))
+        delivered, lat, t_end = 0, [], t_start
+        for _ in procs:
+            c, l, t = results.get(timeout=120)
+            delivered += c
+            lat += l
+            t_end = max(t_end, t)
+        elapsed = max(t_end - t_start, 1e-9)   # perf_counter es el mismo reloj monótono en todos los procesos
+        for p in procs:
+            p.join(10)
+    finally:
+        server.terminate()
+        server.wait(10)
+    return {"workers": workers, "sent": sent, "sent_per_s": round(sent / elapsed, 1),
+            "delivered": delivered, "delivered_per_s": round(delivered / elapsed, 1),
+            "fanout_latency_ms": summary_ms(lat)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--clients", type=int, default=1000)
+    ap.add_argument("--procs", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                    help="procesos generadores de carga (receptores)")
+    ap.add_argument("--senders", type=int, default=4)
+    ap.add_argument("--window", type=int, default=16, help="mensajes sin ack por emisor")
+    ap.add_argument("--duration", type=float, default=10)
+    ap.add_argument("--port", type=int, default=18766)
+    ap.add_argument("--json", help="guardar resultados en este archivo")
+    args = ap.parse_args()
+    raise_fd_limit()
+
+    results = []
+    for w in args.workers:
+        r = run_one(w, args)
+        results.append(r)
+        base = results[0]["delivered_per_s"] or 1
+        lat = r["fanout_latency_ms"]
+        print(f"workers {w:>2}: {r['sent_per_s']:>8.1f} msg/s  {r['delivered_per_s']:>10.1f} entregas/s  "
+              f"x{r['delivered_per_s'] / base:.2f}  p50 {lat['p50']} ms  p99 {lat['p99']} ms", flush=True)
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps({"bench": "workers", "commit": git_commit(),
+                                                       "cpus": os.cpu_count(), "args": vars(args),
+                                                       "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# blobs.py — almacén de adjuntos direccionado por contenido (SHA-256)
+import base64, hashlib, os, pathlib, re, tempfile
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+BLOB_PREFIX = "/blob/"   # GET /blob/<sha256> en el mismo puerto del websocket
+
+
+def is_hash(h) -> bool:
+    return isinstance(h, str) and bool(_HASH_RE.match(h))
+
+
+class BlobStore:
+    """Adjuntos en disco, uno por archivo, nombrados por su SHA-256.
+
+    El mismo contenido se guarda una sola vez (deduplicación): si el archivo ya
+    existe no se vuelve a escribir. Los mensajes sólo llevan la referencia
+    `{hash, name, mime, size}`.
+    """
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, h: str) -> pathlib.Path:
+        return self.root / h[:2] / h
+
+    def has(self, h: str) -> bool:
+        return is_hash(h) and self.path(h).exists()
+
+    def put(self, data) -> str:
+        """Guarda `data` (bytes/memoryview) y devuelve su hash. Bloqueante: llamar fuera del loop."""
+        h = hashlib.sha256(data).hexdigest()
+        p = self.path(h)
+        if not p.exists():
+            p.parent.mkdir(exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=p.parent, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, p)
+            except BaseException:
+                try: os.unlink(tmp)
+                except OSError: pass
+                raise
+        return h
+
+    def size(self, h: str) -> int | None:
+        if not is_hash(h):
+            return None
+        try:
+            return self.path(h).stat().st_size
+        except OSError:
+            return None
+
+    def read(self, h: str) -> bytes | None:
+        if not is_hash(h):
+            return None
+        try:
+            return self.path(h).read_bytes()
+        except OSError:
+            return None
+
+
+def externalize(msg: dict, store: BlobStore) -> dict:
+    """Saca los adjuntos base64 (`data`) del mensaje al almacén y deja sólo referencias.
+
+    Las referencias `{hash, ...}` se conservan sólo si el blob existe.
+
+    Bloqueante (decodifica y escribe a disco): llamar con `asyncio.to_thread`.
+    """
+    atts = msg.get("attachments") or []
+    # sólo referencias a blobs existentes (p.ej. subidas por partes ya confirmadas): nada que hacer
+    if all(isinstance(a, dict) and not a.get("data") and store.has(a.get("hash")) for a in atts):
+        return msg
+    refs = []
+    for a in atts:
+        if not isinstance(a, dict):
+            continue
+        if a.get("data"):
+            try:
+                raw = base64.b64decode(a["data"])
+            except (ValueError, TypeError):
+                continue
+            a = {"type": a.get("type", "image"), "hash": store.put(raw),
+                 "name": a.get("name", "imagen.png"), "mime": a.get("mime", "image/png"),
+                 "size": len(raw)}
+        elif not store.has(a.get("hash")):
+            continue   # referencia a un blob que no existe
+        refs.append(a)
+    return {**msg, "attachments": refs}
+
+
+def attach_binary(msg: dict, frames: list, store: BlobStore) -> dict:
+    """Modo binario: guarda los frames crudos de adjuntos y los cambia por referencias.
+
+    `msg["attachments"]` trae sólo los metadatos (name, mime) en el mismo orden
+    que los frames. Bloqueante: llamar con `asyncio.to_thread`.
+    """
+    metas = [a for a in (msg.get("attachments") or []) if isinstance(a, dict)]
+    refs = []
+    for i, raw in enumerate(frames):
+        a = metas[i] if i < len(metas) else {}
+        refs.append({"type": a.get("type", "image"), "hash": store.put(raw),
+                     "name": a.get("name", "imagen.png"), "mime": a.get("mime", "image/png"),
+                     "size": len(raw)})
+    out = {k: v for k, v in msg.items() if k != "binary"}
+    out["attachments"] = refs
+    return out
+
+
+def blob_response(store: BlobStore, path: str):
+    """Respuesta HTTP para `GET /blob/<hash>` (hook `process_request` de websockets)."""
+    from websockets.datastructures import Headers
+    from websockets.http11 import Response
+    h = path[len(BLOB_PREFIX):].split("?", 1)[0]
+    body = store.read(h)
+    if body is None:
+        return Response(404, "Not Found", Headers([("Content-Length", "0"), ("Connection", "close")]), b"")
+    return Response(200, "OK", Headers([
+        ("Content-Type", "application/octet-stream"),
+        ("Content-Length", str(len(body))),
+        ("Cache-Control", "public, max-age=31536000, immutable"),   # el contenido nunca cambia
+        ("Connection", "close"),
+    ]), body)
@@ -0,0 +1,118 @@
+# bus.py — bus local entre procesos worker de servidor.py (--workers N)
+#
+# El proceso principal es el secuenciador: es el único que asigna `seq`, guarda
+# el historial en disco y reparte cada mensaje a todos los workers por un socket
+# Unix. Cada worker atiende sus propios clientes (SO_REUSEPORT en el mismo
+# puerto) y mantiene una réplica en memoria del historial para los reconectes.
+#
+# Protocolo (una línea por mensaje, el JSON nunca trae saltos de línea crudos):
+#   worker → bus:  P <token> <mensaje normalizado sin seq>
+#   bus → worker:  W <id> <{"epoch": ..., "items": [...]}>   al conectarse
+#                  M <id origen> <token> <mensaje con seq>    en orden de seq
+# El worker de origen usa el token para no reenviar al emisor y mandarle el ack.
+import asyncio, logging
+from codec import dumps, loads
+
+LINE_LIMIT = 16 * 1024 * 1024   # un mensaje de texto largo no debe cortar el bus
+
+
+class BusServer:
+    """Lado del proceso principal: secuencia los mensajes publicados y los reparte en orden.
+
+    `sequence(msg) -> bytes` asigna el seq, guarda y devuelve los bytes a repartir;
+    `snapshot() -> (epoch, items)` es lo que recibe un worker al conectarse.
+    """
+
+    def __init__(self, path, sequence, snapshot):
+        self.path = str(path)
+        self.sequence = sequence
+        self.snapshot = snapshot
+        self._workers = {}   # id -> StreamWriter
+        self._next_id = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._serve, self.path, limit=LINE_LIMIT)
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for w in list(self._workers.values()):
+            w.close()
+
+    async def _serve(self, reader, writer):
+        self._next_id += 1
+        wid = self._next_id
+        epoch, items = self.snapshot()
+        writer.write(b"W %d " % wid + dumps({"epoch": epoch, "items": items}) + b"\n")
+        self._workers[wid] = writer
+        logging.info(f"Worker {wid} conectado al bus")
+        try:
+            while line := await reader.readline():
+                op, token, payload = line.rstrip(b"\n").split(b" ", 2)
+                if op != b"P":
+                    continue
+                try:
+                    msg = loads(payload)
+                except ValueError:
+                    continue
+                data = self.sequence(msg)
+                out = b"M %d %s " % (wid, token) + data + b"\n"
+                for w in list(self._workers.values()):
+                    w.write(out)
+                # esperar a los workers lentos acota lo que se acumula en memoria
+                await asyncio.gather(*(w.drain() for w in list(self._workers.values())),
+                                     return_exceptions=True)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logging.warning(f"Bus: worker {wid} desconectado: {e!r}")
+        finally:
+            self._workers.pop(wid, None)
+            writer.close()
+            logging.info(f"Worker {wid} desconectado del bus")
+
+
+class BusClient:
+    """Lado del worker: publica mensajes y recibe los ya secuenciados.
+
+    `on_message(msg, data, sender, ack)` se llama en orden de seq para cada
+    mensaje; `sender` es el ws local que lo mandó (o None si vino de otro worker).
+    """
+
+    def __init__(self, path, on_message):
+        self.path = str(path)
+        self.on_message = on_message
+        self.id = None
+        self.epoch = ""
+        self._reader = self._writer = None
+        self._pending = {}   # token -> (ws, ack)
+        self._token = 0
+
+    async def connect(self) -> list:
+        """Conecta y devuelve los mensajes del historial actual (para la réplica local)."""
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=LINE_LIMIT)
+        op, wid, payload = (await self._reader.readline()).rstrip(b"\n").split(b" ", 2)
+        if op != b"W":
+            raise ConnectionError("respuesta inesperada del bus")
+        self.id = int(wid)
+        snap = loads(payload)
+        self.epoch = snap["epoch"]
+        return snap["items"]
+
+    def publish(self, msg: dict, sender=None, ack=False):
+        self._token += 1
+        self._pending[self._token] = (sender, ack)
+        self._writer.write(b"P %d " % self._token + dumps(msg) + b"\n")
+
+    async def run(self):
+        """Lee el bus hasta que se corta (el proceso principal terminó)."""
+        while line := await self._reader.readline():
+            op, wid, token, data = line.rstrip(b"\n").split(b" ", 3)
+            if op != b"M":
+                continue
+            sender, ack = (self._pending.pop(int(token), (None, False))
+                           if int(wid) == self.id else (None, False))
+            await self.on_message(loads(data), data, sender, ack)
+
+    async def drain(self):
+        await self._writer.drain()
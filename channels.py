@@ -0,0 +1,146 @@
+# channels.py — canales (salas): índice canal → conexiones y un historial por canal
+#
+# Protocolo (ver también protocol.py):
+#   mensaje:      {"from": ..., "text": ..., "channel": "soporte"}   (sin canal → "general")
+#   suscribirse:  {"type": "subscribe", "channel": "soporte", "since": n, "epoch": e}
+#                 → {"type": "history", "channel": "soporte", ...} (delta o completo, como al conectar)
+#   desuscribir:  {"type": "unsubscribe", "channel": "soporte"}
+#   al conectar:  ws://host:8765/?channel=soporte  (si no, "general"; since/epoch aplican a ese canal)
+# El seq es global (uno solo para todos los canales) y cada canal retiene sus últimos N.
+import re
+from history import History
+
+DEFAULT_CHANNEL = "general"
+_NAME = re.compile(r"^[\w.\- ]{1,64}$")
+
+
+def channel_name(value, default=DEFAULT_CHANNEL) -> str | None:
+    """Nombre de canal normalizado; `default` si no vino, None si es inválido."""
+    if value is None or value == "":
+        return default
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    return value if _NAME.match(value) else None
+
+
+class Channels:
+    """Historial por canal + quién está suscripto a qué.
+
+    `subscribers(canal)` es lo único que recorre un broadcast, así el costo de
+    cada mensaje depende de la audiencia del canal y no del total de conexiones.
+    Tiene la misma cara que `History` para métricas y logs (len, nbytes,
+    last_seq, hits, misses, hit_rate) sumando todos los canales.
+    """
+
+    def __init__(self, maxlen=30, epoch="", max_channels=1000):
+        self.maxlen = maxlen
+        self.max_channels = max_channels
+        self._epoch = epoch
+        self.last_seq = 0
+        self._rings = {}    # canal -> History
+        self._subs = {}     # canal -> {ws: None} (dict: orden de suscripción, borrado O(1))
+        self._by_ws = {}    # ws -> set de canales
+
+    # ---------- secuencia / epoch ----------
+    def next_seq(self) -> int:
+        self.last_seq += 1
+        return self.last_seq
+
+    @property
+    def epoch(self) -> str:
+        return self._epoch
+
+    @epoch.setter
+    def epoch(self, value: str):
+        self._epoch = value
+        for ring in self._rings.values():
+            ring.epoch = value
+
+    # ---------- historial ----------
+    def ring(self, name: str, create=True) -> History | None:
+        ring = self._rings.get(name)
+        if ring is None and create and len(self._rings) < self.max_channels:
+            ring = self._rings[name] = History(self.maxlen, self._epoch, channel=name)
+        return ring
+
+    def append(self, msg: dict, data: bytes | None = None) -> bool:
+        """Agrega `msg` al historial de `msg["channel"]`; False si no hay lugar para otro canal."""
+        name = msg.setdefault("channel", DEFAULT_CHANNEL)
+        ring = self.ring(name)
+        if ring is None:
+            return False
+        if not isinstance(msg.get("seq"), int):
+            msg["seq"] = self.next_seq()   # historiales viejos no traen seq
+            data = None
+        ring.append(msg, data)
+        self.last_seq = max(self.last_seq, msg["seq"])
+        return True
+
+    def extend(self, msgs):
+        for m in msgs:
+            self.append(m)
+
+    def __len__(self):
+        return sum(len(r) for r in self._rings.values())
+
+    def __bool__(self):
+        return any(self._rings.values())
+
+    def __iter__(self):
+        """Todos los mensajes retenidos, en orden de seq."""
+        return iter(sorted((m for r in self._rings.values() for m in r), key=lambda m: m["seq"]))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(r.nbytes for r in self._rings.values())
+
+    @property
+    def hits(self) -> int:
+        return sum(r.hits for r in self._rings.values())
+
+    @property
+    def misses(self) -> int:
+        return sum(r.misses for r in self._rings.values())
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    # ---------- suscripciones ----------
+    def subscribe(self, ws, name: str) -> bool:
+        if self.ring(name) is None:
+            return False
+        self._subs.setdefault(name, {})[ws] = None
+        self._by_ws.setdefault(ws, set()).add(name)
+        return True
+
+    def unsubscribe(self, ws, name: str):
+        subs = self._subs.get(name)
+        if subs is not None:
+            subs.pop(ws, None)
+            if not subs:
+                del self._subs[name]
+        names = self._by_ws.get(ws)
+        if names is not None:
+            names.discard(name)
+
+    def drop(self, ws):
+        """Saca a `ws` de todos sus canales (al desconectarse)."""
+        for name in self._by_ws.pop(ws, ()):
+            subs = self._subs.get(name)
+            if subs is not None:
+                subs.pop(ws, None)
+                if not subs:
+                    del self._subs[name]
+
+    def subscribers(self, name: str):
+        return self._subs.get(name, {}).keys()
+
+    def channels_of(self, ws) -> set:
+        return self._by_ws.get(ws, set())
+
+    @property
+    def names(self) -> list:
+        return list(self._rings)
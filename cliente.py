@@ -1,11 +1,67 @@
-import sys, asyncio, threading, json, winsound, pathlib, os
+import sys, time, pathlib, os
+STARTUP_T0 = time.perf_counter()   # el arranque se mide desde acá (ver startup_mark)
+import threading
 from PyQt6 import QtWidgets, QtGui, QtCore
-import websockets, base64, html, tempfile, datetime, logging
-from io import BytesIO; from collections import deque
+import base64, html, tempfile
+from blobs import BlobStore, BLOB_PREFIX, externalize
+from channels import DEFAULT_CHANNEL, channel_name
+from protocol import BINARY_SUBPROTOCOL, is_binary, resume_url, retry_after, Backoff, acks_advertised
+from codec import dumps, loads, DecodeError
+from imagecache import ImageCache, image_key
+from msgbuffer import MessageBuffer
+import hashlib, urllib.parse
+
+# Arranque: para mostrar el ícono alcanza con Qt y Settings. asyncio y websockets se
+# importan en el hilo de red con el ícono ya visible (_import_network); lo del modo
+# host, los diálogos, las subidas y los sonidos, donde se usan.
+asyncio = websockets = None
+
+def _import_network():
+    global asyncio, websockets
+    import asyncio, websockets
 
 APP_ORG = "Tecnicos"
 APP_NAME = "FastChat"
-
+DECODE_WORKERS = 4   # hilos para decodificar/bajar/guardar adjuntos fuera del loop del websocket
+SEND_WINDOW = 64     # mensajes enviados sin confirmar a la vez (los demás esperan en la cola de envío)
+ACK_TIMEOUT = 5.0    # servidor que no anuncia acks: si no confirma en este tiempo, se manda sin esperar acks
+# Reconexión: espera con jitter entre RECONNECT_BASE y RECONNECT_MAX s (protocol.Backoff);
+# vuelve a la mínima después de una conexión que duró RECONNECT_STABLE s
+RECONNECT_BASE, RECONNECT_MAX, RECONNECT_STABLE = 1.0, 15.0, 30.0
+# Imágenes recibidas: caché por hash en %TEMP%/FastChat, con tope de tamaño (LRU) y antigüedad
+IMAGE_CACHE_MAX = 256 * 1024 * 1024
+IMAGE_CACHE_AGE = 30 * 24 * 3600
+LOADING_HTML = '<span style="color:#8A8F98;">🖼 cargando imagen…</span>'   # mientras se decodifica
+BLOB_LINK = "fastchat-blob:"   # enlace de una miniatura: fastchat-blob:<hash>/<nombre> baja el original al abrirlo
+# Imágenes al enviar: formato → (formato Qt, mime, extensión). El lado máximo, el
+# formato y la calidad son de Settings; "Original" en el diálogo manda PNG sin reducir.
+IMAGE_FORMATS = {"png": ("PNG", "image/png", ".png"),
+                 "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+                 "webp": ("WEBP", "image/webp", ".webp")}   # requiere el plugin qwebp (emisor y receptores)
+
+
+
+# Tiempos de arranque en ms desde STARTUP_T0: import, icon (bandeja visible), connect
+# (primera conexión). Con FASTCHAT_STARTUP_LOG=<archivo> se agrega una línea JSON por arranque.
+STARTUP = {}
+_mei = getattr(sys, "_MEIPASS", None)
+if _mei and pathlib.Path(_mei).name.startswith("_MEI"):   # exe one-file: se acaba de desempaquetar
+    STARTUP["unpack"] = round((time.time() - os.stat(_mei).st_ctime) * 1000, 1)   # antes de STARTUP_T0
+
+def startup_mark(stage: str):
+    if stage in STARTUP:
+        return
+    STARTUP[stage] = round((time.perf_counter() - STARTUP_T0) * 1000, 1)
+    if stage != "connect":
+        return
+    names = {"unpack": "desempaquetado", "import": "import", "icon": "ícono", "connect": "conexión"}
+    print("[Arranque] " + " · ".join(f"{names.get(k, k)} {v:.0f} ms" for k, v in STARTUP.items()))
+    if path := os.environ.get("FASTCHAT_STARTUP_LOG"):
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(dumps({"ts": time.time(), "frozen": bool(getattr(sys, "frozen", False)), **STARTUP}).decode() + "\n")
+        except OSError as e:
+            print(f"No se pudo escribir {path}: {e}")
 
 
 def resource_path(rel_path: str) -> str:
@@ -18,16 +74,39 @@ def play_sound(path: str, fallback: str):
         if not snd or not pathlib.Path(snd).exists():
             snd = resource_path(fallback)
         if snd and pathlib.Path(snd).exists():
+            import winsound
             winsound.PlaySound(snd, winsound.SND_FILENAME | winsound.SND_ASYNC)
     except Exception:
         pass
 
-def _qimage_to_png_bytes(img: QtGui.QImage) -> bytes:
+_writable_formats = None
+
+def _encode_image(img: QtGui.QImage, max_dim=0, fmt="png", quality=85) -> tuple[bytes, str, str]:
+    """Reduce `img` a `max_dim` px de lado (0 = sin tope) y la codifica; devuelve (bytes, mime, extensión).
+
+    Bloqueante, pero sólo usa QImage: se puede llamar fuera del hilo de la GUI.
+    Si Qt no tiene con qué escribir `fmt` (p. ej. sin el plugin de WebP), sale PNG.
+    """
+    global _writable_formats
+    if _writable_formats is None:
+        _writable_formats = {bytes(f).decode().upper() for f in QtGui.QImageWriter.supportedImageFormats()}
+    if max_dim and max(img.width(), img.height()) > max_dim:
+        img = img.scaled(max_dim, max_dim, QtCore.Qt.AspectRatioMode.KeepAspectRatio,
+                         QtCore.Qt.TransformationMode.SmoothTransformation)
+    qfmt, mime, ext = IMAGE_FORMATS.get(fmt, IMAGE_FORMATS["png"])
+    if qfmt not in _writable_formats:
+        qfmt, mime, ext = IMAGE_FORMATS["png"]
+    if qfmt == "JPEG" and img.hasAlphaChannel():   # JPEG no tiene alfa: aplanar sobre el fondo del historial
+        flat = QtGui.QImage(img.size(), QtGui.QImage.Format.Format_RGB32)
+        flat.fill(QtGui.QColor("#1A1D21"))
+        p = QtGui.QPainter(flat); p.drawImage(0, 0, img); p.end()
+        img = flat
     ba = QtCore.QByteArray()
     buff = QtCore.QBuffer(ba)
     buff.open(QtCore.QIODevice.OpenModeFlag.WriteOnly)
-    img.save(buff, "PNG")
-    return bytes(ba)
+    if not img.save(buff, qfmt, -1 if qfmt == "PNG" else quality):
+        raise ValueError(f"no se pudo codificar la imagen como {qfmt}")
+    return bytes(ba), mime, ext
 
 def _pixmap_from_path(path: str) -> QtGui.QPixmap | None:
     if not pathlib.Path(path).exists():
@@ -38,42 +117,15 @@ def _pixmap_from_path(path: str) -> QtGui.QPixmap | None:
 def _esc(s: str) -> str:
     return html.escape(s, quote=True)
 
-def _img_tag_from_bytes(b: bytes, mime="image/png") -> str:
-    b64 = base64.b64encode(b).decode("ascii")
-    data = f"data:{mime};base64,{b64}"
-    return (
-        '<div style="margin:6px 0;">'
-        f'  <a href="{data}">'
-        f'    <img src="{data}" '
-        '         style="max-width: 320px; max-height: 220px; '
-        '                border:1px solid #2A2F36; border-radius:8px;">'
-        '  </a>'
-        '</div>'
-    )
-
-import tempfile, pathlib, html
+def _cache_b64_image(cache: ImageCache, data: str, name="imagen.png", key: str | None = None) -> str:
+    """Decodifica un adjunto base64 y lo guarda en la caché (clave: `key` o el hash del contenido)."""
+    raw = base64.b64decode(data)
+    return cache.put(key or image_key(raw), raw, name)
 
-def _esc(s: str) -> str:
-    return html.escape(s, quote=True)
-
-def _save_temp_image(b: bytes, name="imagen.png") -> str:
-    tmpdir = pathlib.Path(tempfile.gettempdir()) / "FastChat"
-    tmpdir.mkdir(exist_ok=True)
-    base = pathlib.Path(name).stem or "imagen"
-    ext = pathlib.Path(name).suffix or ".png"
-    i = 0
-    while True:
-        candidate = tmpdir / (f"{base}{'' if i==0 else f'_{i}'}{ext}")
-        if not candidate.exists():
-            break
-        i += 1
-    candidate.write_bytes(b)
-    return str(candidate)
-
-def _thumb_html_for_file(path: str, name: str, max_w=320, max_h=220) -> str:
+def _thumb_html_for_file(path: str, name: str, max_w=320, max_h=220, href: str | None = None) -> str:
     url = QtCore.QUrl.fromLocalFile(path).toString()  # file:///...
     return (
-        f'<a href="{url}">'
+        f'<a href="{href or url}">'
         f'  <img src="{url}" '
         f'       style="max-width:{max_w}px; max-height:{max_h}px; '
         '              border:1px solid #2A2F36; border-radius:8px;">'
@@ -81,11 +133,19 @@ def _thumb_html_for_file(path: str, name: str, max_w=320, max_h=220) -> str:
     )
 
 
-def _img_link_from_bytes(b: bytes, mime: str = "image/png", name: str = "imagen.png") -> str:
-    path = _save_temp_image(b, name)
-    url = QtCore.QUrl.fromLocalFile(path).toString() 
-    return f'📷 {_esc(name)} — <a href="{url}">Abrir</a>'
-
+def _http_get_blob(ws_url: str, h: str, timeout=15) -> bytes | None:
+    """Baja un adjunto por hash (GET /blob/<sha256> en el mismo host:puerto del websocket)."""
+    import urllib.request   # sólo para bajar blobs: no en el arranque
+    parts = urllib.parse.urlsplit(ws_url)
+    scheme = "https" if parts.scheme == "wss" else "http"
+    url = f"{scheme}://{parts.netloc}{BLOB_PREFIX}{h}"
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as r:
+            b = r.read()
+    except Exception as e:
+        print(f"No se pudo bajar adjunto {h[:12]}: {e}")
+        return None
+    return b if hashlib.sha256(b).hexdigest() == h else None
 
 
 # ---------- Utilidades ----------
@@ -94,6 +154,7 @@ class Settings:
         self.qs = QtCore.QSettings(APP_ORG, APP_NAME)
         self.server_url   = self.qs.value("server_url", "ws://127.0.0.1:8765", str)
         self.user_name    = self.qs.value("user_name",  "Usuario", str)
+        self.channel      = channel_name(self.qs.value("channel", DEFAULT_CHANNEL, str)) or DEFAULT_CHANNEL
 
         # 👇 Guardamos tokens (basename) por default, no rutas absolutas
         self.sound_path   = self._sanitize_setting_path(self.qs.value("sound_path", "sound.wav", str), "sound.wav")
@@ -107,9 +168,34 @@ class Settings:
         self.host_mode    = self.qs.value("host_mode", False, bool)
         self.admin_mode   = self.qs.value("admin_mode", False, bool)
 
+        # Modo host: cola de salida por cliente y política para clientes lentos
+        self.host_outbox_max   = int(self.qs.value("host_outbox_max", 64))
+        self.host_slow_policy  = self.qs.value("host_slow_policy", "drop_oldest", str)   # se valida en _host_start
+        # Modo host: compresión (off | on | shared) y tamaño mínimo para comprimir
+        self.host_deflate          = self.qs.value("host_deflate", "shared", str)
+        self.host_deflate_min_size = int(self.qs.value("host_deflate_min_size", 512))
+        self.host_slow_timeout = float(self.qs.value("host_slow_timeout", 10))
+        # Modo host: métricas Prometheus en http://<host>:8765/metrics
+        self.host_metrics = self.qs.value("host_metrics", True, bool)
+
+        # Imágenes al enviar: lado máximo en px (0 = sin tope), formato (png | jpeg | webp) y calidad (1-100)
+        self.image_max_dim = max(0, int(self.qs.value("image_max_dim", 1920)))
+        self.image_format  = self.qs.value("image_format", "jpeg", str)
+        if self.image_format not in IMAGE_FORMATS:
+            self.image_format = "jpeg"
+        self.image_quality = min(100, max(1, int(self.qs.value("image_quality", 85))))
+
+        # Mensajes recientes en memoria (historial del diálogo): tope de cantidad y de KB
+        self.history_max_msgs = max(1, int(self.qs.value("history_max_msgs", 50)))
+        self.history_max_kb   = max(64, int(self.qs.value("history_max_kb", 1024)))
+
+    def image_policy(self) -> dict:
+        return {"max_dim": self.image_max_dim, "fmt": self.image_format, "quality": self.image_quality}
+
     def save(self):
         self.qs.setValue("server_url", self.server_url)
         self.qs.setValue("user_name",  self.user_name)
+        self.qs.setValue("channel",    self.channel)
         self.qs.setValue("sound_path", self.sound_path)
         self.qs.setValue("sound_send", self.sound_send)
         self.qs.setValue("sound_recive", self.sound_recive)
@@ -119,6 +205,17 @@ class Settings:
         self.qs.setValue("password", self.password)
         self.qs.setValue("host_mode", self.host_mode)
         self.qs.setValue("admin_mode", self.admin_mode)
+        self.qs.setValue("host_outbox_max", self.host_outbox_max)
+        self.qs.setValue("host_slow_policy", self.host_slow_policy)
+        self.qs.setValue("host_slow_timeout", self.host_slow_timeout)
+        self.qs.setValue("host_deflate", self.host_deflate)
+        self.qs.setValue("host_deflate_min_size", self.host_deflate_min_size)
+        self.qs.setValue("host_metrics", self.host_metrics)
+        self.qs.setValue("image_max_dim", self.image_max_dim)
+        self.qs.setValue("image_format", self.image_format)
+        self.qs.setValue("image_quality", self.image_quality)
+        self.qs.setValue("history_max_msgs", self.history_max_msgs)
+        self.qs.setValue("history_max_kb", self.history_max_kb)
         self.qs.sync()
 
     def _sanitize_setting_path(self, val: str, default_basename: str) -> str:
@@ -175,6 +272,9 @@ def prompt_password(correct: str, admin_mode: bool = False) -> bool:
 # ---------- Diálogo elegante de respuesta (ya mejorado) ----------
 class ReplyDialog(QtWidgets.QDialog):
     submitted = QtCore.pyqtSignal(str, list)
+    blob_requested = QtCore.pyqtSignal(str, str)   # hash, nombre: abrir el original de una miniatura
+    encoded = QtCore.pyqtSignal(str, list)          # (hilo de codificación → GUI) texto, adjuntos listos
+    encode_progress = QtCore.pyqtSignal()           # (hilo de codificación → GUI) una imagen más
 
     def eventFilter(self, obj, event):
         if obj is self.input and event.type() == QtCore.QEvent.Type.KeyPress:
@@ -205,12 +305,20 @@ class ReplyDialog(QtWidgets.QDialog):
 
 
 
-    def __init__(self, parent=None, title="Responder", history=None, close_on_send=False):
+    def __init__(self, parent=None, title="Responder", history=None, close_on_send=False, image_policy=None):
         super().__init__(parent)
         self.attachments = []
         self.setAcceptDrops(True)
         self.close_on_send = close_on_send
         self._img_seq = 0 
+        # Las imágenes se reducen/codifican en un hilo (un solo hilo: los envíos salen en orden)
+        self.image_policy = image_policy or {}
+        from concurrent.futures import ThreadPoolExecutor
+        self._encoder = ThreadPoolExecutor(1, thread_name_prefix="fastchat-encode")
+        self._pending = 0                    # envíos esperando al hilo
+        self._img_total = self._img_done = 0
+        self.encoded.connect(self._on_encoded)
+        self.encode_progress.connect(self._on_encode_progress)
 
         QtGui.QShortcut(QtGui.QKeySequence("Ctrl+Return"), self, activated=self._on_send)
         QtGui.QShortcut(QtGui.QKeySequence("Ctrl+Enter"),  self, activated=self._on_send)
@@ -230,6 +338,9 @@ class ReplyDialog(QtWidgets.QDialog):
             QPushButton:hover { background:#343A42; }
             QPushButton#primary { background:#FF9A2D; color:white; }
             QPushButton#primary:hover { background:#FFB41F; }
+            QPushButton:checked { background:#FF9A2D55; }
+            QProgressBar { background:#1A1D21; border:none; border-radius:2px; }
+            QProgressBar::chunk { background:#FF9A2D; border-radius:2px; }
         """)
 
         shadow = QtWidgets.QGraphicsDropShadowEffect(self)
@@ -253,8 +364,11 @@ class ReplyDialog(QtWidgets.QDialog):
         self.history_box.setFixedHeight(200)
         self.history_box.setOpenExternalLinks(False)
         self.history_box.setOpenLinks(False)
-        self.history_box.anchorClicked.connect(lambda url: QtGui.QDesktopServices.openUrl(url))
+        self.history_box.anchorClicked.connect(self._on_anchor)
         self.history_box.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.history_box.setUndoRedoEnabled(False)   # sólo lectura: que los insert no acumulen deshacer
+        self._shown = []    # mensajes en pantalla (las tuplas de last_msgs, por identidad), en orden
+        self._blocks = []   # bloques del documento que ocupa cada uno
         self.history_box.setStyleSheet("""
             /* caja */
             QTextBrowser#history {
@@ -311,10 +425,18 @@ class ReplyDialog(QtWidgets.QDialog):
         send_btn.clicked.connect(self._on_send)
         send_btn.setFixedHeight(50); send_btn.setStyleSheet("font-size:24px;")
 
-        buttons = QtWidgets.QHBoxLayout(); buttons.addWidget(self.input); buttons.addWidget(send_btn)
+        self.original_btn = QtWidgets.QPushButton("HD")
+        self.original_btn.setCheckable(True)
+        self.original_btn.setFixedHeight(50)
+        self.original_btn.setToolTip("Enviar las imágenes originales (PNG, sin reducir)")
+
+        self.progress = QtWidgets.QProgressBar()   # imágenes codificándose
+        self.progress.setTextVisible(False); self.progress.setFixedHeight(4); self.progress.hide()
+
+        buttons = QtWidgets.QHBoxLayout(); buttons.addWidget(self.input); buttons.addWidget(self.original_btn); buttons.addWidget(send_btn)
 
         v = QtWidgets.QVBoxLayout(card); v.setContentsMargins(14,12,12,12); v.setSpacing(12)
-        v.addLayout(header); v.addWidget(self.history_box); v.addLayout(buttons)
+        v.addLayout(header); v.addWidget(self.history_box); v.addWidget(self.progress); v.addLayout(buttons)
 
         
 
@@ -349,15 +471,20 @@ class ReplyDialog(QtWidgets.QDialog):
         e.acceptProposedAction()
 
 
-    def _add_qimage(self, img: QtGui.QImage, name="image.png"):
-        b = _qimage_to_png_bytes(img)
-        self.attachments.append({"name": name, "bytes": b, "mime": "image/png"})
+    def _on_anchor(self, url: QtCore.QUrl):
+        link = url.toString()
+        if link.startswith(BLOB_LINK):   # miniatura: el original todavía no está bajado
+            h, _, name = link[len(BLOB_LINK):].partition("/")
+            self.blob_requested.emit(h, urllib.parse.unquote(name) or "imagen.png")
+        else:
+            QtGui.QDesktopServices.openUrl(url)
 
     def _on_send(self):
-        text = self.input.toPlainText().strip()
+        text = self.input.toPlainText().replace("\ufffc", "").strip()   # U+FFFC: lugar de cada imagen inline
 
+        # 1) Juntar las imágenes inline (la codificación va en un hilo: acá sólo se recolectan)
         doc = self.input.document()
-        img_attachments = []
+        images = []
         block = doc.begin()
         while block.isValid():
             it = block.begin()
@@ -373,26 +500,62 @@ class ReplyDialog(QtWidgets.QDialog):
                             QtCore.QUrl(name)
                         )
                         if isinstance(qimg, QtGui.QImage):
-                            qimg = doc.resource(QtGui.QTextDocument.ResourceType.ImageResource, QtCore.QUrl(name))
-                            b = _qimage_to_png_bytes(qimg)
-                            img_attachments.append({
-                                "type": "image",
-                                "name": name.split("/")[-1] or "image.png",
-                                "mime": "image/png",
-                                "bytes": b,
-                            })
+                            images.append((name.split("/")[-1] or "image.png", qimg))
                 it += 1
             block = block.next()
 
-
-        # 3) Emitir (adjuntos como bytes; quien llama arma base64)
-        if text or img_attachments:
-            self.submitted.emit(text, img_attachments)
-
-        # 4) Limpiar input y reiniciar contador
+        # 2) Limpiar input y reiniciar contador (ya se puede escribir el siguiente)
         self.input.clear()
         self._img_seq = 0
 
+        # 3) Emitir (adjuntos como bytes; quien llama arma base64). Con imágenes, o si hay
+        #    envíos esperando al hilo, pasa por el hilo para no adelantarse a los anteriores.
+        if not (text or images):
+            return
+        if not images and not self._pending:
+            self.submitted.emit(text, [])
+            return
+        policy = {} if self.original_btn.isChecked() else self.image_policy
+        self._pending += 1
+        self._img_total += len(images)
+        self._update_progress()
+        self._encoder.submit(self._encode_job, text, images, policy)
+
+    def _encode_job(self, text, images, policy):
+        # en el hilo de codificación
+        atts = []
+        for name, img in images:
+            try:
+                b, mime, ext = _encode_image(img, **policy)
+                atts.append({"type": "image", "name": pathlib.PurePath(name).stem + ext, "mime": mime, "bytes": b})
+            except Exception as e:
+                print(f"No se pudo preparar la imagen {name}: {e}")
+            self.encode_progress.emit()
+        self.encoded.emit(text, atts)
+
+    def _on_encoded(self, text, atts):
+        self._pending -= 1
+        self._update_progress()
+        if text or atts:
+            self.submitted.emit(text, atts)
+
+    def _on_encode_progress(self):
+        self._img_done += 1
+        self._update_progress()
+
+    def _update_progress(self):
+        if not self._pending:
+            self._img_total = self._img_done = 0
+            self.progress.hide()
+            return
+        self.progress.setRange(0, max(self._img_total, 1))
+        self.progress.setValue(self._img_done)
+        self.progress.show()
+
+    def done(self, r):
+        super().done(r)
+        self._encoder.shutdown(wait=False)   # lo que ya estaba en cola se termina y se envía igual
+
 
     def quit(self):
         inst = QtWidgets.QApplication.instance()
@@ -417,13 +580,100 @@ class ReplyDialog(QtWidgets.QDialog):
         self.move(x, y)
 
     def set_history(self, msgs, max=30):
-        # msgs: list[tuple[str, str_html]]
-        html_hist = "".join(f"<b> - {_esc(s)}: </b> {h}<br>" for s, h in msgs[-max:])
-        self.history_box.setHtml(html_hist)
-        self.history_box.verticalScrollBar().setValue(
-            self.history_box.verticalScrollBar().maximum()
-        )
-        
+        """Muestra los últimos `max` de `msgs` (list[tuple[str, str_html]]).
+
+        Incremental: compara por identidad con lo que ya está en pantalla, agrega
+        al final sólo lo nuevo y reemplaza en su lugar lo que cambió (una imagen
+        que terminó de decodificarse). Lo que sale de la ventana queda arriba
+        hasta juntar `max` y se borra de una vez. El documento entero se rehace
+        sólo si `msgs` no continúa lo mostrado (resync), o si hay que recortar
+        mientras el usuario está leyendo más arriba; si no, el scroll no se mueve.
+        """
+        msgs = msgs[-max:]
+        sb = self.history_box.verticalScrollBar()
+        value, at_bottom = sb.value(), sb.value() >= sb.maximum() - 4
+        off = self._offset(msgs)
+        full = off is not None and off + len(msgs) > 2 * max   # off + len(msgs): lo que quedaría en pantalla
+        if off is None or (full and not at_bottom):
+            self._rebuild(msgs)
+        else:
+            cur = QtGui.QTextCursor(self.history_box.document())
+            cur.beginEditBlock()
+            kept = len(self._shown) - off
+            for i, e in enumerate(msgs[:kept]):
+                if self._shown[off + i] is not e:
+                    self._replace_entry(cur, off + i, e)
+            for e in msgs[kept:]:
+                self._append_entry(cur, e)
+            if full:   # lo que salió de la ventana se borra de a muchos: borrar arriba re-diagrama todo
+                self._drop_head(cur, off)
+            cur.endEditBlock()
+        if at_bottom:
+            self._scroll_to_bottom()
+        else:
+            sb.setValue(value)
+
+    def _offset(self, msgs):
+        # posición en _shown de msgs[0] (o None si no hay cómo continuar lo mostrado)
+        where = {id(e): i for i, e in enumerate(self._shown)}
+        for j, e in enumerate(msgs):
+            if id(e) in where:
+                off = where[id(e)] - j
+                # msgs tiene que cubrir hasta el último mostrado (si no, algo se borró)
+                return off if off >= 0 and len(self._shown) - off <= len(msgs) else None
+        return None
+
+    @staticmethod
+    def _entry_html(entry):
+        s, h = entry
+        return f"<b> - {_esc(s)}: </b> {h}"
+
+    def _append_entry(self, cur, entry):
+        cur.movePosition(QtGui.QTextCursor.MoveOperation.End)
+        if self._shown:
+            cur.insertBlock()
+        first = cur.blockNumber()
+        cur.insertHtml(self._entry_html(entry))
+        self._shown.append(entry)
+        self._blocks.append(cur.blockNumber() - first + 1)
+
+    def _select_entries(self, cur, i, n=1):
+        # selecciona los bloques de los mensajes i..i+n-1 (sin el salto que los separa del resto)
+        doc = self.history_box.document()
+        start = sum(self._blocks[:i])
+        last = doc.findBlockByNumber(start + sum(self._blocks[i:i + n]) - 1)
+        cur.setPosition(doc.findBlockByNumber(start).position())
+        cur.setPosition(last.position() + last.length() - 1, QtGui.QTextCursor.MoveMode.KeepAnchor)
+
+    def _replace_entry(self, cur, i, entry):
+        self._select_entries(cur, i)
+        cur.removeSelectedText()
+        first = cur.blockNumber()
+        cur.insertHtml(self._entry_html(entry))
+        self._shown[i] = entry
+        self._blocks[i] = cur.blockNumber() - first + 1
+
+    def _drop_head(self, cur, n):
+        self._select_entries(cur, 0, n)
+        cur.movePosition(QtGui.QTextCursor.MoveOperation.NextBlock, QtGui.QTextCursor.MoveMode.KeepAnchor)
+        cur.removeSelectedText()
+        del self._shown[:n], self._blocks[:n]
+
+    def _rebuild(self, msgs):
+        self.history_box.clear()
+        self._shown, self._blocks = [], []
+        cur = QtGui.QTextCursor(self.history_box.document())
+        cur.beginEditBlock()
+        for e in msgs:
+            self._append_entry(cur, e)
+        cur.endEditBlock()
+
+    def _scroll_to_bottom(self):
+        sb = self.history_box.verticalScrollBar()
+        sb.setValue(sb.maximum())
+        # el layout del documento puede terminar después: repetir cuando vuelva el loop
+        QtCore.QTimer.singleShot(0, lambda: sb.setValue(sb.maximum()))
+
     def _insert_inline_image(self, img: QtGui.QImage, max_w=320, max_h=220):
         # Tamaño original
         ow, oh = img.width(), img.height()
@@ -464,6 +714,7 @@ class SettingsDialog(QtWidgets.QDialog):
 
         tabs = QtWidgets.QTabWidget()
         tabs.addTab(self._general_tab(), "General")
+        tabs.addTab(self._images_tab(), "Imágenes")
 
         btn_save = QtWidgets.QPushButton("Guardar")
         btn_save.clicked.connect(self._on_save)
@@ -487,6 +738,9 @@ class SettingsDialog(QtWidgets.QDialog):
         self.ed_url.setPlaceholderText("ws://192.168.0.10:8765")
         self.ed_url.setToolTip("Dirección del servidor al que se conectará el cliente.")
         self.ed_user = QtWidgets.QLineEdit(self.settings.user_name)
+        self.ed_channel = QtWidgets.QLineEdit(self.settings.channel)
+        self.ed_channel.setPlaceholderText(DEFAULT_CHANNEL)
+        self.ed_channel.setToolTip("Canal del equipo/sede. Sólo se reciben los mensajes de este canal.")
 
         self.toggleServer = QtWidgets.QCheckBox("Modo Host")
         self.toggleServer.setToolTip("Si está activado, el cliente actuará como servidor con la ip asignada al equipo.")
@@ -500,9 +754,54 @@ class SettingsDialog(QtWidgets.QDialog):
         self.grid.addWidget(self.toggleCliente, 0, 0)
         self.grid.addWidget(self.toggleServer, 0, 1)
 
+        # topes del historial en memoria (MessageBuffer): lo que pase de cualquiera se descarta
+        self.sp_hist_msgs = QtWidgets.QSpinBox()
+        self.sp_hist_msgs.setRange(1, 10000); self.sp_hist_msgs.setSuffix(" mensajes")
+        self.sp_hist_msgs.setValue(self.settings.history_max_msgs)
+        self.sp_hist_kb = QtWidgets.QSpinBox()
+        self.sp_hist_kb.setRange(64, 256 * 1024); self.sp_hist_kb.setSingleStep(256); self.sp_hist_kb.setSuffix(" KB")
+        self.sp_hist_kb.setValue(self.settings.history_max_kb)
+        self.sp_hist_kb.setToolTip("Memoria máxima del HTML del historial. Las imágenes de los mensajes "
+                                   "descartados se borran de la caché.")
+        hist = QtWidgets.QHBoxLayout()
+        hist.addWidget(self.sp_hist_msgs)
+        hist.addWidget(self.sp_hist_kb)
+
         form.addRow("", self.grid)
         form.addRow("Usuario:", self.ed_user)
         form.addRow("Servidor:", self.ed_url)
+        form.addRow("Canal:", self.ed_channel)
+        form.addRow("Historial:", hist)
+
+        w.setLayout(form)
+        return w
+
+    def _images_tab(self):
+        w = QtWidgets.QWidget()
+        form = QtWidgets.QFormLayout()
+        form.setLabelAlignment(QtCore.Qt.AlignmentFlag.AlignRight)
+
+        self.sp_max_dim = QtWidgets.QSpinBox()
+        self.sp_max_dim.setRange(0, 16384); self.sp_max_dim.setSingleStep(160); self.sp_max_dim.setSuffix(" px")
+        self.sp_max_dim.setSpecialValueText("Sin límite")
+        self.sp_max_dim.setValue(self.settings.image_max_dim)
+        self.sp_max_dim.setToolTip("Las imágenes más grandes se reducen a este lado máximo antes de enviarse.")
+
+        self.cb_format = QtWidgets.QComboBox()
+        for key, label in (("jpeg", "JPEG"), ("webp", "WebP"), ("png", "PNG (sin pérdida)")):
+            self.cb_format.addItem(label, key)
+        self.cb_format.setCurrentIndex(max(0, self.cb_format.findData(self.settings.image_format)))
+        self.cb_format.setToolTip("WebP: más chico, pero todos los clientes necesitan el plugin de Qt para verlo.")
+
+        self.sp_quality = QtWidgets.QSpinBox()
+        self.sp_quality.setRange(1, 100)
+        self.sp_quality.setValue(self.settings.image_quality)
+        self.sp_quality.setToolTip("Calidad de JPEG/WebP (no afecta a PNG).")
+
+        form.addRow("Lado máximo:", self.sp_max_dim)
+        form.addRow("Formato:", self.cb_format)
+        form.addRow("Calidad:", self.sp_quality)
+        form.addRow("", QtWidgets.QLabel("El botón HD del chat envía el original."))
 
         w.setLayout(form)
         return w
@@ -511,6 +810,7 @@ class SettingsDialog(QtWidgets.QDialog):
     def _on_save(self):
         url = self.ed_url.text().strip()
         user = self.ed_user.text().strip() or "Usuario"
+        channel = channel_name(self.ed_channel.text())
 
         # Validación mínima
         if not (url.startswith("ws://") or url.startswith("wss://")):
@@ -518,11 +818,22 @@ class SettingsDialog(QtWidgets.QDialog):
                 self, "Dato inválido", "La URL del servidor debe empezar con ws:// o wss://"
             )
             return
+        if channel is None:
+            QtWidgets.QMessageBox.warning(
+                self, "Dato inválido", "El canal sólo puede tener letras, números, espacios, '.', '-' o '_' (hasta 64)."
+            )
+            return
 
         self.settings.server_url = url
         self.settings.user_name = user
+        self.settings.channel = channel
         self.settings.host_mode = self.toggleServer.isChecked()
         self.settings.admin_mode = self.toggleCliente.isChecked()
+        self.settings.image_max_dim = self.sp_max_dim.value()
+        self.settings.image_format = self.cb_format.currentData()
+        self.settings.image_quality = self.sp_quality.value()
+        self.settings.history_max_msgs = self.sp_hist_msgs.value()
+        self.settings.history_max_kb = self.sp_hist_kb.value()
         self.settings.save()
 
         self.saved.emit(self.settings)
@@ -533,7 +844,9 @@ class SettingsDialog(QtWidgets.QDialog):
 
 # ---------- Cliente en bandeja ----------
 class TrayClient(QtWidgets.QSystemTrayIcon):
-    message_received = QtCore.pyqtSignal(str, str)  # from, text
+    messages_received = QtCore.pyqtSignal(list)  # [(from, text), ...]: uno, o los de un frame batch
+    blob_ready = QtCore.pyqtSignal(str)  # original bajado (ruta local) para abrir
+    history_updated = QtCore.pyqtSignal()  # cambió last_msgs (historial o imagen ya decodificada)
 
     def __init__(self, app: QtWidgets.QApplication, settings: Settings):
         self.reply_dialog = None
@@ -552,7 +865,11 @@ class TrayClient(QtWidgets.QSystemTrayIcon):
         self.activated.connect(self._on_tray_activated)
         self.messageClicked.connect(self._on_message_clicked)
 
-        self.last_msgs = []
+        self._images = ImageCache(pathlib.Path(tempfile.gettempdir()) / "FastChat",
+                                  IMAGE_CACHE_MAX, IMAGE_CACHE_AGE)   # hash → archivo local
+        # (remitente, html) recientes; al descartar los viejos se borran sus imágenes de la caché
+        self.last_msgs = MessageBuffer(settings.history_max_msgs, settings.history_max_kb * 1024,
+                                       on_evict=self._drop_images)
 
         # Menú de bandeja
         menu = QtWidgets.QMenu()
@@ -560,13 +877,17 @@ class TrayClient(QtWidgets.QSystemTrayIcon):
         send_action.triggered.connect(self.prompt_and_send)
         cfg_action = menu.addAction("Configurar…")
         cfg_action.triggered.connect(self.open_settings)
+        mem_action = menu.addAction("Uso de memoria…")
+        mem_action.triggered.connect(self._show_memory_usage)
         menu.addSeparator()
         quit_action = menu.addAction("Salir")
         quit_action.triggered.connect(self._quit_app)
         self.setContextMenu(menu)
 
         # Señal de mensaje entrante
-        self.message_received.connect(self._show_notification)
+        self.messages_received.connect(self._show_notifications)
+        self.blob_ready.connect(self._open_file)
+        self.history_updated.connect(self._refresh_history)
 
         self.show()
         # --- buffer de notificaciones para agrupar ráfagas ---
@@ -576,138 +897,87 @@ class TrayClient(QtWidgets.QSystemTrayIcon):
         self._notif_timer.timeout.connect(self._flush_notifications)
         self._notif_cooldown_ms = 400  # ventana de agregación (ms): ajustá 400–1000
 
-        # Hilo WebSocket
+        self._hub = None     # modo host: hub.Hub propio (el mismo motor que servidor.py)
+        self._local = None   # hub.LocalPeer: la bandeja enganchada a su propio hub, sin websocket
+        self._host_history_path = pathlib.Path(tempfile.gettempdir()) / "fastchat.jsonl"
+
+        # Hilo WebSocket (y modo host): recién cuando el ícono ya está en la bandeja
+        self._net_ready = threading.Event()   # loop creado: ya se le pueden mandar corrutinas
         self.ws_thread = threading.Thread(target=self._ws_thread_main, daemon=True)
+        QtCore.QTimer.singleShot(0, self._start_background)
+
+    def _start_background(self):
+        startup_mark("icon")
         self.ws_thread.start()
-        self._host_running = False
-        self._host_clients = set()
-        self._host_history = deque(maxlen=30)
-        self._host_history_path = pathlib.Path(tempfile.gettempdir()) / "fastchat.json"
 
-        # aplicar modo host luego de que el loop esté vivo
-        QtCore.QTimer.singleShot(300, self._apply_host_mode_from_settings)
+    def _submit(self, coro):
+        """Corre `coro` en el loop del hilo de red (esperando a que exista, si recién arrancamos)."""
+        self._net_ready.wait()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
 
-    def _apply_host_mode_from_settings(self):
-        # sincronizamos en el loop asyncio
-        asyncio.run_coroutine_threadsafe(self._host_apply_from_settings(), self.loop)
-    
     async def _host_apply_from_settings(self):
-        if self.settings.host_mode and not self._host_running:
+        if self.settings.host_mode and not self._hub:
             await self._host_start()
-            # si activamos host, conectamos el cliente a localhost
+            # los clientes remotos entran por ws://<esta máquina>:8765; la bandeja se
+            # engancha directo al hub (ver _receiver)
             if not self.settings.server_url.startswith("ws://127.0.0.1"):
                 self.settings.server_url = "ws://127.0.0.1:8765"
                 self.settings.save()
-                await self._force_reconnect()
-        elif not self.settings.host_mode and self._host_running:
+            await self._force_reconnect()
+        elif not self.settings.host_mode and self._hub:
             await self._host_stop()
 
     async def _host_start(self, host="0.0.0.0", port=8765):
-        if self._host_running:
+        if self._hub:
             return
-        # cargar historial desde disco (si existe)
+        from hub import Hub   # el motor del servidor sólo hace falta en modo host
+        from journal import Journal
+        from outbound import POLICIES as SLOW_POLICIES
+        from compression import serve_kwargs as compression_kwargs, MODES as DEFLATE_MODES
+        s = self.settings
+        policy = s.host_slow_policy if s.host_slow_policy in SLOW_POLICIES else "drop_oldest"
+        deflate = s.host_deflate if s.host_deflate in DEFLATE_MODES else "shared"
+        hub = Hub(30, outbox_max=s.host_outbox_max, slow_policy=policy, slow_timeout=s.host_slow_timeout,
+                  deflate=compression_kwargs(deflate, min_size=s.host_deflate_min_size),
+                  metrics_enabled=s.host_metrics, batch_min=4,   # como servidor.py por defecto
+                  accept_rate=500, accept_burst=1000, replays_max=32, log=lambda m: print(f"[Host] {m}"))
+        # cargar historial desde disco (si existe); el diario escribe en segundo plano
+        blobs = BlobStore(pathlib.Path(tempfile.gettempdir()) / "fastchat_blobs")   # mismo directorio que servidor.py
         try:
-            if self._host_history_path.exists():
-                items = json.loads(self._host_history_path.read_text(encoding="utf-8"))
-                for it in items[-30:]:
-                    self._host_history.append(it)
-                print(f"[Host] Historial cargado ({len(self._host_history)} mensajes)")
+            journal = Journal(
+                self._host_history_path, keep=30,
+                legacy_path=self._host_history_path.with_suffix(".json"),
+                log=lambda m: print(f"[Host] {m}"),
+                on_write=hub.metrics.save_history.observe,
+                transform=lambda it: externalize(it, blobs),
+            )
+            # leer el diario y pasar imágenes inline al almacén toca disco: fuera del loop
+            await asyncio.to_thread(hub.open, blobs, journal, self._host_history_path.with_suffix(".epoch"))
+            print(f"[Host] Historial cargado ({len(hub.channels)} mensajes)")
         except Exception as e:
             print(f"[Host] No se pudo cargar historial: {e}")
+            if hub.blobs is None:
+                await asyncio.to_thread(hub.open, blobs)
 
         try:
-            self._host_wsserver = await websockets.serve(
-                self._host_handler, host=host, port=port,
-                ping_interval=20, ping_timeout=20, max_queue=32, close_timeout=5
-            )
-            self._host_running = True
+            await hub.start(host, port)
+            self._hub = hub
             print(f"[Host] Servidor WebSocket en ws://{host}:{port}")
         except OSError as e:
             print(f"[Host] No se pudo iniciar servidor en {port}: {e}")
+            await hub.stop()
             self.settings.host_mode = False
             self.settings.save()
 
     async def _host_stop(self):
-        if not self._host_running:
+        hub, self._hub = self._hub, None
+        if not hub:
             return
         try:
-            self._host_wsserver.close()
-            await self._host_wsserver.wait_closed()
+            await hub.stop()   # también desengancha a la bandeja: _receiver vuelve al websocket
             print("[Host] Servidor detenido")
         except Exception as e:
             print(f"[Host] Error al detener servidor: {e}")
-        finally:
-            self._host_running = False
-            self._host_clients.clear()
-
-    async def _host_handler(self, ws):
-        self._host_clients.add(ws)
-        try:
-            # enviar historial a quien entra
-            if self._host_history:
-                payload = {"type": "history", "items": list(self._host_history)}
-                await self._host_safe_send(ws, json.dumps(payload, ensure_ascii=False))
-
-            async for raw in ws:
-                try:
-                    msg = json.loads(raw)
-                except json.JSONDecodeError:
-                    continue
-
-                text = msg.get("text", "")
-                sender = msg.get("from", "???")
-                attachments = msg.get("attachments", [])
-
-                norm = {
-                    "type": "image" if attachments else "msg",
-                    "from": sender,
-                    "text": text,
-                    "attachments": attachments,
-                    "ts": datetime.datetime.now().isoformat(timespec="seconds"),
-                }
-
-                self._host_history.append(norm)
-                # persistir a disco
-                try:
-                    self._host_history_path.write_text(
-                        json.dumps(list(self._host_history), ensure_ascii=False, indent=2),
-                        encoding="utf-8"
-                    )
-                except Exception as e:
-                    print(f"[Host] No se pudo guardar historial: {e}")
-
-                # broadcast a todos excepto el emisor
-                await self._host_broadcast(norm, sender_ws=ws)
-        finally:
-            self._host_clients.discard(ws)
-
-    async def _host_broadcast(self, msg: dict, sender_ws=None):
-        if not self._host_clients:
-            return
-        data = json.dumps(msg, ensure_ascii=False)
-        dead = []
-        for c in list(self._host_clients):
-            if c is sender_ws:
-                continue
-            ok = await self._host_safe_send(c, data)
-            if not ok:
-                dead.append(c)
-        for d in dead:
-            try:
-                self._host_clients.discard(d)
-            except Exception:
-                pass
-
-    async def _host_safe_send(self, ws, data: str) -> bool:
-        try:
-            await ws.send(data)
-            return True
-        except Exception:
-            try:
-                await ws.close()
-            except Exception:
-                pass
-            return False
 
 
 
@@ -723,24 +993,46 @@ class TrayClient(QtWidgets.QSystemTrayIcon):
             self.setIcon(self.icon_normal)
             self.setToolTip("🗲 FastChat")
 
+    def memory_usage(self) -> dict:
+        """Lo que ocupa el cliente en mensajes recientes y en la caché de imágenes."""
+        return {**self.last_msgs.stats(), "cache_files": len(self._images), "cache_bytes": self._images.nbytes}
+
+    def _show_memory_usage(self):
+        u = self.memory_usage()
+        QtWidgets.QMessageBox.information(
+            None, "FastChat",
+            f"Mensajes en memoria: {u['msgs']} de {u['max_msgs']}\n"
+            f"HTML: {u['bytes'] / 1024:.0f} KB de {u['max_bytes'] / 1024:.0f} KB\n"
+            f"Imágenes referenciadas: {u['images']}\n"
+            f"Caché de imágenes: {u['cache_files']} archivos, {u['cache_bytes'] / 1e6:.1f} MB")
+
+    def _drop_images(self, keys):
+        # desde la GUI o el loop (on_evict de last_msgs): el borrado va al pool
+        self._net_ready.wait()
+        self._decode_pool.submit(self._discard_images, list(keys))
+
+    def _discard_images(self, keys):
+        for k in keys:
+            self._images.discard(k)
+
     def _mark_all_read(self):
         """Resetea contador de no leídos y vuelve a icono normal."""
         self.unread_count = 0
         self._update_tray_icon()
 
     # ---------- Notificaciones ----------
-    def _show_notification(self, sender: str, text: str):
-
+    def _show_notifications(self, notes: list):
+        # una ráfaga (frame batch) llega junta: un solo repintado y un solo sonido
         if self.reply_dialog and self.reply_dialog.isVisible():
             self.reply_dialog.set_history(self.last_msgs)
             play_sound(resolve_asset(self.settings.sound_recive, "recive.wav"), "recive.wav")
             return
 
-        self.unread_count += 1
+        self.unread_count += len(notes)
         self._update_tray_icon()
     
         # self.showMessage("🗲 Nuevo Mensaje", f"{sender}: {text}", self.icon(), self.settings.toast_ms)
-        self._notif_buf.append((sender, text))
+        self._notif_buf.extend(notes)
         # reinicia la ventana de agregación: mientras sigan llegando, no mostramos
         self._notif_timer.start(self._notif_cooldown_ms)
 
@@ -781,7 +1073,7 @@ class TrayClient(QtWidgets.QSystemTrayIcon):
     # ---------- Envío ----------
     def prompt_and_send(self):
         self._mark_all_read()
-        dlg = ReplyDialog(history=self.last_msgs, close_on_send=False)
+        dlg = ReplyDialog(history=self.last_msgs, close_on_send=False, image_policy=self.settings.image_policy())
         self.reply_dialog = dlg
 
         def send_and_append(text, attachments):
@@ -789,39 +1081,47 @@ class TrayClient(QtWidgets.QSystemTrayIcon):
                 "from": self.settings.user_name,
                 "type": "msg" if text else "image",
                 "text": text,
+                "channel": self.settings.channel,
+                # bytes crudos: la cola de envío los sube por partes (o binario/base64 según la conexión)
                 "attachments": [
-                    {"type":"image","name":a["name"],"mime":a["mime"],
-                    "data": base64.b64encode(a["bytes"]).decode("ascii")}
+                    {"type":"image","name":a["name"],"mime":a["mime"],"bytes":a["bytes"]}
                     for a in attachments
                 ]
             }
-            asyncio.run_coroutine_threadsafe(self._send_ws_payload(payload), self.loop)
-
-            # --- construir HTML para historial ---
-            html_parts = []
-            if text:
-                html_parts.append(_esc(text))
-            for a in attachments:
-                try:
-                    fname = a.get("name", "imagen.png")
-                    fpath = _save_temp_image(a["bytes"], fname)              # guarda a %TEMP%/FastChat
-                    html_parts.append(_thumb_html_for_file(fpath, fname))    # miniatura clickeable
-                except Exception:
-                    pass
-            shown_html = "<br>".join(html_parts) if html_parts else _esc("")
-
-
-            self.last_msgs.append((self.settings.user_name, shown_html))
+            self._submit(self._send_ws_payload(payload))
+
+            # --- historial: las miniaturas se escriben a la caché en el pool, no acá ---
+            head = [_esc(text)] if text else []
+            entry = (self.settings.user_name, "<br>".join(head + [LOADING_HTML] * bool(attachments)) or _esc(""))
+            self.last_msgs.append(entry)
+            if attachments:
+                self._submit(self._finish_own_entry(entry, head, [(a["bytes"], a.get("name", "imagen.png"))
+                                                                  for a in attachments]))
             dlg.set_history(self.last_msgs)
             play_sound(resolve_asset(self.settings.sound_send, "send.wav"), "send.wav")
 
 
         dlg.submitted.connect(send_and_append)
+        dlg.blob_requested.connect(self._open_blob)
         dlg.exec()
 
         
 
 
+    def _refresh_history(self):
+        if self.reply_dialog and self.reply_dialog.isVisible():
+            self.reply_dialog.set_history(self.last_msgs)
+
+    def _open_blob(self, h: str, name: str):
+        # click en una miniatura: bajar el original (una sola vez) y abrirlo
+        fut = self._submit(self._blob_path(h, name))
+        fut.add_done_callback(lambda f: self.blob_ready.emit(
+            (f.result() or "") if not f.cancelled() and not f.exception() else ""))
+
+    def _open_file(self, path: str):
+        if path:
+            QtGui.QDesktopServices.openUrl(QtCore.QUrl.fromLocalFile(path))
+
     # ---------- Configuración ----------
     def open_settings(self):
         if not prompt_password(self.settings.password, self.settings.admin_mode):
@@ -835,13 +1135,14 @@ class TrayClient(QtWidgets.QSystemTrayIcon):
             self.icon_normal = safe_qicon(self.settings.icon_path, "icon.ico", self.app)
             self.icon_unread = safe_qicon(self.settings.icon_unread, "icon_unread.ico", self.app)
             self._update_tray_icon()
-            asyncio.run_coroutine_threadsafe(self._force_reconnect(), self.loop)
+            self.last_msgs.resize(st.history_max_msgs, st.history_max_kb * 1024)
+            self._submit(self._force_reconnect())
             if self.settings.host_mode and not self.settings.server_url.startswith("ws://127.0.0.1"):
                 self.settings.server_url = "ws://127.0.0.1:8765"
                 self.settings.save()
-                asyncio.run_coroutine_threadsafe(self._force_reconnect(), self.loop)
+                self._submit(self._force_reconnect())
             else:
-                asyncio.run_coroutine_threadsafe(self._force_reconnect(), self.loop)
+                self._submit(self._force_reconnect())
 
         dlg.saved.connect(apply_and_refresh)
         dlg.exec()
@@ -855,123 +1156,428 @@ class TrayClient(QtWidgets.QSystemTrayIcon):
 
     # ---------- WebSocket ----------
     async def _send_ws(self, text: str):
-        try:
-            if self.ws:
-                await self.ws.send(json.dumps(
-                    {"from": self.settings.user_name, "text": text},
-                    ensure_ascii=False
-                ))
-            else:
-                print("⚠️ No hay conexión WebSocket activa")
-        except Exception as e:
-            print(f"Error al enviar: {e}")
+        await self._send_ws_payload({"from": self.settings.user_name, "text": text,
+                                     "channel": self.settings.channel})
 
 
     async def _receiver(self):
-        backoff = 1
+        backoff = Backoff(RECONNECT_BASE, RECONNECT_MAX)
         while True:
+            up, floor = None, None
             try:
-                async with websockets.connect(self.settings.server_url, ping_interval=20, ping_timeout=20) as ws:
+                if self._hub:   # modo host: directo al hub propio, sin websocket ni JSON
+                    await self._receive_local(self._hub)
+                    backoff.reset()
+                    continue
+                # reanudación: pedimos sólo lo posterior al último seq visto en ESTE servidor y canal
+                if self._seq_url != (self.settings.server_url, self.settings.channel):
+                    self._seq_url, self._last_seq, self._epoch = (self.settings.server_url, self.settings.channel), 0, None
+                url = resume_url(self.settings.server_url, self._last_seq, self._epoch, self.settings.channel,
+                                 batch=True)
+                self._reconnect_now = False
+                async with websockets.connect(url, ping_interval=20, ping_timeout=20,
+                                              subprotocols=[BINARY_SUBPROTOCOL]) as ws:
                     self.ws = ws
-                    backoff = 1
+                    up = time.monotonic()
+                    startup_mark("connect")
+                    self._acks = True if acks_advertised(ws) else None
+                    self._resend()
 
                     async for raw in ws:
+                        if isinstance(raw, bytes):
+                            continue   # binarios sólo llegan como respuesta a pedidos que no hacemos acá
                         try:
-                            msg = json.loads(raw)
-                        except json.JSONDecodeError:
+                            msg = loads(raw)
+                        except DecodeError:
                             continue
+                        await self._handle_incoming(msg)
+                if self._reconnect_now:   # la cerramos nosotros (cambio de configuración): volver ya
+                    continue
 
-                        mtype = msg.get("type", "msg")
-
-                        # --- reconstrucción de historial al conectar/reconectar ---
-                        if mtype == "history":
-                            items = msg.get("items", [])
-                            self.last_msgs = []  # limpiar SOLO cuando llega history
-
-                            for it in items:
-                                sender = it.get("from", "???")
-                                text   = it.get("text", "")
-                                atts   = it.get("attachments", [])
-
-                                parts = []
-                                if text:
-                                    parts.append(_esc(text))
-
-                                for a in atts:
-                                    if a.get("type") == "image" and a.get("data"):
-                                        try:
-                                            b     = base64.b64decode(a["data"])
-                                            fname = a.get("name", "imagen.png")
-                                            fpath = _save_temp_image(b, fname)               # guarda en %TEMP%/FastChat
-                                            parts.append(_thumb_html_for_file(fpath, fname))  # miniatura clickeable
-                                        except Exception:
-                                            pass
-
-                                shown_html = "<br>".join(parts) if parts else _esc(text)
-                                self.last_msgs.append((sender, shown_html))
-                                if len(self.last_msgs) > 50:
-                                    self.last_msgs.pop(0)
-
-                            # refrescar diálogo si está abierto
-                            if self.reply_dialog and self.reply_dialog.isVisible():
-                                self.reply_dialog.set_history(self.last_msgs)
-                            continue  # no toasts para history
-
-                        # --- mensajes en vivo ---
-                        if msg.get("type") == "image" or msg.get("attachments"):
-                            sender = msg.get("from", "???")
-                            parts = []
-                            txt = msg.get("text", "")
-                            if txt:
-                                parts.append(_esc(txt))
-
-                            for a in msg.get("attachments", []):
-                                if a.get("type") == "image" and a.get("data"):
-                                    try:
-                                        b     = base64.b64decode(a["data"])
-                                        fname = a.get("name", "imagen.png")
-                                        fpath = _save_temp_image(b, fname)
-                                        parts.append(_thumb_html_for_file(fpath, fname))
-                                    except Exception:
-                                        pass
-
-                            shown_html = "<br>".join(parts) if parts else _esc("📷 imagen")
-                            self.last_msgs.append((sender, shown_html))
-                            self.message_received.emit(sender, "[imagen]")  # sonido/toast
-                        else:
-                            sender = msg.get("from", "???")
-                            text = msg.get("text", "")
-                            self.last_msgs.append((sender, _esc(text)))
-                            self.message_received.emit(sender, text)
-
-            except Exception:
-                await asyncio.sleep(backoff)
-                backoff = min(backoff * 2, 10)
+            except Exception as e:
+                floor = retry_after(e)   # servidor saturado: cerró con 1013 y cuánto esperar
+            # también si el servidor cerró bien (reinicio): con jitter, para no volver todos juntos
+            if up is not None and time.monotonic() - up > RECONNECT_STABLE:
+                backoff.reset()
+            await asyncio.sleep(backoff.next(floor))
+
+    async def _receive_local(self, hub):
+        self._local = peer = hub.attach_local(self.settings.channel)
+        startup_mark("connect")
+        self._send_wake.set()   # lo que quedó en la cola de envío mientras no había par
+        try:
+            while (msg := await peer.get()) is not None:   # None: el hub se detuvo o reconectamos
+                await self._handle_incoming(msg)
+        finally:
+            self._local = None
+            peer.close()
+
+    async def _handle_incoming(self, msg: dict, notes: list | None = None):
+        mtype = msg.get("type", "msg")
+
+        # --- ráfaga: varios mensajes en un frame, un solo aviso al final ---
+        if mtype == "batch":
+            notes = []
+            for it in msg.get("items", []):
+                if isinstance(it, dict) and it.get("type") != "batch":
+                    await self._handle_incoming(it, notes)
+            prev = self._render_tail
+            if prev is None or prev.done():
+                if notes:
+                    self.messages_received.emit(notes)
+            else:   # quedan imágenes decodificándose: avisar cuando termine la última
+                self._render_tail = asyncio.ensure_future(self._notify_after(prev, notes))
+            return
 
+        # --- reconstrucción de historial al conectar/reconectar ---
+        if mtype == "history":
+            items = msg.get("items", [])
+            if not msg.get("delta"):
+                self.last_msgs.clear()  # limpiar SOLO con historial completo (resync)
+            self._epoch = msg.get("epoch", self._epoch)
+            self._last_seq = max([self._last_seq, msg.get("last_seq", 0)] +
+                                 [it.get("seq", 0) for it in items])
+
+            for it in items:
+                if it.get("id") in self._unacked:   # nuestro: publicado aunque el ack se perdió
+                    self._acked(it["id"])
+                    if msg.get("delta"):
+                        continue   # ya está en last_msgs desde que se mandó
+                self._add_entry(it.get("from", "???"), it.get("text", ""), it.get("attachments", []))
+
+            # refrescar diálogo si está abierto
+            self.history_updated.emit()
+            return  # no toasts para history
+
+        if mtype == "upload":   # respuesta a un paso de subida por partes
+            fut = self._upload_waiters.get(msg.get("upload"))
+            if fut and not fut.done():
+                fut.set_result(msg)
+            return
+        if mtype == "ack":   # nuestro mensaje ya tiene seq: no pedirlo al reanudar
+            self._acks = True
+            self._last_seq = max(self._last_seq, msg.get("seq", 0))
+            self._acked(msg.get("id"))
+            return
+        if mtype == "error" and msg.get("id") in self._unacked:
+            print(f"Mensaje rechazado por el servidor: {msg.get('error')}")
+            self._acked(msg["id"])
+            return
+        if mtype not in ("msg", "image"):
+            return  # respuestas de control (p.ej. "blob") no son mensajes
+        self._last_seq = max(self._last_seq, msg.get("seq", 0))
+
+        # --- mensajes en vivo ---
+        sender = msg.get("from", "???")
+        text = msg.get("text", "")
+        if msg.get("type") == "image" or msg.get("attachments"):
+            self._add_entry(sender, text, msg.get("attachments", []), notify="[imagen]",
+                            empty=_esc("📷 imagen"), notes=notes)   # sonido/toast
+        else:
+            self._add_entry(sender, text, [], notify=text, notes=notes)
+
+    def _add_entry(self, sender: str, text: str, atts, notify: str | None = None, empty: str | None = None,
+                   notes: list | None = None):
+        """Agrega un mensaje a `last_msgs` en su lugar, ya mismo.
+
+        Las imágenes se decodifican/bajan en el pool (`_attachments_html`) y
+        reemplazan al marcador LOADING_HTML cuando están listas. El aviso
+        (`notify`, toast y sonido) sale en orden de llegada: cada mensaje
+        espera al anterior, aunque sus imágenes se decodifiquen a la vez.
+        Con `notes` (mensajes de un frame batch) el aviso se junta ahí en vez de salir.
+        """
+        images = [a for a in atts or [] if isinstance(a, dict) and a.get("type") == "image"]
+        head = [_esc(text)] if text else []
+        entry = (sender, "<br>".join(head + [LOADING_HTML] * bool(images)) or (empty or _esc(text)))
+        self.last_msgs.append(entry)
+        prev = self._render_tail
+        if not images and (prev is None or prev.done()):
+            if notify is not None:
+                self._notify(entry[0], notify, notes)
+            return
+        self._render_tail = asyncio.ensure_future(self._finish_entry(entry, head, images, notify, empty, prev, notes))
 
+    def _notify(self, sender, text, notes=None):
+        if notes is None:
+            self.messages_received.emit([(sender, text)])
+        else:
+            notes.append((sender, text))
+
+    async def _notify_after(self, prev, notes):
+        await asyncio.wait([prev])
+        if notes:
+            self.messages_received.emit(notes)
+
+    async def _finish_entry(self, entry, head, images, notify, empty, prev, notes=None):
+        parts = await self._attachments_html(images) if images else []
+        if prev is not None:
+            await asyncio.wait([prev])   # orden de llegada (sin propagar errores del anterior)
+        if images:
+            shown_html = "<br>".join(head + parts) or (empty or _esc(""))
+            # si hubo resync o ya salió del buffer, no hay nada que reemplazar
+            self.last_msgs.replace(entry, (entry[0], shown_html))
+        if notify is not None:
+            self._notify(entry[0], notify, notes)
+        elif images:
+            self.history_updated.emit()
+
+    async def _finish_own_entry(self, entry, head, images):
+        """Miniaturas de un mensaje propio: escribe `images` [(bytes, nombre)] a la caché
+        en el pool y reemplaza el marcador LOADING_HTML de `entry`."""
+        parts = []
+        for data, fname in images:
+            try:
+                fpath = await self._in_pool(self._images.put_bytes, data, fname)   # caché en %TEMP%/FastChat
+                parts.append(_thumb_html_for_file(fpath, fname))                     # miniatura clickeable
+            except Exception:
+                pass
+        self.last_msgs.replace(entry, (entry[0], "<br>".join(head + parts) or _esc("")))
+        self.history_updated.emit()
+
+    def _in_pool(self, fn, *args):
+        return self.loop.run_in_executor(self._decode_pool, fn, *args)
+
+    async def _attachments_html(self, atts) -> list:
+        """Miniaturas de los adjuntos: la que manda el servidor, inline (base64 viejo) o por hash,
+        bajando el blob sólo si falta. Todas a la vez en el pool; el resultado respeta el orden."""
+        imgs = [a for a in atts if isinstance(a, dict) and a.get("type") == "image"]
+        parts = await asyncio.gather(*(self._attachment_html(a) for a in imgs), return_exceptions=True)
+        return [p for p in parts if isinstance(p, str)]
+
+    async def _attachment_html(self, a: dict) -> str | None:
+        fname = a.get("name", "imagen.png")
+        if a.get("thumb") and a.get("hash"):
+            # miniatura del servidor: el original se baja recién si el usuario lo abre
+            key = a["hash"] + "-mini"
+            tpath = await self._in_pool(self._images.get, key) or await self._in_pool(
+                _cache_b64_image, self._images, a["thumb"], "mini.jpg", key)
+            link = f"{BLOB_LINK}{a['hash']}/{urllib.parse.quote(fname)}"
+            return _thumb_html_for_file(tpath, fname, href=link)
+        if a.get("data"):
+            fpath = await self._in_pool(_cache_b64_image, self._images, a["data"], fname)
+        elif a.get("hash"):
+            fpath = await self._blob_path(a["hash"], fname)
+        else:
+            return None
+        return _thumb_html_for_file(fpath, fname) if fpath else None
+
+    async def _blob_path(self, h: str, name: str) -> str | None:
+        path = await self._in_pool(self._images.get, h)   # get() toca el disco (y espera al índice)
+        if path:
+            return path   # ya lo tenemos: no se vuelve a pedir ni a escribir
+        if self._hub:   # modo host: el blob ya está en el disco propio
+            b = await self._in_pool(self._hub.blobs.read, h)
+        else:
+            b = await self._in_pool(_http_get_blob, self.settings.server_url, h)
+        if b is None:
+            return None
+        return await self._in_pool(self._images.put, h, b, name)
 
     async def _force_reconnect(self):
+        self._reconnect_now = True
+        if self._local:
+            self._local.close()
         try:
-            if self.ws and self.ws.open:
+            if self.ws:
                 await self.ws.close(code=1000, reason="config change")
         except Exception:
             pass
         # El loop _receiver volverá a conectar con la nueva URL
     
+    async def _upload(self, raw: bytes, name: str, mime: str) -> dict | None:
+        """Sube `raw` por partes (upload_begin/chunk/commit) y devuelve la referencia {hash, ...}.
+
+        Si la conexión se corta, espera a que `_receiver` reconecte y sigue desde el
+        offset que confirma el servidor. None si el servidor no soporta subidas por partes.
+        """
+        from uploads import UPLOAD_CHUNK, UploadError
+        uid = os.urandom(16).hex()
+        size, mv = len(raw), memoryview(raw)
+        answered = False   # el servidor contestó alguna vez (soporta el protocolo)
+        deadline = time.monotonic() + 300
+        while time.monotonic() < deadline:
+            ws = self.ws
+            if ws is None:
+                await asyncio.sleep(0.5)
+                continue
+            try:
+                r = await self._upload_step(ws, {"type": "upload_begin", "upload": uid, "size": size})
+                answered = True
+                off = r["offset"]
+                while off < size:
+                    r = await self._upload_step(ws, {"type": "upload_chunk", "upload": uid, "offset": off},
+                                                mv[off:off + UPLOAD_CHUNK])
+                    off = r["offset"]
+                r = await self._upload_step(ws, {"type": "upload_commit", "upload": uid})
+                return {"type": "image", "hash": r["hash"], "name": name, "mime": mime, "size": r["size"]}
+            except asyncio.TimeoutError:
+                if not answered:
+                    return None   # servidor viejo: se manda inline
+                await asyncio.sleep(1)
+            except UploadError as e:
+                print(f"Subida rechazada por el servidor: {e}")
+                return None
+            except (websockets.ConnectionClosed, OSError):
+                while self.ws is ws:   # esperar la reconexión y retomar
+                    await asyncio.sleep(0.5)
+        return None
+
+    async def _upload_step(self, ws, msg: dict, chunk=None, timeout=15) -> dict:
+        from uploads import UploadError
+        fut = self.loop.create_future()
+        self._upload_waiters[msg["upload"]] = fut
+        try:
+            async with self._send_lock:   # un trozo por vez: los mensajes de texto pasan entre trozos
+                if chunk is None:
+                    await ws.send(dumps(msg), text=True)
+                elif is_binary(ws):
+                    await ws.send(dumps({**msg, "binary": 1}), text=True)
+                    await ws.send(chunk)
+                else:
+                    await ws.send(dumps({**msg, "data": base64.b64encode(chunk).decode("ascii")}), text=True)
+            r = await asyncio.wait_for(fut, timeout)
+        finally:
+            self._upload_waiters.pop(msg["upload"], None)
+        if "error" in r:
+            raise UploadError(r["error"])
+        return r
+
+    # ---------- Cola de envío ----------
     async def _send_ws_payload(self, payload: dict):
-        if self.ws:
-            await self.ws.send(json.dumps(payload, ensure_ascii=False))
+        """Encola `payload` para mandarlo (vuelve enseguida; el envío lo hace `_sender`)."""
+        mid = os.urandom(16).hex()   # el servidor confirma con este id y descarta reenvíos repetidos
+        self._unacked[mid] = payload = {**payload, "id": mid}
+        if not self._local and any(a.get("bytes") for a in payload.get("attachments") or []):
+            self._uploading.add(mid)   # los mensajes de texto que siguen no esperan a la subida
+            self.loop.create_task(self._prepare(mid, payload))
+        self._send_wake.set()
+
+    async def _prepare(self, mid, payload: dict):
+        # adjuntos primero, por partes; el mensaje (que los anuncia) sale recién al final.
+        # La referencia reemplaza a los bytes en el payload: un reenvío no vuelve a subir
+        try:
+            for a in payload.get("attachments") or []:
+                if a.get("bytes"):
+                    ref = await self._upload(a["bytes"], a.get("name", "imagen.png"), a.get("mime", "image/png"))
+                    if ref:
+                        a.clear()
+                        a.update(ref)
+        finally:
+            self._uploading.discard(mid)
+            self._send_wake.set()
+
+    async def _sender(self):
+        """Manda la cola `_unacked` en orden sin esperar cada ack (hasta SEND_WINDOW en vuelo).
+
+        Cada mensaje sale de la cola recién con su ack; al reconectar (`_resend`)
+        se vuelve a mandar todo lo no confirmado. Sin conexión, espera. Con un
+        servidor sin acks (`_acks` False) cada mensaje sale de la cola al mandarlo.
+        """
+        while True:
+            mid = next((m for m in self._unacked if m not in self._inflight and m not in self._uploading), None)
+            ws, local = self.ws, self._local
+            if mid is None or not (ws or local) or len(self._inflight) >= SEND_WINDOW:
+                self._send_wake.clear()
+                await self._send_wake.wait()
+                continue
+            payload = self._unacked[mid]
+            if local:   # modo host: el dict (con los bytes crudos) va directo al hub, que contesta al publicar
+                try:
+                    await local.send(payload)
+                except Exception as e:
+                    print(f"Error al enviar: {e}")
+                self._unacked.pop(mid, None)
+                continue
+            self._inflight[mid] = None
+            try:
+                await self._transmit(ws, payload)
+            except (websockets.ConnectionClosed, OSError):
+                while self.ws is ws:   # se reenvía cuando _receiver reconecte
+                    await asyncio.sleep(0.5)
+            except Exception as e:
+                print(f"Error al enviar: {e}")
+                self._acked(mid)   # no se va a poder mandar nunca: no trabar la cola
+            else:
+                if self._acks is False:   # no va a llegar ack: mandado es entregado
+                    self._acked(mid)
+                elif self._acks is None and len(self._inflight) == 1:
+                    self.loop.create_task(self._probe_acks(ws))
+
+    async def _probe_acks(self, ws):
+        # el servidor no anunció acks: si no confirma nada en ACK_TIMEOUT, es uno viejo que
+        # nunca lo va a hacer (la ventana se trabaría y cada reconexión reenviaría todo)
+        await asyncio.sleep(ACK_TIMEOUT)
+        if self.ws is ws and self._acks is None and self._inflight:
+            print("El servidor no confirma los mensajes: se envían sin esperar confirmación")
+            self._acks = False
+            for mid in list(self._inflight):
+                self._acked(mid)
+
+    def _acked(self, mid):
+        """Saca de la cola un mensaje confirmado. Sin id (servidor viejo): el más viejo en vuelo."""
+        if mid is None:
+            mid = next(iter(self._inflight), None)
+        if self._unacked.pop(mid, None) is not None:
+            self._inflight.pop(mid, None)
+            self._send_wake.set()
+
+    def _resend(self):
+        # conexión nueva: nada de lo anterior llegó confirmado por ella
+        self._inflight.clear()
+        if self._unacked:
+            print(f"Reenviando {len(self._unacked)} mensajes sin confirmar")
+        self._send_wake.set()
+
+    async def _transmit(self, ws, payload: dict):
+        # adjuntos que no se pudieron subir por partes (servidor viejo): van con el mensaje
+        atts = payload.get("attachments") or []
+        raws = [a["bytes"] for a in atts if "bytes" in a]
+        metas = [{k: v for k, v in a.items() if k != "bytes"} for a in atts]
+        async with self._send_lock:   # encabezado + binarios no se intercalan con otro envío
+            if raws and is_binary(ws):
+                header = {**payload, "attachments": metas, "binary": len(raws)}
+                await ws.send(dumps(header), text=True)
+                for b in raws:
+                    await ws.send(b)
+                return
+            for m, a in zip(metas, atts):
+                if "bytes" in a:
+                    m["data"] = base64.b64encode(a["bytes"]).decode("ascii")
+            await ws.send(dumps({**payload, "attachments": metas}), text=True)
 
 
     def _ws_thread_main(self):
+        _import_network()   # acá y no al importar cliente.py: el ícono ya está visible
+        from concurrent.futures import ThreadPoolExecutor
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
         self.ws = None
+        self._send_lock = asyncio.Lock()
+        self._upload_waiters = {}   # id de subida -> Future con la respuesta del servidor
+        # cola de envío: id -> payload, en orden; cada uno sale con su ack (o se reenvía al reconectar)
+        self._unacked = {}
+        self._inflight = {}      # ids ya mandados por la conexión actual, en el orden en que salieron
+        self._acks = None        # el servidor confirma: True / False (viejo) / None (todavía no se sabe)
+        self._uploading = set()  # ids con adjuntos subiéndose por partes (todavía no se mandan)
+        self._send_wake = asyncio.Event()
+        self._seq_url, self._last_seq, self._epoch = None, 0, None   # reanudación por delta
+        self._reconnect_now = False   # _force_reconnect: reconectar sin esperar el backoff
+        # adjuntos: decodificar y escribir a disco fuera del loop (pings y envíos no esperan)
+        self._decode_pool = ThreadPoolExecutor(DECODE_WORKERS, thread_name_prefix="fastchat-decode")
+        self._render_tail = None   # último mensaje esperando sus imágenes (orden de los avisos)
+        self.loop.create_task(self._host_apply_from_settings())
         self.loop.create_task(self._receiver())
+        self.loop.create_task(self._sender())
+        # indexar la caché de imágenes en el pool: ni en el hilo de la GUI ni antes de
+        # conectar. Todo acceso a la caché pasa por el pool (_in_pool): un get() que
+        # llega durante el escaneo espera ahí, no en el loop
+        self._in_pool(self._images.load)
+        self._net_ready.set()
         self.loop.run_forever()
 
 # ---------- Main ----------
 def main():
+    startup_mark("import")
     app = QtWidgets.QApplication(sys.argv)
     app.setQuitOnLastWindowClosed(False)
     settings = Settings()
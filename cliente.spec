@@ -1,4 +1,9 @@
 # -*- mode: python ; coding: utf-8 -*-
+# pyinstaller cliente.spec                      → dist/cliente.exe (un solo archivo; se desempaqueta en %TEMP% en cada arranque)
+# set FASTCHAT_ONEDIR=1 && pyinstaller cliente.spec → dist/cliente/cliente.exe (carpeta: arranca sin desempaquetar ni UPX)
+import os
+
+ONEDIR = os.environ.get("FASTCHAT_ONEDIR", "0") != "0"
 
 
 a = Analysis(
@@ -16,24 +21,53 @@ a = Analysis(
 )
 pyz = PYZ(a.pure)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.datas,
-    [],
-    name='cliente',
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=False,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-    icon=['icon.ico'],
-)
+if ONEDIR:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        [],
+        exclude_binaries=True,
+        name='cliente',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=False,   # UPX obliga a descomprimir cada DLL al cargarla (y los antivirus las re-escanean)
+        console=False,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+        icon=['icon.ico'],
+    )
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        name='cliente',
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.datas,
+        [],
+        name='cliente',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=True,
+        upx_exclude=[],
+        runtime_tmpdir=None,
+        console=False,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+        icon=['icon.ico'],
+    )
@@ -0,0 +1,76 @@
+# codec.py — JSON del protocolo (frames, diario, base, bus entre procesos)
+#
+# Un solo lugar para serializar: orjson o msgspec si están instalados, si no el
+# json de la biblioteca estándar. FASTCHAT_JSON=orjson|msgspec|json fuerza uno
+# (auto por defecto). Todos producen lo mismo:
+#   dumps(obj) → bytes UTF-8 compactos, sin escapar lo que no es ASCII: se
+#                mandan tal cual como frame de texto, sin pasar por str;
+#   loads(x)   → acepta bytes o str; los errores son siempre ValueError
+#                (DecodeError).
+# Lo que el backend rápido no sabe escribir (enteros de más de 64 bits, claves
+# que no son str) sale por el json estándar, no falla; al leerlo, orjson trae
+# esos enteros como float.
+import json, logging, os
+
+BACKENDS = ("orjson", "msgspec", "json")
+DecodeError = ValueError   # json.JSONDecodeError, orjson.JSONDecodeError y msgspec.DecodeError lo son
+
+
+# armados una vez: json.dumps/json.loads con argumentos crean un JSONEncoder por
+# llamada, y json.loads(bytes) además adivina la codificación
+_std_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+_std_decode = json.JSONDecoder().decode
+
+
+def _std_dumps(obj) -> bytes:
+    try:
+        return _std_encode(obj).encode("utf-8")
+    except UnicodeEncodeError:   # surrogates sueltos (de un cliente): escapados, el frame sigue siendo UTF-8 válido
+        return json.dumps(obj, separators=(",", ":")).encode("ascii")
+
+
+def _std_loads(data):
+    return _std_decode(data.decode("utf-8") if isinstance(data, (bytes, bytearray)) else data)
+
+
+def backend(name: str):
+    """(dumps, loads) de `name`; ImportError si no está instalado."""
+    if name == "orjson":
+        import orjson
+        fast = orjson.dumps
+
+        def dumps(obj) -> bytes:
+            try:
+                return fast(obj)
+            except TypeError:
+                return _std_dumps(obj)
+        return dumps, orjson.loads
+    if name == "msgspec":
+        import msgspec
+        fast = msgspec.json.Encoder().encode
+
+        def dumps(obj) -> bytes:
+            try:
+                return fast(obj)
+            except (TypeError, ValueError):
+                return _std_dumps(obj)
+        return dumps, msgspec.json.Decoder().decode
+    if name == "json":
+        return _std_dumps, _std_loads
+    raise ValueError(f"codec JSON desconocido: {name!r} (usar {', '.join(BACKENDS)})")
+
+
+def _pick(pref: str):
+    names = (pref,) if pref in BACKENDS else BACKENDS
+    if pref not in BACKENDS + ("auto",):
+        logging.warning(f"FASTCHAT_JSON={pref!r} no reconocido; se elige solo")
+    for name in names:
+        try:
+            return (name, *backend(name))
+        except ImportError:
+            if name == pref:
+                logging.warning(f"FASTCHAT_JSON={name}: no está instalado, se usa json")
+    return ("json", *backend("json"))
+
+
+NAME, dumps, loads = _pick(os.environ.get("FASTCHAT_JSON", "auto").strip().lower())
@@ -0,0 +1,129 @@
+# compression.py — permessage-deflate ajustable y frames comprimidos compartidos
+#
+# Modos (FASTCHAT_DEFLATE en el servidor, host_deflate en el modo host):
+#   off     → sin compresión
+#   on      → deflate por conexión (con context takeover), salteando frames chicos
+#   shared  → sin context takeover del lado del servidor: el mismo mensaje produce
+#             los mismos bytes comprimidos para todos, así que se comprime UNA vez
+#             por broadcast/historial y el resultado se reusa en cada conexión.
+# En todos los modos los frames de menos de `min_size` bytes y los binarios
+# (imágenes ya comprimidas) se mandan sin comprimir; RFC 7692 lo permite por mensaje.
+import zlib
+from collections import OrderedDict
+from websockets import frames
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate, ServerPerMessageDeflateFactory,
+)
+
+MODES = ("off", "on", "shared")
+
+
+class _SharedCache:
+    """Últimos payloads comprimidos, indexados por los bytes originales.
+
+    El broadcast encola el MISMO objeto bytes en todas las conexiones, así que
+    la búsqueda es un hash ya cacheado por Python + comparación por identidad.
+    """
+
+    def __init__(self, max_items=32, max_bytes=8 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._d = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        v = self._d.get(key)
+        if v is not None:
+            self.hits += 1
+            self._d.move_to_end(key)
+        return v
+
+    def put(self, key, value):
+        self.misses += 1
+        if len(key) > self.max_bytes:
+            return
+        self._d[key] = value
+        self._bytes += len(key) + len(value)
+        while len(self._d) > self.max_items or self._bytes > self.max_bytes:
+            k, v = self._d.popitem(last=False)
+            self._bytes -= len(k) + len(v)
+
+
+class TunedPerMessageDeflate(PerMessageDeflate):
+    """PerMessageDeflate con umbral mínimo, sin comprimir binarios y caché compartido."""
+
+    def __init__(self, *args, min_size=512, compress_binary=False, cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self.compress_binary = compress_binary
+        # el caché sólo es válido si cada mensaje se comprime desde cero
+        self.cache = cache if self.local_no_context_takeover else None
+        self._raw_cont = False   # el mensaje fragmentado en curso va sin comprimir
+
+    def encode(self, frame: frames.Frame) -> frames.Frame:
+        if frame.opcode in frames.CTRL_OPCODES:
+            return frame
+        if frame.opcode is frames.OP_CONT:
+            if self._raw_cont:
+                if frame.fin:
+                    self._raw_cont = False
+                return frame
+            return super().encode(frame)
+
+        if (len(frame.data) < self.min_size
+                or (frame.opcode is frames.OP_BINARY and not self.compress_binary)):
+            self._raw_cont = not frame.fin
+            return frame
+
+        if self.cache is None or not frame.fin:
+            return super().encode(frame)
+
+        data = frame.data
+        key = data if isinstance(data, bytes) else bytes(data)
+        packed = self.cache.get(key)
+        if packed is None:
+            enc = zlib.compressobj(wbits=-self.local_max_window_bits, **self.compress_settings)
+            packed = enc.compress(key) + enc.flush(zlib.Z_SYNC_FLUSH)
+            packed = packed[:-4]   # sin el bloque vacío 00 00 ff ff (RFC 7692 7.2.1)
+            self.cache.put(key, packed)
+        return frames.Frame(frame.opcode, packed, True, True, frame.rsv2, frame.rsv3)
+
+
+class TunedDeflateFactory(ServerPerMessageDeflateFactory):
+    """Factory de servidor que negocia permessage-deflate y devuelve `TunedPerMessageDeflate`."""
+
+    def __init__(self, mode="shared", window_bits=12, mem_level=5, level=6,
+                 min_size=512, compress_binary=False):
+        if mode not in ("on", "shared"):
+            raise ValueError(f"modo de compresión inválido: {mode!r}")
+        super().__init__(
+            server_no_context_takeover=(mode == "shared"),
+            server_max_window_bits=window_bits,
+            client_max_window_bits=window_bits,
+            compress_settings={"memLevel": mem_level, "level": level},
+        )
+        self.min_size = min_size
+        self.compress_binary = compress_binary
+        self.cache = _SharedCache() if mode == "shared" else None
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, ext = super().process_request_params(params, accepted_extensions)
+        tuned = TunedPerMessageDeflate(
+            ext.remote_no_context_takeover, ext.local_no_context_takeover,
+            ext.remote_max_window_bits, ext.local_max_window_bits, ext.compress_settings,
+            min_size=self.min_size, compress_binary=self.compress_binary,
+            # el caché se comparte sólo entre conexiones con la misma ventana
+            cache=self.cache if ext.local_max_window_bits == self.server_max_window_bits else None,
+        )
+        return response_params, tuned
+
+
+def serve_kwargs(mode="shared", **tuning) -> dict:
+    """Argumentos de compresión para `websockets.serve` según el modo."""
+    if mode not in MODES:
+        raise ValueError(f"modo de compresión inválido: {mode!r} (usar {', '.join(MODES)})")
+    if mode == "off":
+        return {"compression": None}
+    return {"compression": None, "extensions": [TunedDeflateFactory(mode, **tuning)]}
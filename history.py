@@ -0,0 +1,152 @@
+# history.py — historial en memoria con el frame de "history" pre-serializado
+import pathlib, uuid
+from collections import deque
+from codec import dumps
+
+
+def encode(msg: dict) -> bytes:
+    """Serializa un mensaje a UTF-8 (se envía como frame de texto sin re-codificar)."""
+    return dumps(msg)
+
+
+def load_epoch(path, fresh: bool) -> str:
+    """Identificador del "universo" de números de secuencia.
+
+    Se regenera cuando el historial arranca vacío (`fresh`), así un cliente con
+    un `since` de un historial anterior no confunde secuencias reiniciadas.
+    """
+    p = pathlib.Path(path)
+    if not fresh:
+        try:
+            epoch = p.read_text(encoding="utf-8").strip()
+            if epoch:
+                return epoch
+        except OSError:
+            pass
+    epoch = uuid.uuid4().hex[:12]
+    try:
+        p.write_text(epoch, encoding="utf-8")
+    except OSError:
+        pass
+    return epoch
+
+
+class History:
+    """Cola de los últimos `maxlen` mensajes + snapshot versionado del frame de historial.
+
+    Cada mensaje se guarda junto a sus bytes ya serializados (los mismos que se
+    usaron en el broadcast), así armar el frame `{"type": "history", ...}` es sólo
+    unir bytes. El snapshot se arma una vez por versión y todos los clientes que
+    se conectan reciben el mismo objeto bytes.
+
+    Cada mensaje lleva un `seq` monótono; `replay()` contesta a un cliente que
+    reconecta sólo con lo que le falta (ver protocol.py). Los seq no tienen por qué
+    ser consecutivos (el historial de un canal ve sólo los de ese canal).
+    """
+
+    def __init__(self, maxlen=30, epoch="", channel=None):
+        self.maxlen = maxlen
+        self.epoch = epoch
+        self.channel = channel                 # se incluye en el frame si no es None
+        self.last_seq = 0
+        self._floor = 0                        # seq más alto que ya NO está en memoria
+        self._items = deque(maxlen=maxlen)     # dicts
+        self._encoded = deque(maxlen=maxlen)   # bytes de cada dict
+        self.version = 0
+        self._frame = None
+        self._frame_version = -1
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    def next_seq(self) -> int:
+        """Reserva el próximo número de secuencia (asignarlo justo antes de `append`)."""
+        self.last_seq += 1
+        return self.last_seq
+
+    def append(self, msg: dict, data: bytes | None = None):
+        """Agrega `msg`; `data` son sus bytes si ya se serializó para el broadcast."""
+        if not isinstance(msg.get("seq"), int):
+            msg["seq"] = self.next_seq()   # historiales viejos no traen seq
+            data = None
+        if len(self._items) == self.maxlen:
+            self._floor = self._items[0]["seq"]           # el que se descarta
+        elif not self._items:
+            self._floor = max(self._floor, msg["seq"] - 1)   # lo anterior nunca estuvo acá
+        self.last_seq = max(self.last_seq, msg["seq"])
+        self._items.append(msg)
+        self._encoded.append(data if data is not None else encode(msg))
+        self.version += 1
+
+    def extend(self, msgs):
+        for m in msgs:
+            self.append(m)
+
+    def clear(self):
+        self._items.clear()
+        self._encoded.clear()
+        self._floor = self.last_seq
+        self.version += 1
+
+    def _join(self, extra: bytes, encoded) -> bytes:
+        head = b'{"type": "history", "epoch": ' + dumps(self.epoch) + \
+               b', "last_seq": ' + str(self.last_seq).encode() + extra
+        if self.channel is not None:
+            head += b', "channel": ' + dumps(self.channel)
+        return head + b', "items": [' + b", ".join(encoded) + b"]}"
+
+    def frame(self) -> bytes:
+        """Frame completo (`"resync": true`) cacheado para la versión actual."""
+        if self._frame_version == self.version:
+            self.hits += 1
+            return self._frame
+        self.misses += 1
+        self._frame = self._join(b', "resync": true', self._encoded)
+        self._frame_version = self.version
+        return self._frame
+
+    def replay(self, since: int | None, epoch: str | None) -> bytes | None:
+        """Respuesta para un cliente que se conecta.
+
+        - sin `since` (cliente viejo) → historial completo, o nada si está vacío
+        - mismo epoch y el hueco sigue en memoria → `"delta": true` con los que faltan
+        - si no → historial completo (`"resync": true`)
+        """
+        if since is None:
+            return self.frame() if self._items else None
+        if epoch != self.epoch or since > self.last_seq:
+            return self.frame()
+        if since == self.last_seq:
+            return self._join(b', "delta": true', ())
+        if since < self._floor:
+            return self.frame()   # el hueco es más viejo que lo retenido
+        missing = [d for m, d in zip(self._items, self._encoded) if m["seq"] > since]
+        return self._join(b', "delta": true', missing)
+
+    def before(self, seq: int | None, limit: int) -> list:
+        """Hasta `limit` mensajes en memoria con seq < `seq` (rango pedido sin base de datos)."""
+        items = [m for m in self._items if seq is None or m["seq"] < seq]
+        return items[-limit:] if limit > 0 else []
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes serializados retenidos (sin el frame cacheado)."""
+        return sum(len(d) for d in self._encoded)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {"version": self.version, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hit_rate, 3),
+                "frame_bytes": len(self._frame) if self._frame else 0}
@@ -0,0 +1,486 @@
+# hub.py — el motor del chat: canales, historial, adjuntos, colas de salida y métricas
+#
+# Lo usan servidor.py (proceso dedicado, o un worker con --workers) y el modo
+# host de cliente.py. Hay dos tipos de conexión:
+#   - remotas: websockets, cada una con su Outbox (bytes ya serializados);
+#   - locales (LocalPeer): en el mismo proceso que el hub. Reciben y mandan los
+#     dicts de los mensajes directamente, sin JSON ni TCP de loopback; la bandeja
+#     en modo host se engancha así a su propio hub.
+import asyncio, base64, contextlib, datetime, logging
+from collections import OrderedDict
+import websockets
+from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
+from outbound import Outbox
+from admission import Admission
+from sqlstore import SqliteStore
+from history import encode, load_epoch
+from codec import loads, DecodeError
+from channels import Channels, DEFAULT_CHANNEL, channel_name
+from blobs import externalize, attach_binary, blob_response, BLOB_PREFIX
+from uploads import Uploads, OPS as UPLOAD_OPS, handle_request as upload_step
+from protocol import (select_subprotocol, advertise_acks, is_binary, chunks, recv_attachments, resume_params, handshake_channel,
+                      wants_batch, msg_id, RETRY_CLOSE, retry_reason, FETCH_MAX)
+from metrics import ChatMetrics, METRICS_PATH
+from thumbs import add_thumbs, available as thumbs_available
+
+IDS_MAX = 10000   # ids de cliente recordados para descartar reenvíos (los más recientes)
+
+
+def _attachments_ok(atts) -> bool:
+    """`attachments` ausente/null o una lista de dicts (lo que viene del cliente, sin confiar)."""
+    return atts is None or isinstance(atts, list) and all(isinstance(a, dict) for a in atts)
+
+
+class LocalPeer:
+    """Conexión en el mismo proceso que el hub: los mensajes llegan como dicts a una cola.
+
+    Los dicts son los mismos que guarda el historial: leerlos, no modificarlos.
+    `get()` devuelve None cuando el hub se detiene o el par se desconecta.
+    """
+
+    def __init__(self, hub, channel=DEFAULT_CHANNEL):
+        self.hub = hub
+        self.channel = channel
+        self._queue = asyncio.Queue()
+
+    @property
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def put(self, msg: dict | None):
+        self._queue.put_nowait(msg)
+
+    async def get(self) -> dict | None:
+        return await self._queue.get()
+
+    async def send(self, msg: dict) -> dict | None:
+        """Publica `msg` (adjuntos con "bytes" crudos o referencias); devuelve el mensaje con seq."""
+        return await self.hub.submit(self, msg)
+
+    def close(self):
+        self.hub.detach_local(self)
+
+
+class Hub:
+    """Estado y lógica de una sala de chat, independiente de quién la aloje.
+
+    `open()` carga el historial del almacén, `start()`/`stop()` levantan y bajan
+    el websocket. Un worker de servidor.py asigna `bus` (BusClient): los
+    mensajes se publican ahí y vuelven secuenciados por `replicate()`.
+    """
+
+    def __init__(self, history_max=30, channels_max=1000, range_max=200, outbox_max=64,
+                 slow_policy="drop_oldest", slow_timeout=10.0, upload_max=64 * 1024 * 1024,
+                 uploads_per_conn=4, upload_pending_max=512 * 1024 * 1024,
+                 deflate=None, metrics_enabled=True, thumbs=True, batch_min=0, batch_max=64, batch_window=0.0,
+                 accept_rate=0, accept_burst=200, replays_max=0, log=logging.info):
+        self.clients = {}   # ws (o LocalPeer) -> Outbox (o el mismo LocalPeer)
+        self.channels = Channels(history_max, max_channels=channels_max)
+        self.history_max = history_max
+        self.range_max = range_max
+        self.outbox_max = outbox_max
+        self.slow_policy = slow_policy
+        self.slow_timeout = slow_timeout
+        # frames batch para clientes atrasados (?batch=1, ver outbound.py); batch_min=0 los apaga
+        self.batch = {"batch_min": batch_min, "batch_max": batch_max, "batch_window": batch_window}
+        self.upload_max = upload_max
+        self.uploads_per_conn = uploads_per_conn
+        self.upload_pending_max = upload_pending_max
+        # admisión (admission.py): conexiones por segundo y reenvíos de historial a la vez; 0 = sin tope
+        self.admission = Admission(accept_rate, accept_burst)
+        self._replays = asyncio.Semaphore(replays_max) if replays_max > 0 else contextlib.nullcontext()
+        self.deflate = deflate or {}   # kwargs de compression.serve_kwargs
+        self.metrics_enabled = metrics_enabled
+        self.metrics = ChatMetrics(self.clients, self.channels)
+        self.thumbs = thumbs   # miniaturas de imágenes (thumbs.py, si hay Pillow)
+        self.log = log
+        self.store = None     # Journal o SqliteStore: load / append / flush / close
+        self.blobs = None
+        self.uploads = None   # subidas por partes (uploads.py), en <blobs>/.uploads
+        self.bus = None
+        self._ids = OrderedDict()   # id de cliente -> seq (o Future mientras se publica)
+        self._server = None
+        self._lag_task = None
+
+    # ---------- almacenes ----------
+    def open(self, blobs, store=None, epoch_path=None, items=None, epoch=None):
+        """Prepara adjuntos/subidas y carga el historial: de `store` (epoch en `epoch_path`)
+        o, en un worker, de la réplica `items`/`epoch` que manda el bus."""
+        self.blobs, self.store = blobs, store
+        self.uploads = Uploads(blobs.root / ".uploads", blobs, max_size=self.upload_max,
+                               per_conn=self.uploads_per_conn, pending_max=self.upload_pending_max)
+        if n := self.uploads.expire():
+            self.log(f"Subidas abandonadas borradas: {n}")
+        if self.thumbs and not thumbs_available():
+            logging.warning("Pillow no está instalado (pip install -r requirements-extra.txt): "
+                            "las imágenes se reparten sin miniatura")
+        if items is None:
+            # historiales viejos traen las imágenes inline: se pasan al almacén al cargar
+            items = (externalize(it, blobs) for it in store.load()) if store else ()
+        self.channels.extend(items)
+        for m in self.channels:   # reenvíos de antes del reinicio: se siguen reconociendo
+            self._remember(m)
+        if epoch is None:
+            epoch = load_epoch(epoch_path, fresh=not self.channels) if epoch_path else ""
+        self.channels.epoch = epoch
+
+    def save(self, item: dict):
+        # no bloquea: el hilo del diario / de la base agrupa y escribe en segundo plano
+        if self.store:
+            self.store.append(item)
+
+    # ---------- websocket ----------
+    def serve(self, host, port, **kwargs):
+        return websockets.serve(
+            self.handler, host=host, port=port, process_request=self.process_request,
+            select_subprotocol=select_subprotocol, process_response=advertise_acks,
+            ping_interval=20, ping_timeout=20, max_queue=32, close_timeout=5,
+            **self.deflate, **kwargs,
+        )
+
+    async def start(self, host, port, **kwargs):
+        self._server = await self.serve(host, port, **kwargs)
+        if self.metrics_enabled:
+            self._lag_task = asyncio.create_task(self.metrics.watch_loop())
+
+    async def stop(self):
+        """Cierra el websocket, desconecta a todos y baja a disco lo pendiente."""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._lag_task:
+            self._lag_task.cancel()
+            self._lag_task = None
+        for box in list(self.clients.values()):
+            if isinstance(box, LocalPeer):
+                self.detach_local(box)
+            else:
+                box.close()
+        self.clients.clear()
+        if self.store:
+            await asyncio.to_thread(self.store.close)
+            self.store = None
+
+    # ---------- pares locales ----------
+    def attach_local(self, channel=DEFAULT_CHANNEL) -> LocalPeer:
+        """Engancha un cliente del mismo proceso; lo primero en su cola es el historial del canal."""
+        peer = LocalPeer(self, channel)
+        if not self.channels.subscribe(peer, channel):
+            peer.channel = DEFAULT_CHANNEL
+            self.channels.subscribe(peer, DEFAULT_CHANNEL)
+        self.clients[peer] = peer
+        ring = self.channels.ring(peer.channel)
+        peer.put({"type": "history", "channel": peer.channel, "epoch": ring.epoch,
+                  "last_seq": self.channels.last_seq, "resync": True, "items": list(ring)})
+        return peer
+
+    def detach_local(self, peer: LocalPeer):
+        if self.clients.pop(peer, None) is not None:
+            self.channels.drop(peer)
+            peer.put(None)
+
+    async def submit(self, peer: LocalPeer, msg: dict) -> dict | None:
+        # mismos pasos que un mensaje remoto, sin pasar por JSON: los adjuntos
+        # con "bytes" van derecho al almacén de blobs (como en modo binario)
+        atts = msg.get("attachments") or []
+        frames = [a["bytes"] for a in atts if a.get("bytes")]
+        if frames:
+            msg = {**msg, "attachments": [{k: v for k, v in a.items() if k != "bytes"}
+                                          for a in atts if a.get("bytes")]}
+        self.metrics.messages_in.inc()
+        norm = await self.normalize(msg, frames)
+        if norm is None:
+            return None
+        await self.publish(norm, peer, ack=False)
+        return norm
+
+    # ---------- envío ----------
+    async def broadcast(self, msg: dict, sender_ws=None, data: bytes | None = None):
+        # sólo encola: cada conexión tiene su escritora, un cliente lento no frena al resto
+        if not self.clients: return
+        data = data if data is not None else encode(msg)   # mismos bytes para todos
+        kind = "image" if msg.get("type") == "image" else "msg"
+        with self.metrics.broadcast.time():
+            # sólo los suscriptores del canal: el costo depende de la audiencia, no del total
+            for ws in list(self.channels.subscribers(msg.get("channel", DEFAULT_CHANNEL))):
+                box = self.clients.get(ws)
+                if box is None or ws is sender_ws:   # no reenvíes al emisor
+                    continue
+                if isinstance(box, LocalPeer):
+                    box.put(msg)   # el dict tal cual: nada que serializar
+                else:
+                    box.put(data, kind)
+
+    def _reply(self, ws, msg: dict, kind="reply"):
+        box = self.clients.get(ws)
+        if box and not isinstance(box, LocalPeer):
+            box.put(encode(msg), kind)
+
+    async def send_history(self, ws, since=None, epoch=None, channel=DEFAULT_CHANNEL, always=False):
+        # snapshot completo compartido (no se re-serializa) o sólo lo que le falta al cliente
+        ring = self.channels.ring(channel)
+        box = self.clients.get(ws)
+        if not box or ring is None:
+            return
+        frame = ring.replay(since, epoch)
+        if frame is None and always:   # suscripción explícita: confirmar aunque esté vacío
+            frame = ring.frame()
+        if frame:
+            box.put(frame, "history")
+
+    async def subscribe(self, ws, req: dict):
+        name = channel_name(req.get("channel"))
+        if name is None or not self.channels.subscribe(ws, name):
+            self._reply(ws, {"type": "error", "error": "channel", "channel": req.get("channel")})
+            return
+        try:
+            since = int(req["since"]) if req.get("since") is not None else None
+        except (TypeError, ValueError):
+            since = None
+        await self.send_history(ws, since, req.get("epoch"), name, always=True)
+
+    async def send_blob(self, ws, h):
+        box = self.clients.get(ws)
+        if not box:
+            return
+        size = await asyncio.to_thread(self.blobs.size, h)
+        if size is not None and size > FETCH_MAX:   # no entraría en un frame: que lo baje por HTTP
+            box.put(encode({"type": "blob", "hash": h, "error": "too_large", "size": size,
+                            "url": BLOB_PREFIX + h}), "blob")
+            return
+        raw = await asyncio.to_thread(self.blobs.read, h) if size is not None else None
+        if raw is None:
+            box.put(encode({"type": "blob", "hash": h, "error": "not_found"}), "blob")
+            return
+        if is_binary(ws):   # encabezado + bytes crudos, sin base64
+            header = encode({"type": "blob", "hash": h, "size": len(raw), "binary": 1})
+            box.put([(header, True), (chunks(raw), False)], "blob")
+        else:
+            box.put(encode({"type": "blob", "hash": h, "data": base64.b64encode(raw).decode("ascii")}), "blob")
+
+    async def send_range(self, ws, req: dict):
+        try:
+            before = int(req["before"]) if req.get("before") is not None else None
+            limit = max(1, min(int(req.get("limit", 50)), self.range_max))
+        except (TypeError, ValueError):
+            return
+        sender = req.get("from") or None
+        channel = channel_name(req.get("channel"))
+        ring = self.channels.ring(channel, create=False) if channel else None
+        recent = ([m for m in ring.before(before, self.range_max) if not sender or m.get("from") == sender]
+                  if ring else [])
+        if isinstance(self.store, SqliteStore) and channel:
+            items = await asyncio.wrap_future(self.store.query(before, limit, sender, channel))
+            if self.bus:   # worker: el principal escribe por lotes, lo más nuevo puede estar sólo en memoria
+                top = items[-1]["seq"] if items else 0
+                items = (items + [m for m in recent if m["seq"] > top])[-limit:]
+        else:   # sin base: sólo lo que hay en memoria
+            items = recent[-limit:]
+        self._reply(ws, {"type": "range", "channel": channel, "before": before, "items": items,
+                         "more": len(items) == limit}, "history")
+
+    async def process_request(self, connection, request):
+        # HTTP en el mismo puerto: GET /blob/<sha256> y GET /metrics
+        if request.path.startswith(BLOB_PREFIX):
+            return await asyncio.to_thread(blob_response, self.blobs, request.path)
+        if self.metrics_enabled and request.path == METRICS_PATH:
+            return self.metrics.response()
+        return None
+
+    # ---------- conexiones remotas ----------
+    def _drop_client(self, box: Outbox):
+        if self.clients.get(box.ws) is box:
+            del self.clients[box.ws]
+            self.channels.drop(box.ws)
+
+    async def handler(self, ws):
+        if wait := self.admission.admit():   # ola de reconexiones: que vuelva más tarde, escalonado
+            self.metrics.rejected.inc()
+            try:
+                await ws.close(RETRY_CLOSE, retry_reason(wait))
+            except Exception:
+                pass
+            return
+        box = self.clients[ws] = Outbox(ws, self.outbox_max, self.slow_policy, self.slow_timeout,
+                                        on_close=self._drop_client, metrics=self.metrics,
+                                        **(self.batch if wants_batch(ws) else {}))
+        peer = getattr(ws, "remote_address", None)
+        since, epoch = resume_params(ws)
+
+        try:
+            # pocos historiales saliendo a la vez; el resto espera su turno (ya conectado, sin reintentar).
+            # Se suscribe recién con el turno: nada en vivo llega antes que su historial
+            async with self._replays:
+                # Canal inicial (?channel=, si no "general") e historial de ese canal (completo, o delta si reanuda)
+                channel = channel_name(handshake_channel(ws)) or DEFAULT_CHANNEL
+                if not self.channels.subscribe(ws, channel):
+                    channel = DEFAULT_CHANNEL
+                    self.channels.subscribe(ws, channel)
+                await self.send_history(ws, since, epoch, channel)
+                with contextlib.suppress(asyncio.TimeoutError):   # uno trabado no retiene el turno
+                    await asyncio.wait_for(box.flushed(), self.slow_timeout)
+            self.log(f"Cliente conectado: {peer} en #{channel} "
+                     f"(snapshot de historial: {self.channels.hits} hits / {self.channels.misses} misses)")
+
+            async for raw in ws:
+                self.metrics.bytes_in.inc(len(raw) if isinstance(raw, bytes) or raw.isascii()
+                                          else len(raw.encode("utf-8")))
+                if isinstance(raw, bytes):
+                    logging.debug("Frame binario sin encabezado ignorado")
+                    continue
+                try:
+                    msg = loads(raw)
+                except DecodeError:
+                    logging.debug("Mensaje no-JSON ignorado")
+                    continue
+
+                if msg.get("type") == "fetch":   # pedido de un adjunto por hash
+                    await self.send_blob(ws, msg.get("hash"))
+                    continue
+                if msg.get("type") == "range":   # mensajes más viejos: {"before": seq, "limit": n, "channel": c}
+                    await self.send_range(ws, msg)
+                    continue
+                if msg.get("type") == "subscribe":
+                    await self.subscribe(ws, msg)
+                    continue
+                if msg.get("type") in UPLOAD_OPS:   # subida por partes (uploads.py)
+                    self._reply(ws, await upload_step(self.uploads, ws, msg), "ack")
+                    continue
+                if msg.get("type") == "unsubscribe":
+                    self.channels.unsubscribe(ws, channel_name(msg.get("channel")))
+                    continue
+
+                # modo binario: los adjuntos llegan crudos en los frames que siguen
+                frames = await recv_attachments(ws, msg) if msg.get("binary") else None
+                self.metrics.messages_in.inc()
+                if frames:
+                    self.metrics.bytes_in.inc(sum(len(f) for f in frames))
+
+                await self.accept(ws, msg, frames, ack=since is not None)
+
+        except (ConnectionClosedOK, ConnectionClosedError) as e:
+            self.log(f"Cliente desconectado ({peer}): {e}")
+        except OSError as e:
+            self.log(f"Cliente desconectado por OSError ({peer}): {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.exception(f"Error en handler ({peer}): {e}")
+        finally:
+            self.channels.drop(ws)
+            if self.uploads:
+                self.uploads.release(ws)
+            box = self.clients.pop(ws, None)
+            if box:
+                box.close()
+
+    # ---------- mensajes ----------
+    async def accept(self, ws, msg: dict, frames=None, ack=False):
+        """Normaliza y publica un mensaje de `ws`. Con "id" se confirma siempre y un
+        reenvío del mismo id (después de reconectar) sólo se confirma, no se republica."""
+        mid = msg_id(msg)
+        if mid:
+            seq = await self._seen(mid)
+            if seq is not None:
+                self.metrics.duplicates.inc()
+                self._reply(ws, {"type": "ack", "seq": seq, "id": mid}, "ack")
+                return
+            pending = self._ids[mid] = asyncio.get_running_loop().create_future()
+        published = False
+        try:
+            norm = await self.normalize(msg, frames)
+            if norm is None:   # adjuntos mal formados, nombre de canal inválido o demasiados canales
+                if not _attachments_ok(msg.get("attachments") or None):
+                    err = {"type": "error", "error": "attachments"}
+                else:
+                    err = {"type": "error", "error": "channel", "channel": msg.get("channel")}
+                self._reply(ws, {**err, "id": mid} if mid else err)
+                return
+            if mid:
+                norm["id"] = mid
+            await self.publish(norm, ws, ack=ack or bool(mid))
+            published = True   # el Future lo resuelve deliver (en un worker, cuando vuelve del bus)
+        finally:
+            if mid and not published:   # no salió: que un reenvío lo publique
+                if self._ids.get(mid) is pending:
+                    del self._ids[mid]
+                if not pending.done():   # deliver pudo resolverlo antes de que publish fallara
+                    pending.set_result(None)
+
+    async def _seen(self, mid):
+        """seq con el que ya se publicó `mid`, o None. Si se está publicando, lo espera."""
+        seq = self._ids.get(mid)
+        if isinstance(seq, asyncio.Future):
+            try:
+                seq = await asyncio.wait_for(asyncio.shield(seq), self.slow_timeout)
+            except asyncio.TimeoutError:
+                seq = None
+        return seq
+
+    def _remember(self, msg: dict):
+        mid = msg.get("id")
+        if not mid:
+            return
+        prev = self._ids.pop(mid, None)
+        self._ids[mid] = msg["seq"]
+        if isinstance(prev, asyncio.Future) and not prev.done():
+            prev.set_result(msg["seq"])
+        while len(self._ids) > IDS_MAX:
+            self._ids.popitem(last=False)
+
+    async def normalize(self, msg: dict, frames=None) -> dict | None:
+        """Mensaje tal como se guarda y reparte (sin seq); None si el canal no es válido
+        o "attachments" no es una lista de dicts."""
+        attachments = msg.get("attachments") or []
+        if not _attachments_ok(attachments):
+            return None
+        target = channel_name(msg.get("channel"))
+        if target is None or self.channels.ring(target) is None:
+            return None
+        norm = {
+            "type": "image" if attachments else "msg",
+            "from": msg.get("from", "???"),
+            "text": msg.get("text", ""),
+            "attachments": attachments,   # 👈 reenviamos adjuntos
+            "ts": datetime.datetime.now().isoformat(timespec="seconds"),
+            "channel": target,
+        }
+        # adjuntos → almacén de blobs (en un hilo); queda {hash, name, mime, size}
+        # (los subidos por partes ya llegan como referencia y sólo se validan)
+        if frames:
+            norm = await asyncio.to_thread(attach_binary, norm, frames, self.blobs)
+        elif attachments:
+            norm = await asyncio.to_thread(externalize, norm, self.blobs)
+        if norm["attachments"]:   # miniatura inline; el original se pide sólo al abrirlo
+            norm = await asyncio.to_thread(add_thumbs, norm, self.blobs, self.thumbs)
+        norm["type"] = "image" if norm["attachments"] else "msg"
+        return norm
+
+    async def publish(self, norm: dict, sender_ws=None, ack=False):
+        if self.bus:   # worker: el proceso principal asigna el seq y lo reparte a todos
+            self.bus.publish(norm, sender_ws, ack=ack)
+            await self.bus.drain()
+        else:
+            data = self.sequence(norm)
+            await self.deliver(norm, data, sender_ws, ack=ack)
+
+    def sequence(self, norm: dict) -> bytes:
+        # seq justo antes de encolar: el orden en cada cola coincide con el seq
+        norm["seq"] = self.channels.next_seq()
+        data = encode(norm)
+        self.channels.append(norm, data)
+        self.save(norm)
+        return data
+
+    async def deliver(self, msg: dict, data: bytes, sender_ws=None, ack=False):
+        self._remember(msg)
+        await self.broadcast(msg, sender_ws=sender_ws, data=data)
+        if ack:   # cliente con reanudación o con cola de envío: confirmar su seq
+            self._reply(sender_ws, {"type": "ack", "seq": msg["seq"], "id": msg["id"]} if msg.get("id")
+                        else {"type": "ack", "seq": msg["seq"]}, "ack")
+
+    async def replicate(self, msg: dict, data: bytes, sender_ws, ack):
+        # worker: réplica del historial + broadcast a los clientes de este proceso
+        self.channels.append(msg, data)
+        await self.deliver(msg, data, sender_ws, ack)
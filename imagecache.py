@@ -0,0 +1,164 @@
+# imagecache.py — caché local de imágenes del cliente, direccionada por contenido
+#
+# Cada imagen queda una sola vez en disco como <sha256><ext> (las miniaturas del
+# servidor como <sha256>-mini.jpg). Un índice en memoria resuelve hash → archivo
+# sin recorrer el directorio: al reconectar con el historial completo, las imágenes que
+# ya tenemos no se vuelven a decodificar ni a escribir. Tope por tamaño total
+# (LRU) y por antigüedad.
+import collections, hashlib, os, pathlib, re, tempfile, threading, time
+
+_FILE_RE = re.compile(r"^([0-9a-f]{64}(?:-mini)?)(\.[a-z0-9]{1,8})$")
+_EXT_RE = re.compile(r"^\.[A-Za-z0-9]{1,8}$")
+_TOUCH_EVERY = 24 * 3600   # cada cuánto se renueva el mtime de un archivo usado (s)
+
+
+def image_key(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _ext(name: str, default=".png") -> str:
+    ext = pathlib.Path(name or "").suffix
+    return ext.lower() if _EXT_RE.match(ext) else default
+
+
+class ImageCache:
+    """Archivos de imagen por clave de contenido, con índice en memoria y desalojo LRU.
+
+    `get(key)` es O(1) (un stat, sin recorrer el directorio); `put(key, data, name)` escribe sólo
+    si la clave no estaba. El directorio se indexa una vez, en `load()` o en el
+    primer uso (no en el constructor: el cliente lo crea al arrancar), y se
+    borran los archivos de más de `max_age` segundos (también los nombres
+    viejos tipo imagen_12.png de versiones anteriores). Seguro entre hilos.
+    """
+
+    def __init__(self, root, max_bytes=256 * 1024 * 1024, max_age=30 * 24 * 3600):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._index = collections.OrderedDict()   # clave -> [ruta, tamaño, último uso]; primero el más viejo
+        self._bytes = 0
+        self._loaded = False
+
+    def load(self):
+        """Indexa el directorio si todavía no se hizo. Bloqueante."""
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._scan()
+                self._loaded = True
+
+    def _scan(self):
+        limit = time.time() - self.max_age
+        found = []
+        for e in os.scandir(self.root):
+            try:
+                if not e.is_file():
+                    continue
+                st = e.stat()
+                if st.st_mtime < limit:   # vencido (o de una versión vieja, o un .tmp- abandonado)
+                    os.unlink(e.path)
+                    continue
+            except OSError:
+                continue
+            if m := _FILE_RE.match(e.name):
+                found.append((st.st_mtime, m.group(1), e.path, st.st_size))
+        for mtime, key, path, size in sorted(found):
+            self._index[key] = [path, size, mtime]
+            self._bytes += size
+        self._unlink(self._evict())
+
+    # len/nbytes no indexan ni esperan al índice (los lee la GUI): mientras
+    # `load()` no terminó, cuentan lo que ya hay en memoria
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> str | None:
+        """Ruta del archivo de `key`, o None si no está en la caché."""
+        self.load()
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            self._index.move_to_end(key)
+        try:
+            now = time.time()
+            if now - entry[2] >= _TOUCH_EVERY:   # que el tope por antigüedad cuente desde el último uso
+                os.utime(entry[0])
+                entry[2] = now
+            elif not os.path.exists(entry[0]):
+                raise FileNotFoundError(entry[0])
+        except OSError:   # lo borró alguien más (limpieza de %TEMP%)
+            with self._lock:
+                if self._index.get(key) is entry:
+                    del self._index[key]
+                    self._bytes -= entry[1]
+            return None
+        return entry[0]
+
+    def put(self, key: str, data, name="imagen.png") -> str:
+        """Guarda `data` bajo `key` (si no estaba) y devuelve la ruta. Bloqueante."""
+        path = self.get(key)
+        if path:
+            return path
+        path = self.root / f"{key}{_ext(name)}"
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try: os.unlink(tmp)
+            except OSError: pass
+            raise
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old:
+                self._bytes -= old[1]
+            self._index[key] = [str(path), len(data), time.time()]
+            self._bytes += len(data)
+            victims = self._evict()
+        self._unlink(victims)
+        return str(path)
+
+    def discard(self, key: str):
+        """Saca `key` de la caché y borra su archivo (si estaba)."""
+        self.load()
+        with self._lock:
+            entry = self._index.pop(key, None)
+            if entry:
+                self._bytes -= entry[1]
+        if entry:
+            self._unlink([entry[0]])
+
+    def put_bytes(self, data, name="imagen.png") -> str:
+        """Como `put`, con la clave calculada del contenido."""
+        return self.put(image_key(data), data, name)
+
+    def _evict(self) -> list:
+        # con el lock tomado; devuelve las rutas a borrar.
+        # El más reciente nunca se desaloja: es el que se acaba de pedir o guardar.
+        victims = []
+        limit = time.time() - self.max_age
+        while len(self._index) > 1:
+            key, (path, size, used) = next(iter(self._index.items()))
+            if self._bytes <= self.max_bytes and used >= limit:
+                break
+            del self._index[key]
+            self._bytes -= size
+            victims.append(path)
+        return victims
+
+    @staticmethod
+    def _unlink(paths):
+        for p in paths:
+            try:
+                os.unlink(p)
+            except OSError:
+                pass
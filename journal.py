@@ -0,0 +1,222 @@
+# journal.py — historial en disco como diario append-only (JSON lines)
+import logging, os, pathlib, threading, time
+from collections import deque
+from codec import dumps, loads
+
+
+class Journal:
+    """Diario append-only del historial con escritura diferida (write-behind).
+
+    - `append()` no toca el disco: deja el mensaje en un buffer y vuelve.
+    - Un hilo escritor junta todo lo pendiente en UNA escritura (+fsync) cada
+      `flush_interval` segundos o cuando lo pendiente supera `flush_bytes`.
+    - Se retienen los últimos `keep` mensajes de CADA canal (uno tranquilo no
+      pierde su historial por uno con mucho movimiento). Cuando el archivo
+      acumula `compact_factor` veces lo retenido (y al menos `keep * compact_factor`
+      líneas), el mismo hilo lo compacta reescribiendo sólo eso (write + replace).
+    - `load()` reconstruye el historial recorriendo el archivo de atrás hacia
+      adelante; la compactación lo mantiene acotado.
+    - `transform` se aplica a cada mensaje retenido al cargar (p.ej. sacar los
+      adjuntos inline al almacén de blobs); si cambia alguno, el archivo se
+      reescribe ya con la versión nueva.
+    """
+
+    def __init__(self, path, keep=30, flush_interval=1.0, flush_bytes=256 * 1024,
+                 fsync=True, compact_factor=4, legacy_path=None, log=logging.info, on_write=None,
+                 transform=None):
+        self.path = pathlib.Path(path)
+        self.keep = keep
+        self.flush_interval = float(flush_interval)
+        self.flush_bytes = int(flush_bytes)
+        self.fsync = fsync
+        self.compact_factor = max(2, compact_factor)
+        self.compact_lines = max(keep * compact_factor, keep + 1)
+        self.legacy_path = pathlib.Path(legacy_path) if legacy_path else None
+        self.log = log
+        self.on_write = on_write          # callback(segundos) tras cada lote escrito (métricas)
+        self.transform = transform        # item -> item (el mismo objeto si no hay nada que cambiar)
+
+        self._tails = {}                  # canal -> deque de (orden, línea serializada), para compactar
+        self._order = 0                   # posición de la próxima línea (orden del archivo)
+        self._lines = 0                   # líneas en el archivo
+        self._pending = []                # dicts aún no escritos
+        self._pending_bytes = 0
+        self._cond = threading.Condition()
+        self._stop = False
+        self._busy = False                # hay un lote escribiéndose
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    # ---------- lectura ----------
+    def load(self) -> list:
+        """Devuelve los últimos `keep` mensajes de cada canal, en orden (migra el fastchat.json viejo si hace falta).
+
+        Hay que llamarlo antes del primer `append()`: la compactación parte de estas colas.
+        """
+        if not self.path.exists() and self.legacy_path and self.legacy_path.exists():
+            self._import_legacy()
+        if not self.path.exists():
+            return []
+        found = []
+        try:
+            _terminate_last_line(self.path)
+            found, self._lines = _read_channels(self.path, self.keep)
+            if self._transform(found):   # las líneas viejas no se copian tal cual en cada compactación
+                _atomic_write(self.path, [line for line, _ in found])
+                self._lines = len(found)
+                self.log(f"Diario {self.path} reescrito sin adjuntos inline")
+        except OSError as e:
+            logging.warning(f"No se pudo leer {self.path}: {e}")
+        self._order = len(found)
+        for i, (line, it) in enumerate(found):
+            self._tail_for(it).append((i, line))
+        return [it for _, it in found]
+
+    def _transform(self, found: list) -> bool:
+        changed = False
+        for i, (line, it) in enumerate(found) if self.transform else ():
+            new = self.transform(it)
+            if new is not it:
+                found[i] = (dumps(new), new)
+                changed = True
+        return changed
+
+    def _tail_for(self, item: dict) -> deque:
+        channel = item.get("channel") or "general"
+        if (tail := self._tails.get(channel)) is None:
+            tail = self._tails[channel] = deque(maxlen=self.keep)
+        return tail
+
+    def _import_legacy(self):
+        try:
+            old = loads(self.legacy_path.read_bytes())
+            lines = [dumps(it) for it in old[-self.keep:]]
+            _atomic_write(self.path, lines)
+            self.log(f"Historial migrado de {self.legacy_path} a {self.path}")
+        except Exception as e:
+            logging.warning(f"No se pudo migrar {self.legacy_path}: {e}")
+
+    # ---------- escritura ----------
+    def append(self, item: dict):
+        with self._cond:
+            self._pending.append(item)
+            # estimación barata; el tamaño real se conoce al serializar en el hilo
+            self._pending_bytes += 256 + sum(len(a.get("data", "")) for a in item.get("attachments", ()))
+            if len(self._pending) == 1 or self._pending_bytes >= self.flush_bytes:
+                self._cond.notify()
+
+    def flush(self, timeout=5.0):
+        """Bloquea hasta que lo pendiente esté en disco (para apagado ordenado)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify()
+            while (self._pending or self._busy) and time.monotonic() < deadline:
+                self._cond.wait(0.05)
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stop:
+                    self._cond.wait()
+                if self._stop and not self._pending:
+                    return
+                # esperar a juntar más mensajes, salvo que ya haya suficientes bytes
+                deadline = time.monotonic() + self.flush_interval
+                while (not self._stop and self._pending_bytes < self.flush_bytes
+                       and (left := deadline - time.monotonic()) > 0):
+                    self._cond.wait(left)
+                batch, self._pending, self._pending_bytes = self._pending, [], 0
+                self._busy = True
+            try:
+                t0 = time.perf_counter()
+                self._write(batch)
+                if self.on_write:
+                    self.on_write(time.perf_counter() - t0)
+            except Exception as e:
+                logging.warning(f"No se pudo guardar {self.path}: {e}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _write(self, batch):
+        lines = [dumps(it) for it in batch]
+        for it, line in zip(batch, lines):
+            self._tail_for(it).append((self._order, line))
+            self._order += 1
+        retained = sum(len(t) for t in self._tails.values())
+        if self._lines + len(lines) > max(self.compact_lines, retained * self.compact_factor):
+            keep = sorted(x for t in self._tails.values() for x in t)
+            _atomic_write(self.path, [line for _, line in keep])
+            self._lines = len(keep)
+            return
+        with open(self.path, "ab") as f:
+            f.write(b"\n".join(lines) + b"\n")
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        self._lines += len(lines)
+
+
+def _atomic_write(path: pathlib.Path, lines):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(b"".join(l + b"\n" for l in lines))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _terminate_last_line(path: pathlib.Path):
+    # si la última escritura quedó a medias, cerrar la línea para no pegarle la siguiente
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() and (f.seek(-1, os.SEEK_END), f.read(1))[1] != b"\n":
+            f.write(b"\n")
+
+
+def _lines_backward(path: pathlib.Path, chunk=64 * 1024):
+    """Líneas no vacías del archivo, de la última a la primera, leyendo por bloques."""
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        rest = b""
+        while pos > 0:
+            step = min(chunk, pos)
+            pos -= step
+            f.seek(pos)
+            parts = (f.read(step) + rest).split(b"\n")
+            rest = parts[0]   # puede seguir en el bloque anterior
+            for line in reversed(parts[1:]):
+                if line.strip():
+                    yield line
+        if rest.strip():
+            yield rest
+
+
+def _read_channels(path: pathlib.Path, keep: int):
+    """([(línea, item), ...] con los últimos `keep` de cada canal en orden del archivo, líneas del archivo)."""
+    found, lines, per_channel = [], 0, {}
+    for line in _lines_backward(path):
+        lines += 1
+        try:   # una línea cortada (corte de luz, etc.) no se puede leer y se saltea
+            it = loads(line)
+            channel = it.get("channel") or "general"
+        except (ValueError, AttributeError):
+            continue
+        if per_channel.get(channel, 0) < keep:
+            per_channel[channel] = per_channel.get(channel, 0) + 1
+            found.append((line, it))
+    found.reverse()
+    return found, lines
+
+
+def read_tail(path, n: int) -> list:
+    """Últimos `n` mensajes de cada canal de un diario, sin abrirlo para escritura (migraciones)."""
+    return [it for _, it in _read_channels(pathlib.Path(path), n)[0]]
@@ -0,0 +1,157 @@
+# metrics.py — métricas del servidor en formato de texto de Prometheus (GET /metrics)
+#
+# Sin dependencias: contadores, gauges calculados al momento del scrape e
+# histogramas con buckets fijos. Lo sirve el mismo puerto del websocket
+# (process_request), tanto en servidor.py como en el modo host del cliente.
+import asyncio, threading, time
+from websockets.datastructures import Headers
+from websockets.http11 import Response
+
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# segundos: de 100 µs a 10 s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _fmt(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name, self.help = name, help
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter",
+                f"{self.name} {_fmt(self.value)}"]
+
+
+class Gauge:
+    """Valor leído con `fn()` en cada scrape (no hay que mantenerlo actualizado)."""
+
+    def __init__(self, name, help, fn):
+        self.name, self.help, self.fn = name, help, fn
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge",
+                f"{self.name} {_fmt(self.fn())}"]
+
+
+class Histogram:
+    """Histograma acumulativo; `observe()` se puede llamar desde otros hilos (escritores a disco)."""
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name, self.help = name, help
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)   # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, v: float):
+        i = 0
+        while i < len(self.buckets) and v > self.buckets[i]:
+            i += 1
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+            self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def render(self):
+        with self._lock:
+            counts, total, n = list(self.counts), self.sum, self.count
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        acc = 0
+        for le, c in zip(self.buckets + (float("inf"),), counts):
+            acc += c
+            out.append(f'{self.name}_bucket{{le="{_fmt(le)}"}} {acc}')
+        out += [f"{self.name}_sum {_fmt(total)}", f"{self.name}_count {n}"]
+        return out
+
+
+class _Timer:
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0)
+
+
+class ChatMetrics:
+    """Las métricas de un servidor FastChat.
+
+    `clients` es el dict ws → Outbox y `history` el `History` en memoria; se leen
+    al momento del scrape. Los contadores los incrementan el handler, `Outbox`
+    (frames/bytes salientes, descartes) y el escritor del historial (`on_write`).
+    """
+
+    def __init__(self, clients, history):
+        self.clients = clients
+        self.history = history
+        self.started = time.time()
+        self.messages_in = Counter("fastchat_messages_in_total", "Mensajes de chat recibidos")
+        self.duplicates = Counter("fastchat_duplicate_messages_total", "Reenvíos de mensajes ya publicados (mismo id), sólo confirmados")
+        self.bytes_in = Counter("fastchat_bytes_in_total", "Bytes recibidos en frames (UTF-8 en los de texto)")
+        self.frames_out = Counter("fastchat_frames_out_total", "Frames enviados a clientes (mensajes, historial, blobs, acks)")
+        self.messages_out = Counter("fastchat_messages_out_total", "Mensajes de chat entregados a clientes (cada item de un batch cuenta)")
+        self.bytes_out = Counter("fastchat_bytes_out_total", "Bytes enviados a clientes (antes de comprimir)")
+        self.dropped = Counter("fastchat_outbox_dropped_total", "Frames descartados por cola de salida llena")
+        self.batches = Counter("fastchat_batches_out_total", "Frames batch enviados (varios mensajes en un frame)")
+        self.batched = Counter("fastchat_batched_messages_total", "Mensajes enviados dentro de frames batch")
+        self.rejected = Counter("fastchat_connections_rejected_total", "Conexiones cerradas con retry-after por el control de admisión")
+        self.slow_kicks = Counter("fastchat_slow_client_disconnects_total", "Clientes lentos desconectados")
+        self.broadcast = Histogram("fastchat_broadcast_seconds", "Tiempo de fan-out de un broadcast (encolar en todas las conexiones)")
+        self.save_history = Histogram("fastchat_save_history_seconds", "Duración de cada escritura por lotes del historial")
+        self.loop_lag = Histogram("fastchat_event_loop_lag_seconds", "Atraso del event loop respecto de lo programado")
+        self._last_lag = 0.0
+        self._items = [
+            Gauge("fastchat_clients", "Conexiones websocket abiertas", lambda: len(self.clients)),
+            Gauge("fastchat_outbox_backlog", "Frames pendientes en todas las colas de salida",
+                  lambda: sum(b.backlog for b in list(self.clients.values()))),
+            self.messages_in, self.duplicates, self.bytes_in, self.frames_out, self.messages_out, self.bytes_out,
+            self.batches, self.batched, self.dropped, self.slow_kicks, self.rejected,
+            Gauge("fastchat_history_messages", "Mensajes en el historial en memoria", lambda: len(self.history)),
+            Gauge("fastchat_history_bytes", "Bytes serializados del historial en memoria", lambda: self.history.nbytes),
+            Gauge("fastchat_history_last_seq", "Último número de secuencia asignado", lambda: self.history.last_seq),
+            Gauge("fastchat_history_snapshot_hit_ratio", "Aciertos del snapshot de historial pre-serializado",
+                  lambda: self.history.hit_rate),
+            self.broadcast, self.save_history, self.loop_lag,
+            Gauge("fastchat_event_loop_lag_last_seconds", "Último atraso medido del event loop", lambda: self._last_lag),
+            Gauge("fastchat_uptime_seconds", "Segundos desde el arranque", lambda: time.time() - self.started),
+        ]
+
+    def render(self) -> bytes:
+        lines = []
+        for m in self._items:
+            lines += m.render()
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def response(self) -> Response:
+        body = self.render()
+        headers = Headers([("Content-Type", CONTENT_TYPE), ("Content-Length", str(len(body))),
+                           ("Cache-Control", "no-store")])
+        return Response(200, "OK", headers, body)
+
+    async def watch_loop(self, interval=0.5):
+        """Tarea que mide cuánto tarda el loop en despertar un sleep de `interval`."""
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(interval)
+            self._last_lag = max(0.0, loop.time() - t0 - interval)
+            self.loop_lag.observe(self._last_lag)
@@ -0,0 +1,122 @@
+# msgbuffer.py — los últimos mensajes del cliente (el historial del diálogo), acotados
+#
+# Cada entrada es una tupla (remitente, html) tal como la muestra ReplyDialog
+# (que las compara por identidad). El buffer es un anillo con tope de cantidad
+# y de bytes: al pasarse, salen las más viejas y, con ellas, las imágenes de
+# la caché local que ya no use ninguna otra entrada.
+import collections, re, sys, threading
+
+# archivos de ImageCache referenciados desde el HTML: <sha256>(-mini).<ext>
+_KEY_RE = re.compile(r"\b([0-9a-f]{64}(?:-mini)?)\.[A-Za-z0-9]{1,8}\b")
+
+
+def image_keys(html: str) -> tuple:
+    """Claves de ImageCache que aparecen en `html` (miniaturas e imágenes guardadas)."""
+    return tuple(set(_KEY_RE.findall(html)))
+
+
+def entry_size(entry) -> int:
+    """Bytes aproximados que ocupa una entrada (la tupla y sus dos strings)."""
+    return sys.getsizeof(entry) + sum(sys.getsizeof(x) for x in entry)
+
+
+class MessageBuffer:
+    """Anillo de entradas (remitente, html) con tope de cantidad y de bytes.
+
+    Se usa como la lista de antes: `append`, `len`, iterar e índices/slices
+    (un slice devuelve una lista). Al pasarse de `max_msgs` o `max_bytes` se
+    descartan las más viejas (siempre queda al menos la última) y se llama a
+    `on_evict(claves)` con las imágenes que dejaron de estar referenciadas.
+    `clear()` (resync) no borra imágenes: las entradas nuevas suelen ser las
+    mismas. Seguro entre hilos.
+    """
+
+    def __init__(self, max_msgs=50, max_bytes=1024 * 1024, on_evict=None):
+        self.max_msgs = max_msgs
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._items = collections.deque()   # [entrada, bytes, claves de imagen]; primero la más vieja
+        self._refs = collections.Counter()   # clave de imagen -> entradas que la usan
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        with self._lock:
+            return iter([r[0] for r in self._items])
+
+    def __getitem__(self, i):
+        with self._lock:
+            if isinstance(i, slice):
+                return [r[0] for r in list(self._items)[i]]
+            return self._items[i][0]
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def _track(self, entry) -> list:
+        rec = [entry, entry_size(entry), image_keys(entry[1])]
+        self._refs.update(rec[2])
+        self._bytes += rec[1]
+        return rec
+
+    def _untrack(self, rec) -> list:
+        _, size, keys = rec
+        self._bytes -= size
+        self._refs.subtract(keys)
+        gone = [k for k in keys if self._refs[k] <= 0]
+        for k in gone:
+            del self._refs[k]
+        return gone
+
+    def append(self, entry):
+        with self._lock:
+            self._items.append(self._track(entry))
+            gone = self._trim()
+        self._evicted(gone)
+
+    def replace(self, old, new) -> bool:
+        """Cambia la entrada `old` (por identidad) por `new`; False si ya no está."""
+        with self._lock:
+            for i, rec in enumerate(self._items):
+                if rec[0] is old:
+                    self._items[i] = self._track(new)
+                    gone = self._untrack(rec)
+                    break
+            else:
+                return False
+        self._evicted(gone)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._refs.clear()
+            self._bytes = 0
+
+    def resize(self, max_msgs=None, max_bytes=None):
+        """Cambia los topes (y descarta lo que sobre)."""
+        with self._lock:
+            self.max_msgs = max_msgs or self.max_msgs
+            self.max_bytes = max_bytes or self.max_bytes
+            gone = self._trim()
+        self._evicted(gone)
+
+    def _trim(self) -> list:
+        # con el lock tomado; la última entrada queda aunque sola pase el tope de bytes
+        gone = []
+        while len(self._items) > 1 and (len(self._items) > self.max_msgs or self._bytes > self.max_bytes):
+            gone += self._untrack(self._items.popleft())
+        return gone
+
+    def _evicted(self, keys):
+        if keys and self.on_evict:
+            self.on_evict(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"msgs": len(self._items), "bytes": self._bytes, "images": len(self._refs),
+                    "max_msgs": self.max_msgs, "max_bytes": self.max_bytes}
@@ -0,0 +1,209 @@
+# outbound.py — colas de salida por conexión (servidor y modo host)
+import asyncio, logging, time
+from collections import deque
+
+# Políticas para consumidores lentos (cola llena):
+#   drop_oldest → descarta el mensaje más viejo de la cola
+#   drop_images → descarta primero imágenes pendientes, luego el más viejo
+#   disconnect  → descarta el más viejo, pero si la cola sigue llena (o un envío
+#                 queda trabado) más de `slow_timeout` segundos, cierra la conexión.
+#                 "Sigue llena" hasta que baje a la mitad: que la escritora saque
+#                 uno y el siguiente put lo vuelva a llenar no cuenta como ponerse al día
+POLICIES = ("drop_oldest", "drop_images", "disconnect")
+
+# Ráfagas (sólo clientes con ?batch=1, ver protocol.py): si al escribir quedan
+# `batch_min` mensajes o más en cola, los consecutivos salen juntos en un frame
+# {"type": "batch", "items": [...]} (hasta `batch_max`). Con `batch_window` > 0
+# la escritora además espera ese tiempo a ver si llega otro, pero sólo cuando
+# acaba de mandar algo: un mensaje suelto después de un rato sale sin demora.
+BATCHABLE = ("msg", "image")
+_BATCH_HEAD = b'{"type":"batch","items":['
+_BATCH_TAIL = b"]}"
+
+
+class Outbox:
+    """Cola acotada de frames pendientes para UNA conexión.
+
+    `put()` nunca bloquea: encola y vuelve. La tarea escritora de la conexión
+    drena la cola en orden, así un cliente lento sólo se atrasa a sí mismo.
+    """
+
+    def __init__(self, ws, maxsize=64, policy="drop_oldest", slow_timeout=10.0, on_close=None, metrics=None,
+                 batch_min=0, batch_max=64, batch_window=0.0):
+        if policy not in POLICIES:
+            raise ValueError(f"política desconocida: {policy!r} (usar {', '.join(POLICIES)})")
+        self.ws = ws
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.slow_timeout = float(slow_timeout)
+        self.on_close = on_close          # callback(outbox) al morir la conexión
+        self.metrics = metrics            # metrics.ChatMetrics (opcional)
+        self.dropped = 0                  # frames descartados por cola llena
+        self.sent = 0
+        self.batch_min = int(batch_min)   # 0 = nunca agrupar
+        self.batch_max = max(1, int(batch_max))
+        self.batch_window = float(batch_window)
+        self._last_send = 0.0
+        self._q = deque()                 # items: (data, kind)
+        self._queued = self._done = 0     # items encolados / ya escritos o descartados (ver flushed)
+        self._progress = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._full_since = None
+        self._closed = False
+        self._task = asyncio.get_running_loop().create_task(self._writer())
+
+    @property
+    def backlog(self) -> int:
+        return len(self._q)
+
+    def put(self, data, kind="msg") -> bool:
+        """Encola `data` (str/bytes ya serializado). Devuelve False si la conexión está cerrada.
+
+        Los bytes se mandan como frame de texto (JSON en UTF-8) salvo `kind="binary"`.
+        Una lista `[(frame, es_texto), ...]` se manda entera y en orden (encabezado + binario).
+        """
+        if self._closed:
+            return False
+        if len(self._q) <= self.maxsize // 2:
+            self._full_since = None
+        elif len(self._q) >= self.maxsize:
+            if not self._make_room():
+                return False
+        self._q.append((data, kind))
+        self._queued += 1
+        self._wake.set()
+        return True
+
+    async def flushed(self):
+        """Vuelve cuando todo lo encolado hasta ahora salió (o se descartó, o se cerró la conexión)."""
+        target = self._queued
+        while self._done < target and not self._closed:
+            self._progress.clear()
+            await self._progress.wait()
+
+    def _advance(self, n=1):
+        self._done += n
+        self._progress.set()
+
+    def _make_room(self) -> bool:
+        now = time.monotonic()
+        if self._full_since is None:
+            self._full_since = now
+        if self.policy == "disconnect" and now - self._full_since > self.slow_timeout:
+            logging.warning(f"Cliente lento desconectado ({self.peer}): cola llena por más de {self.slow_timeout:.0f}s")
+            self._kick_slow()
+            return False
+        if self.policy == "drop_images":
+            for i, (_, kind) in enumerate(self._q):
+                if kind == "image":
+                    del self._q[i]
+                    self._count_drop()
+                    return True
+        self._q.popleft()
+        self._count_drop()
+        return True
+
+    def _count_drop(self):
+        self._advance()
+        self.dropped += 1
+        if self.metrics:
+            self.metrics.dropped.inc()
+
+    @property
+    def peer(self):
+        return getattr(self.ws, "remote_address", None)
+
+    async def _writer(self):
+        try:
+            while True:
+                while not self._q:
+                    self._wake.clear()
+                    await self._wake.wait()
+                data, kind = self._q.popleft()
+                if self.batch_min and kind in BATCHABLE:
+                    data = await self._collect(data)
+                n = self._queued - self._done - len(self._q)   # items que salen en este frame
+                if isinstance(data, list):
+                    send = self._send_frames(data)
+                else:
+                    send = self.ws.send(data, text=(kind != "binary"))
+                if self.policy == "disconnect":
+                    await asyncio.wait_for(send, self.slow_timeout)
+                else:
+                    await send
+                self.sent += 1
+                self._advance(n)
+                self._last_send = time.monotonic()
+                if self.metrics:
+                    self.metrics.frames_out.inc()
+                    self.metrics.bytes_out.inc(_size(data))
+                    if kind in BATCHABLE:
+                        self.metrics.messages_out.inc(n)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logging.warning(f"Cliente lento desconectado ({self.peer}): envío trabado más de {self.slow_timeout:.0f}s")
+            self._kick_slow()
+        except Exception as e:
+            logging.warning(f"Cliente eliminado por error de envío: {e!r}")
+            self.close(kick=True)
+
+    async def _collect(self, data):
+        """`data` solo, o junto con los mensajes que lo siguen en la cola en un frame batch."""
+        if (self.batch_window > 0 and not self._q
+                and time.monotonic() - self._last_send < self.batch_window):
+            await asyncio.sleep(self.batch_window)   # en plena ráfaga: dar tiempo a que llegue el siguiente
+            windowed = True
+        else:
+            windowed = False
+        if not self._q or not (windowed or 1 + len(self._q) >= self.batch_min):
+            return data
+        items = [data]
+        while self._q and len(items) < self.batch_max:
+            nxt, kind = self._q[0]
+            if kind not in BATCHABLE or isinstance(nxt, list):
+                break   # historial, blobs, binarios: salen solos y en su lugar
+            self._q.popleft()
+            items.append(nxt)
+        if len(items) == 1:
+            return data
+        if self.metrics:
+            self.metrics.batches.inc()
+            self.metrics.batched.inc(len(items))
+        # los items ya son JSON: se pegan sin volver a serializar
+        return _BATCH_HEAD + b",".join(i.encode() if isinstance(i, str) else i for i in items) + _BATCH_TAIL
+
+    def _kick_slow(self):
+        if self.metrics:
+            self.metrics.slow_kicks.inc()
+        self.close(kick=True)
+
+    async def _send_frames(self, frames):
+        for frame, text in frames:
+            await self.ws.send(frame, text=text)
+
+    def close(self, kick=False):
+        """Detiene la escritora. Con `kick=True` también cierra el websocket."""
+        if self._closed:
+            return
+        self._closed = True
+        self._q.clear()
+        self._progress.set()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+        if kick:
+            asyncio.get_running_loop().create_task(_close_quietly(self.ws))
+        if self.on_close:
+            self.on_close(self)
+
+
+def _size(data) -> int:
+    """Bytes de un item de la cola: frame, o lista [(frame, es_texto), ...] con frames en trozos."""
+    if isinstance(data, list):
+        return sum(sum(len(c) for c in f) if isinstance(f, list) else len(f) for f, _ in data)
+    return len(data)
+
+
+async def _close_quietly(ws):
+    try: await ws.close()
+    except Exception: pass
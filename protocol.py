@@ -0,0 +1,174 @@
+# protocol.py — extensiones del protocolo FastChat sobre websockets
+#
+# Modo binario (subprotocolo "fastchat.bin", se negocia en el handshake):
+#   subir:  frame de texto con el mensaje JSON y "binary": N, seguido de N frames
+#           binarios con los bytes crudos de cada adjunto (en el orden de "attachments").
+#   bajar:  {"type": "blob", "hash": h, "size": n, "binary": 1} seguido de un frame
+#           binario (fragmentado en trozos de BLOB_CHUNK) con el contenido.
+# Los clientes que no ofrecen el subprotocolo siguen con JSON de texto + base64.
+# {"type": "fetch", "hash": h} sólo manda blobs de hasta FETCH_MAX bytes (que en base64
+#   entran en el max_size de 1 MiB de un cliente websockets por defecto); los más
+#   grandes contestan {"type": "blob", "hash": h, "error": "too_large", "size": n,
+#   "url": "/blob/<hash>"} y se bajan por HTTP en el mismo puerto.
+# Adjuntos grandes: subida por partes reanudable (upload_begin/chunk/commit, ver
+# uploads.py) y después el mensaje con la referencia {"hash": ...}.
+#
+# Reanudación (query string del handshake, los servidores viejos la ignoran):
+#   ws://host:8765/?since=<último seq visto>&epoch=<epoch del servidor>
+#   El servidor contesta {"type": "history", "delta": true, "items": [...faltantes]}
+#   o, si el hueco ya no está en memoria o cambió el epoch, el historial completo
+#   con "resync": true. Ambos traen "epoch" y "last_seq". A estos clientes además
+#   se les confirma cada mensaje propio con {"type": "ack", "seq": n}.
+#
+# Canales (ver channels.py): ws://host:8765/?channel=soporte elige el canal
+#   inicial (since/epoch se refieren a ese canal); sin él se usa "general".
+#
+# Envío confiable: un mensaje con "id" (generado por el cliente, único) se confirma
+#   siempre con {"type": "ack", "seq": n, "id": id}, aunque no haya ?since. Si el
+#   id ya se publicó (reenvío después de reconectar) no se vuelve a publicar: sólo
+#   se confirma con el seq original. El "id" queda en el mensaje guardado.
+#   Estos servidores lo anuncian en el handshake (encabezado X-FastChat-Acks: 1);
+#   con uno que no lo anuncia, el cliente espera el primer ack un rato y, si no
+#   llega (servidor viejo, sin acks), manda sin esperar confirmación.
+#
+# Reconexión: un servidor saturado (muchas conexiones por segundo, ver admission.py)
+#   acepta el handshake y cierra enseguida con el código 1013 (Try Again Later) y
+#   razón "retry-after=<segundos>". El cliente espera al menos eso antes de volver;
+#   entre reintentos, Backoff (jitter decorrelacionado) para no volver todos juntos.
+#
+# Ráfagas (?batch=1): si la cola de salida del cliente se atrasa, el servidor
+#   junta varios mensajes seguidos en un frame {"type": "batch", "items": [...]}
+#   (cada item, el mismo mensaje que habría ido solo). Sin el parámetro, nunca.
+
+import random, urllib.parse
+
+BINARY_SUBPROTOCOL = "fastchat.bin"
+BLOB_CHUNK = 64 * 1024
+FETCH_MAX = 700 * 1024   # 700 KiB → ~934 KiB en base64 dentro del JSON
+MSG_ID_MAX = 64
+RETRY_CLOSE = 1013   # "Try Again Later" (RFC 6455 / registro IANA)
+ACKS_HEADER = "X-FastChat-Acks"
+
+
+def select_subprotocol(connection, offered):
+    """Para `websockets.serve`: acepta el modo binario si el cliente lo ofrece, si no sigue sin subprotocolo."""
+    return BINARY_SUBPROTOCOL if BINARY_SUBPROTOCOL in offered else None
+
+
+def is_binary(ws) -> bool:
+    return getattr(ws, "subprotocol", None) == BINARY_SUBPROTOCOL
+
+
+def advertise_acks(connection, request, response):
+    """Para `websockets.serve` (process_response): anuncia que este servidor confirma cada mensaje con id."""
+    response.headers[ACKS_HEADER] = "1"
+
+
+def acks_advertised(ws) -> bool:
+    """Del lado del cliente: el servidor anunció acks en el handshake."""
+    response = getattr(ws, "response", None)
+    return response is not None and response.headers.get(ACKS_HEADER) == "1"
+
+
+def chunks(data, size=BLOB_CHUNK) -> list:
+    """Rebanadas memoryview (sin copiar) para mandar un binario como frames fragmentados."""
+    mv = memoryview(data)
+    if len(mv) <= size:
+        return [mv]
+    return [mv[i:i + size] for i in range(0, len(mv), size)]
+
+
+async def recv_attachments(ws, msg: dict) -> list:
+    """Lee los `msg["binary"]` frames binarios que siguen a un encabezado y los devuelve como bytes."""
+    n = int(msg.get("binary") or 0)
+    frames = []
+    for _ in range(n):
+        raw = await ws.recv()
+        if isinstance(raw, str):
+            raise ValueError("se esperaba un frame binario de adjunto")
+        frames.append(raw)
+    return frames
+
+
+def msg_id(msg: dict) -> str | None:
+    """El "id" de cliente de un mensaje, si es válido (texto de hasta MSG_ID_MAX caracteres)."""
+    mid = msg.get("id")
+    return mid if isinstance(mid, str) and 0 < len(mid) <= MSG_ID_MAX else None
+
+
+def retry_reason(seconds: float) -> str:
+    """Razón de cierre con la espera sugerida (acompaña a RETRY_CLOSE)."""
+    return f"retry-after={seconds:.1f}"
+
+
+def retry_after(exc) -> float | None:
+    """Espera pedida por el servidor al cerrar con RETRY_CLOSE (de un ConnectionClosed), o None."""
+    rcvd = getattr(exc, "rcvd", None)
+    if rcvd is None or rcvd.code != RETRY_CLOSE:
+        return None
+    key, _, value = (rcvd.reason or "").partition("=")
+    try:
+        return max(0.0, float(value)) if key == "retry-after" else None
+    except ValueError:
+        return None
+
+
+class Backoff:
+    """Espera entre reconexiones con jitter decorrelacionado: min(cap, U(base, 3 × la anterior)).
+
+    Clientes que cayeron juntos (reinicio del servidor) vuelven repartidos en el
+    tiempo en vez de en oleadas; `next(floor)` respeta además el retry-after del servidor.
+    """
+
+    def __init__(self, base=1.0, cap=15.0, rng=random):
+        self.base, self.cap, self.rng = base, cap, rng
+        self.delay = base
+
+    def reset(self):
+        self.delay = self.base
+
+    def next(self, floor=None) -> float:
+        self.delay = min(self.cap, self.rng.uniform(self.base, self.delay * 3))
+        if floor:   # el servidor ya reparte las esperas; un poco de jitter igual
+            return max(self.delay, floor * self.rng.uniform(1.0, 1.25))
+        return self.delay
+
+
+def _query(ws) -> dict:
+    request = getattr(ws, "request", None)
+    return urllib.parse.parse_qs(urllib.parse.urlsplit(getattr(request, "path", "") or "").query)
+
+
+def resume_params(ws):
+    """(since, epoch) pedidos en el handshake; since es None para clientes sin reanudación."""
+    q = _query(ws)
+    try:
+        since = int(q["since"][0]) if "since" in q else None
+    except ValueError:
+        since = None
+    return since, (q.get("epoch") or [None])[0]
+
+
+def handshake_channel(ws) -> str | None:
+    """Canal pedido en el handshake (`?channel=`), o None."""
+    return (_query(ws).get("channel") or [None])[0]
+
+
+def wants_batch(ws) -> bool:
+    """El cliente acepta frames {"type": "batch"} (`?batch=1` en el handshake)."""
+    return (_query(ws).get("batch") or ["0"])[0] == "1"
+
+
+def resume_url(url: str, since: int, epoch: str | None, channel: str | None = None, batch=False) -> str:
+    """`url` del servidor con los parámetros de reanudación (y el canal, y ?batch=1) agregados."""
+    parts = urllib.parse.urlsplit(url)
+    q = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query)
+         if k not in ("since", "epoch", "batch") and not (channel and k == "channel")]
+    q.append(("since", str(since)))
+    if epoch:
+        q.append(("epoch", epoch))
+    if channel:
+        q.append(("channel", channel))
+    if batch:
+        q.append(("batch", "1"))
+    return urllib.parse.urlunsplit(parts._replace(path=parts.path or "/", query=urllib.parse.urlencode(q)))
@@ -1,121 +1,214 @@
-# server.py (con historial en %TEMP% arreglado)
-import asyncio, json, datetime, pathlib, logging, os, tempfile
-import websockets
-from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
-from collections import deque
+# server.py (historial en %TEMP% como diario append-only)
+# La lógica del chat vive en hub.py (la comparte el modo host de cliente.py);
+# acá queda la configuración por entorno y los modos de proceso.
+import asyncio, pathlib, logging, os, tempfile, argparse, signal, socket, sys
+from journal import Journal
+from sqlstore import SqliteStore
+from blobs import BlobStore, externalize
+from compression import serve_kwargs as compression_kwargs
+from bus import BusServer, BusClient
+from hub import Hub
+import codec
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
-CLIENTS = set()
 HISTORY_MAX = 30
-HISTORY_PATH = pathlib.Path(tempfile.gettempdir()) / "fastchat.json"   # 👈 ahora es Path
-HISTORY = deque(maxlen=HISTORY_MAX)
+HISTORY_PATH = pathlib.Path(tempfile.gettempdir()) / "fastchat.jsonl"  # diario append-only
+LEGACY_HISTORY_PATH = pathlib.Path(tempfile.gettempdir()) / "fastchat.json"
+# Canales: cada uno con su historial (frame pre-serializado, cache caliente) y sus suscriptores
+CHANNELS_MAX = int(os.environ.get("FASTCHAT_CHANNELS_MAX", 1000))
+
+# Dónde se guarda el historial: journal (diario en %TEMP%, últimos HISTORY_MAX de cada canal)
+# o sqlite (base en DATA_DIR, retención ilimitada y pedidos {"type": "range"})
+STORE_KIND = os.environ.get("FASTCHAT_STORE", "journal")
+DATA_DIR = pathlib.Path(os.environ.get("FASTCHAT_DATA_DIR")
+                        or pathlib.Path(os.environ.get("LOCALAPPDATA") or pathlib.Path.home() / ".local" / "share") / "FastChat")
+DB_PATH = DATA_DIR / "fastchat.db"
+RANGE_MAX = 200   # mensajes por pedido de rango
+
+# Escritura diferida del historial: cada cuánto (s) o cuántos bytes pendientes se baja a disco
+FLUSH_INTERVAL = float(os.environ.get("FASTCHAT_FLUSH_INTERVAL", 1.0))
+FLUSH_BYTES = int(os.environ.get("FASTCHAT_FLUSH_BYTES", 256 * 1024))
+
+# Adjuntos: fuera del historial, en un almacén por SHA-256 (GET /blob/<hash> o {"type": "fetch"})
+BLOB_DIR = pathlib.Path(os.environ.get("FASTCHAT_BLOB_DIR")
+                        or (DATA_DIR / "blobs" if STORE_KIND == "sqlite"   # que duren lo mismo que la base
+                            else pathlib.Path(tempfile.gettempdir()) / "fastchat_blobs"))
+UPLOAD_MAX = int(os.environ.get("FASTCHAT_UPLOAD_MAX", 64 * 1024 * 1024))   # bytes por adjunto
+# Subidas por partes abiertas a la vez: por conexión, y bytes declarados entre todas (por proceso); 0 = sin tope
+UPLOADS_PER_CONN = int(os.environ.get("FASTCHAT_UPLOADS_PER_CONN", 4))
+UPLOAD_PENDING_MAX = int(os.environ.get("FASTCHAT_UPLOAD_PENDING_MAX", 8 * UPLOAD_MAX))
+# Miniaturas JPEG inline en cada imagen (thumbs.py, requiere Pillow); FASTCHAT_THUMBS=0 las apaga
+THUMBS = os.environ.get("FASTCHAT_THUMBS", "1") != "0"
+
+# Compresión permessage-deflate (ver compression.py): off | on | shared
+# shared comprime cada broadcast/historial una sola vez para todos los clientes
+DEFLATE_MODE = os.environ.get("FASTCHAT_DEFLATE", "shared")
+DEFLATE_WINDOW_BITS = int(os.environ.get("FASTCHAT_DEFLATE_WINDOW_BITS", 12))
+DEFLATE_MEM_LEVEL = int(os.environ.get("FASTCHAT_DEFLATE_MEM_LEVEL", 5))
+DEFLATE_LEVEL = int(os.environ.get("FASTCHAT_DEFLATE_LEVEL", 6))
+DEFLATE_MIN_SIZE = int(os.environ.get("FASTCHAT_DEFLATE_MIN_SIZE", 512))   # bytes; menos → sin comprimir
+
+# Colas de salida: tamaño por cliente y política para clientes lentos
+# (drop_oldest | drop_images | disconnect, ver outbound.py)
+OUTBOX_MAX = int(os.environ.get("FASTCHAT_OUTBOX_MAX", 64))
+SLOW_POLICY = os.environ.get("FASTCHAT_SLOW_POLICY", "drop_oldest")
+SLOW_TIMEOUT = float(os.environ.get("FASTCHAT_SLOW_TIMEOUT", 10))
+# Ráfagas (clientes con ?batch=1): con BATCH_MIN o más mensajes en cola salen juntos en un
+# frame {"type": "batch"} de hasta BATCH_MAX; 0 lo apaga. BATCH_WINDOW_MS > 0 además espera
+# ese tiempo a juntar mensajes seguidos (nunca al primero después de un rato sin tráfico)
+BATCH_MIN = int(os.environ.get("FASTCHAT_BATCH_MIN", 4))
+BATCH_MAX = int(os.environ.get("FASTCHAT_BATCH_MAX", 64))
+BATCH_WINDOW = float(os.environ.get("FASTCHAT_BATCH_WINDOW_MS", 0)) / 1000
+
+# Admisión (ver admission.py): conexiones aceptadas por segundo (con ráfaga de ACCEPT_BURST;
+# las demás se cierran con retry-after) e historiales reenviándose a la vez. 0 = sin tope.
+# Con --workers N cada worker aplica los suyos
+ACCEPT_RATE = float(os.environ.get("FASTCHAT_ACCEPT_RATE", 500))
+ACCEPT_BURST = int(os.environ.get("FASTCHAT_ACCEPT_BURST", 1000))
+REPLAYS_MAX = int(os.environ.get("FASTCHAT_REPLAYS_MAX", 32))
+
+# JSON de frames, historial y bus: orjson o msgspec si están instalados, si no json.
+# FASTCHAT_JSON=orjson|msgspec|json fuerza uno; lo lee codec.py al importarse (también los workers)
+JSON_CODEC = codec.NAME
+
+# Métricas en formato Prometheus: GET /metrics en el mismo puerto (FASTCHAT_METRICS=0 lo apaga)
+METRICS_ENABLED = os.environ.get("FASTCHAT_METRICS", "1") != "0"
+
+# Multi-núcleo (--workers N / FASTCHAT_WORKERS): N procesos en el mismo puerto con
+# SO_REUSEPORT, unidos por un bus local (ver bus.py). Sólo donde hay SO_REUSEPORT.
+WORKERS = int(os.environ.get("FASTCHAT_WORKERS", 1))
+
+
+def deflate_options() -> dict:
+    return compression_kwargs(DEFLATE_MODE, window_bits=DEFLATE_WINDOW_BITS, mem_level=DEFLATE_MEM_LEVEL,
+                              level=DEFLATE_LEVEL, min_size=DEFLATE_MIN_SIZE)
+
+HUB = Hub(HISTORY_MAX, channels_max=CHANNELS_MAX, range_max=RANGE_MAX, outbox_max=OUTBOX_MAX,
+          slow_policy=SLOW_POLICY, slow_timeout=SLOW_TIMEOUT, upload_max=UPLOAD_MAX,
+          uploads_per_conn=UPLOADS_PER_CONN, upload_pending_max=UPLOAD_PENDING_MAX,
+          deflate=deflate_options(), metrics_enabled=METRICS_ENABLED, thumbs=THUMBS,
+          batch_min=BATCH_MIN, batch_max=BATCH_MAX, batch_window=BATCH_WINDOW,
+          accept_rate=ACCEPT_RATE, accept_burst=ACCEPT_BURST, replays_max=REPLAYS_MAX)
 
-
-async def safe_send(ws, data: str):
-    try:
-        await ws.send(data)
-        return True
-    except Exception as e:
-        logging.warning(f"Cliente eliminado por error de envío: {e!r}")
-        try: await ws.close()
-        except Exception: pass
-        return False
-
-async def broadcast(msg: dict, sender_ws=None):
-    if not CLIENTS: return
-    data = json.dumps(msg, ensure_ascii=False)
-    dead = []
-    for ws in list(CLIENTS):
-        if ws is sender_ws:   # no reenvíes al emisor
+def load_history():
+    blobs = BlobStore(BLOB_DIR)
+    if STORE_KIND == "sqlite":
+        store = SqliteStore(DB_PATH, keep=HISTORY_MAX, flush_interval=FLUSH_INTERVAL,
+                            import_from=HISTORY_PATH, transform=lambda it: externalize(it, blobs),
+                            on_write=HUB.metrics.save_history.observe)
+        epoch_path = DB_PATH.with_suffix(".epoch")
+    else:
+        store = Journal(HISTORY_PATH, keep=HISTORY_MAX, flush_interval=FLUSH_INTERVAL,
+                        flush_bytes=FLUSH_BYTES, legacy_path=LEGACY_HISTORY_PATH,
+                        on_write=HUB.metrics.save_history.observe,
+                        transform=lambda it: externalize(it, blobs))
+        epoch_path = HISTORY_PATH.with_suffix(".epoch")
+    HUB.open(blobs, store, epoch_path)
+    logging.info(f"Historial cargado ({STORE_KIND}): {len(HUB.channels)} mensajes "
+                 f"en {len(HUB.channels.names)} canales.")
+
+def _stop_on_signals():
+    """SIGTERM (SIGBREAK en Windows) cancela la tarea principal, igual que Ctrl+C:
+    su `finally` llama a HUB.stop() y el diario/la base bajan lo pendiente a disco."""
+    loop, task = asyncio.get_running_loop(), asyncio.current_task()
+    for name in ("SIGTERM", "SIGBREAK"):
+        sig = getattr(signal, name, None)
+        if sig is None:
             continue
-        ok = await safe_send(ws, data)
-        if not ok:
-            dead.append(ws)
-    for ws in dead:
-        CLIENTS.discard(ws)
-
-async def send_history(ws):
-    if not HISTORY:
-        return
-    payload = {"type": "history", "items": list(HISTORY)}
-    await safe_send(ws, json.dumps(payload, ensure_ascii=False))
-
-async def handler(ws):
-    CLIENTS.add(ws)
-    peer = getattr(ws, "remote_address", None)
-    logging.info(f"Cliente conectado: {peer}")
-
-    # Enviar historial al conectarse
-    await send_history(ws)
+        try:
+            loop.add_signal_handler(sig, task.cancel)
+        except NotImplementedError:   # Windows: sin add_signal_handler
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(task.cancel))
 
-    try:
-        async for raw in ws:
-            try:
-                msg = json.loads(raw)
-            except json.JSONDecodeError:
-                logging.debug("Mensaje no-JSON ignorado")
-                continue
-
-            text = msg.get("text", "")
-            sender = msg.get("from", "???")
-            attachments = msg.get("attachments", [])
-
-            norm = {
-                "type": "image" if attachments else "msg",
-                "from": sender,
-                "text": text,
-                "attachments": attachments,   # 👈 reenviamos adjuntos
-                "ts": datetime.datetime.now().isoformat(timespec="seconds"),
-            }
-
-            HISTORY.append(norm)
-            save_history()
-            await broadcast(norm, sender_ws=ws)
-
-    except (ConnectionClosedOK, ConnectionClosedError) as e:
-        logging.info(f"Cliente desconectado ({peer}): {e}")
-    except OSError as e:
-        logging.info(f"Cliente desconectado por OSError ({peer}): {e}")
-    except asyncio.CancelledError:
-        raise
-    except Exception as e:
-        logging.exception(f"Error en handler ({peer}): {e}")
-    finally:
-        CLIENTS.discard(ws)
+def _address(host, port):
+    return host or os.environ.get("FASTCHAT_HOST", "0.0.0.0"), int(port or os.environ.get("FASTCHAT_PORT", 8765))
 
-def load_history():
-    if HISTORY_PATH.exists():
-        try:
-            items = json.loads(HISTORY_PATH.read_text(encoding="utf-8"))
-            for it in items[-HISTORY_MAX:]:
-                HISTORY.append(it)
-            logging.info(f"Historial cargado: {len(HISTORY)} mensajes.")
-        except Exception as e:
-            logging.warning(f"No se pudo cargar {HISTORY_PATH}: {e}")
-
-def save_history():
-    try:
-        HISTORY_PATH.write_text(
-            json.dumps(list(HISTORY), ensure_ascii=False, indent=2),
-            encoding="utf-8",
-        )
-    except Exception as e:
-        logging.warning(f"No se pudo guardar {HISTORY_PATH}: {e}")
-
-async def main():
+async def main(host=None, port=None):
+    _stop_on_signals()
     load_history()  # cargar historial desde %TEMP%
-    host = "0.0.0.0"; port = 8765
-    logging.info(f"Levantando servidor en ws://{host}:{port}")
-    async with websockets.serve(
-        handler, host=host, port=port,
-        ping_interval=20, ping_timeout=20, max_queue=32, close_timeout=5
-    ):
-        logging.info("Servidor listo. Conecta los clientes a 8765")
+    host, port = _address(host, port)
+    logging.info(f"Levantando servidor en ws://{host}:{port} (JSON: {JSON_CODEC})")
+    await HUB.start(host, port)
+    logging.info(f"Servidor listo. Conecta los clientes a {port}")
+    try:
         await asyncio.Future()  # correr para siempre
+    finally:
+        await HUB.stop()  # bajar a disco lo pendiente
+
+async def main_workers(n, host=None, port=None):
+    # proceso principal: historial + secuenciador; los clientes los atienden los workers
+    _stop_on_signals()
+    load_history()
+    host, port = _address(host, port)
+    bus_path = pathlib.Path(tempfile.gettempdir()) / f"fastchat-bus-{os.getpid()}.sock"
+    bus = BusServer(bus_path, HUB.sequence, lambda: (HUB.channels.epoch, list(HUB.channels)))
+    await bus.start()
+    logging.info(f"Levantando {n} workers en ws://{host}:{port} (bus {bus_path}, JSON: {JSON_CODEC})")
+    procs = {}
+
+    async def spawn(i):
+        procs[i] = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "--worker-bus", str(bus_path),
+            "--host", host, "--port", str(port))
+
+    async def supervise(i):
+        while True:
+            await spawn(i)
+            code = await procs[i].wait()
+            logging.warning(f"Worker {i} terminó (código {code}); se relanza")
+            await asyncio.sleep(1)
+
+    tasks = [asyncio.create_task(supervise(i)) for i in range(n)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            t.cancel()
+        for p in procs.values():
+            if p.returncode is None:
+                p.terminate()
+        await asyncio.gather(*(p.wait() for p in procs.values()), return_exceptions=True)
+        await bus.close()
+        bus_path.unlink(missing_ok=True)
+        await HUB.stop()
+
+async def main_worker(bus_path, host=None, port=None):
+    _stop_on_signals()
+    host, port = _address(host, port)
+    # sqlite sólo para pedidos de rango: escribe el principal
+    store = SqliteStore(DB_PATH, keep=HISTORY_MAX, readonly=True) if STORE_KIND == "sqlite" else None
+    bus = HUB.bus = BusClient(bus_path, HUB.replicate)
+    items = await bus.connect()
+    # mismo directorio de blobs para todos (escrituras atómicas por hash); las subidas
+    # están en disco: se retoman aunque el cliente caiga en otro worker
+    HUB.open(BlobStore(BLOB_DIR), store, items=items, epoch=bus.epoch)
+    await HUB.start(host, port, reuse_port=True)
+    logging.info(f"Worker {bus.id} (pid {os.getpid()}) listo en {port}")
+    try:
+        await bus.run()   # vuelve cuando el proceso principal cierra el bus
+    finally:
+        await HUB.stop()
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Servidor FastChat")
+    ap.add_argument("--host")
+    ap.add_argument("--port", type=int)
+    ap.add_argument("--workers", type=int, default=WORKERS,
+                    help="procesos atendiendo el mismo puerto (SO_REUSEPORT); 1 = un solo proceso")
+    ap.add_argument("--worker-bus", help=argparse.SUPPRESS)   # interno: proceso worker
+    args = ap.parse_args()
+    if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        logging.warning("Este sistema no tiene SO_REUSEPORT: se usa un solo proceso")
+        args.workers = 1
     try:
-        asyncio.run(main())
+        if args.worker_bus:
+            asyncio.run(main_worker(args.worker_bus, args.host, args.port))
+        elif args.workers > 1:
+            asyncio.run(main_workers(args.workers, args.host, args.port))
+        else:
+            asyncio.run(main(args.host, args.port))
     except KeyboardInterrupt:
         logging.info("Servidor detenido por teclado.")
+    except asyncio.CancelledError:
+        logging.info("Servidor detenido por señal.")
@@ -0,0 +1,198 @@
+# sqlstore.py — historial en SQLite (WAL) con retención ilimitada y consultas por rango
+import concurrent.futures, logging, pathlib, queue, sqlite3, threading, time
+from codec import dumps, loads
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    seq    INTEGER PRIMARY KEY,
+    ts     TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    type   TEXT NOT NULL,
+    body   TEXT NOT NULL,           -- mensaje normalizado completo (JSON)
+    channel TEXT NOT NULL DEFAULT 'general'
+);
+CREATE INDEX IF NOT EXISTS messages_ts     ON messages(ts);
+CREATE INDEX IF NOT EXISTS messages_sender ON messages(sender, seq);
+"""
+# bases creadas antes de los canales no tienen la columna: se agrega al abrir
+_CHANNEL_INDEX = "CREATE INDEX IF NOT EXISTS messages_channel ON messages(channel, seq)"
+# canales distintos saltando por el índice (un seek por canal, no recorre la tabla)
+_CHANNELS = """
+WITH RECURSIVE ch(name) AS (
+    SELECT MIN(channel) FROM messages
+    UNION ALL
+    SELECT (SELECT MIN(channel) FROM messages WHERE channel > ch.name) FROM ch WHERE ch.name IS NOT NULL
+)
+SELECT name FROM ch WHERE name IS NOT NULL
+"""
+
+_STOP = object()
+
+
+class SqliteStore:
+    """Mensajes en una base SQLite, atendida por UN hilo dedicado (fuera del loop).
+
+    Misma interfaz que `journal.Journal` (`load`/`append`/`flush`/`close`) más
+    `query()` para pedir rangos. Los `append()` se agrupan y se insertan en una
+    sola transacción cada `flush_interval` segundos o cada `batch_max` mensajes.
+    Arrancar cuesta lo mismo con 30 mensajes que con millones: `load()` sólo lee
+    la cola por índice.
+
+    Con `readonly=True` (workers de servidor.py: escribe sólo el principal) abre
+    la base en modo ro, sin tocar el esquema, y `append()` no hace nada.
+    """
+
+    def __init__(self, path, keep=30, flush_interval=1.0, batch_max=500,
+                 import_from=None, transform=None, log=logging.info, on_write=None, readonly=False):
+        self.path = pathlib.Path(path)
+        self.readonly = readonly
+        self.keep = keep
+        self.flush_interval = float(flush_interval)
+        self.batch_max = batch_max
+        self.import_from = pathlib.Path(import_from) if import_from else None
+        self.transform = transform     # aplicado a cada mensaje importado (p.ej. sacar adjuntos inline)
+        self.log = log
+        self.on_write = on_write       # callback(segundos) tras cada lote insertado (métricas)
+        self.count = 0                 # mensajes en la base (aprox.: el seq más alto, para logs/métricas)
+        self._q = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="sqlite-store", daemon=True)
+        self._thread.start()
+
+    # ---------- API (desde cualquier hilo) ----------
+    def load(self) -> list:
+        """Últimos `keep` mensajes de cada canal, en orden de seq (importa el diario si la base está vacía)."""
+        return self._call(self._load).result()
+
+    def append(self, item: dict):
+        if not self.readonly:
+            self._q.put(("insert", item))
+
+    def query(self, before=None, limit=50, sender=None, channel=None) -> concurrent.futures.Future:
+        """Hasta `limit` mensajes con seq < `before` (los más nuevos), en orden ascendente.
+
+        Devuelve un Future; desde asyncio: `await asyncio.wrap_future(store.query(...))`.
+        """
+        return self._call(self._query, before, limit, sender, channel)
+
+    def flush(self, timeout=5.0):
+        try:
+            self._call(lambda conn: None).result(timeout)
+        except concurrent.futures.TimeoutError:
+            pass
+
+    def close(self):
+        self._q.put((_STOP, None))
+        self._thread.join(timeout=5)
+
+    def _call(self, fn, *args) -> concurrent.futures.Future:
+        fut = concurrent.futures.Future()
+        self._q.put(("call", (fut, fn, args)))
+        return fut
+
+    # ---------- hilo de la base ----------
+    def _connect(self):
+        if self.readonly:   # el esquema y las migraciones son del que escribe
+            return sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")   # con WAL: durable ante cortes de la app
+        conn.executescript(_SCHEMA)
+        if "channel" not in [r[1] for r in conn.execute("PRAGMA table_info(messages)")]:
+            conn.execute("ALTER TABLE messages ADD COLUMN channel TEXT NOT NULL DEFAULT 'general'")
+        conn.execute(_CHANNEL_INDEX)
+        return conn
+
+    def _run(self):
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            logging.error(f"No se pudo abrir {self.path}: {e}")
+            conn = None
+        pending, deadline = [], None
+        while True:
+            timeout = None if not pending else max(0.0, deadline - time.monotonic())
+            try:
+                op, arg = self._q.get(timeout=timeout)
+            except queue.Empty:
+                op, arg = "timeout", None
+            if op == "insert":
+                if not pending:
+                    deadline = time.monotonic() + self.flush_interval
+                pending.append(arg)
+                if len(pending) < self.batch_max:
+                    continue
+            # cualquier otra operación ve primero los inserts pendientes
+            if pending and conn:
+                t0 = time.perf_counter()
+                self._insert(conn, pending)
+                if self.on_write:
+                    self.on_write(time.perf_counter() - t0)
+            pending = []
+            if op is _STOP:
+                if conn:
+                    conn.close()
+                return
+            if op == "call":
+                fut, fn, args = arg
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if conn is None:
+                        raise sqlite3.OperationalError(f"base no disponible: {self.path}")
+                    fut.set_result(fn(conn, *args))
+                except Exception as e:
+                    fut.set_exception(e)
+
+    def _insert(self, conn, items):
+        rows = [(it["seq"], it.get("ts", ""), it.get("from", "???"), it.get("type", "msg"),
+                 dumps(it).decode("utf-8"), it.get("channel") or "general")
+                for it in items if isinstance(it.get("seq"), int)]
+        try:
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO messages (seq, ts, sender, type, body, channel) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.count = max([self.count] + [r[0] for r in rows])
+        except sqlite3.Error as e:
+            logging.warning(f"No se pudo guardar en {self.path}: {e}")
+
+    def _load(self, conn):
+        # MAX sobre la clave primaria: una búsqueda, no un COUNT(*) que recorre la tabla
+        self.count = conn.execute("SELECT MAX(seq) FROM messages").fetchone()[0] or 0
+        if not self.count and self.import_from and self.import_from.exists():
+            self._import_journal(conn)
+        # los últimos `keep` de CADA canal (un canal tranquilo no pierde su historial)
+        items = []
+        for (channel,) in conn.execute(_CHANNELS).fetchall():
+            items += self._query(conn, None, self.keep, None, channel)
+        items.sort(key=lambda it: it["seq"])
+        return items
+
+    def _import_journal(self, conn):
+        from journal import read_tail
+        items = read_tail(self.import_from, self.keep)
+        if self.transform:
+            items = [self.transform(it) for it in items]
+        seq = max([it.get("seq", 0) for it in items if isinstance(it.get("seq"), int)] or [0])
+        for it in items:
+            if not isinstance(it.get("seq"), int):
+                seq += 1
+                it["seq"] = seq
+        items.sort(key=lambda it: it["seq"])
+        self._insert(conn, items)
+        self.log(f"Historial importado de {self.import_from} a {self.path} ({len(items)} mensajes)")
+
+    def _query(self, conn, before, limit, sender, channel=None):
+        sql, args = "SELECT body FROM messages", []
+        where = []
+        if channel:
+            where.append("channel = ?"); args.append(channel)
+        if before is not None:
+            where.append("seq < ?"); args.append(int(before))
+        if sender:
+            where.append("sender = ?"); args.append(sender)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY seq DESC LIMIT ?"; args.append(int(limit))
+        rows = conn.execute(sql, args).fetchall()
+        return [loads(b) for (b,) in reversed(rows)]
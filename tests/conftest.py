@@ -0,0 +1,4 @@
+# los módulos de FastChat están en la raíz del repo (sin paquete)
+import pathlib, sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
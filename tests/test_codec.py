@@ -0,0 +1,31 @@
+import pytest
+
+import codec
+
+MSG = {"type": "msg", "from": "Ñandú", "text": "día\nlínea €", "seq": 7, "attachments": [], "ok": True}
+
+
+def _backends():
+    out = []
+    for name in codec.BACKENDS:
+        try:
+            out.append((name, *codec.backend(name)))
+        except ImportError:
+            pass
+    return out
+
+
+@pytest.mark.parametrize("name,dumps,loads", _backends(), ids=lambda v: v if isinstance(v, str) else "")
+def test_same_bytes_and_roundtrip(name, dumps, loads):
+    data = dumps(MSG)
+    assert data == codec.backend("json")[0](MSG)   # el mismo frame con cualquier backend
+    assert b"\n" not in data and "Ñandú".encode() in data   # una línea (bus, diario), UTF-8 sin escapar
+    assert loads(data) == MSG and loads(data.decode()) == MSG
+
+
+@pytest.mark.parametrize("name,dumps,loads", _backends(), ids=lambda v: v if isinstance(v, str) else "")
+def test_fallbacks_and_errors(name, dumps, loads):
+    assert loads(dumps({"n": 10**30, 1: 2})) in ({"n": 10**30, "1": 2}, {"n": 1e30, "1": 2})
+    assert dumps({"t": "\ud800"}) == b'{"t":"\\ud800"}'
+    with pytest.raises(codec.DecodeError):
+        loads(b'{"type": "msg", "te')
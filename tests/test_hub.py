@@ -0,0 +1,74 @@
+import asyncio, base64, json
+
+import pytest
+
+from blobs import BlobStore
+from hub import Hub
+from outbound import Outbox
+from protocol import FETCH_MAX
+
+from test_outbound import FakeWS
+
+
+def test_fetch_refuses_blobs_that_do_not_fit_a_frame(tmp_path):
+    blobs = BlobStore(tmp_path)
+    small, big = blobs.put(b"a" * 1000), blobs.put(b"b" * (FETCH_MAX + 1))
+
+    async def main():
+        hub = Hub(thumbs=False, metrics_enabled=False)
+        hub.open(blobs)
+        ws = FakeWS()
+        box = hub.clients[ws] = Outbox(ws)
+        for h in (small, big, "0" * 64):
+            await hub.send_blob(ws, h)
+        await box.flushed()
+        box.close()
+        return [json.loads(f) for f in ws.frames]
+
+    ok, too_large, missing = asyncio.run(main())
+    assert base64.b64decode(ok["data"]) == b"a" * 1000
+    assert too_large == {"type": "blob", "hash": big, "error": "too_large", "size": FETCH_MAX + 1,
+                         "url": "/blob/" + big}
+    assert missing["error"] == "not_found"
+
+
+def test_malformed_attachments_get_an_error_frame(tmp_path):
+    async def main():
+        hub = Hub(thumbs=False, metrics_enabled=False)
+        hub.open(BlobStore(tmp_path))
+        ws = FakeWS()
+        box = hub.clients[ws] = Outbox(ws)
+        hub.channels.subscribe(ws, "general")
+        for i, atts in enumerate((5, "x", {"a": 1}, [1, {"hash": "0" * 64}], None, [])):
+            await hub.accept(ws, {"from": "a", "text": "t%d" % i, "attachments": atts, "id": "id%06d" % i})
+        await box.flushed()
+        box.close()
+        return [json.loads(f) for f in ws.frames]
+
+    frames = asyncio.run(main())
+    errors = [f for f in frames if f["type"] == "error"]
+    assert [f["id"] for f in errors] == ["id%06d" % i for i in range(4)]
+    assert all(f["error"] == "attachments" for f in errors)
+    # sin adjuntos (null o lista vacía) se publica como siempre
+    assert [f["id"] for f in frames if f["type"] == "ack"] == ["id000004", "id000005"]
+
+
+def test_publish_error_after_deliver_is_not_masked(tmp_path):
+    # worker: el bus puede devolver el mensaje (deliver resuelve el Future) y después fallar
+    async def main():
+        hub = Hub(thumbs=False, metrics_enabled=False)
+        hub.open(BlobStore(tmp_path))
+        ws = FakeWS()
+        hub.clients[ws] = Outbox(ws)
+
+        async def publish(norm, sender_ws=None, ack=False):
+            await hub.deliver({**norm, "seq": 1}, b"{}", sender_ws)
+            raise ConnectionResetError("bus")
+        hub.publish = publish
+        try:
+            await hub.accept(ws, {"from": "a", "text": "t", "id": "abcdefgh"})
+        finally:
+            hub.clients[ws].close()
+
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(main())
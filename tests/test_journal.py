@@ -0,0 +1,74 @@
+import base64, json, os
+
+from blobs import BlobStore, externalize
+from journal import Journal, read_tail
+
+
+def _msg(seq, channel, text="hola"):
+    return {"type": "msg", "from": "Ana", "text": text, "seq": seq, "channel": channel}
+
+
+def _fill(path, msgs, keep=30):
+    j = Journal(path, keep=keep, flush_interval=0.01, fsync=False)
+    j.load()
+    for m in msgs:
+        j.append(m)
+    j.close()
+
+
+def test_restart_keeps_quiet_channel_next_to_busy_one(tmp_path):
+    path = tmp_path / "fastchat.jsonl"
+    quiet = [_msg(i, "quiet") for i in range(1, 6)]
+    busy = [_msg(i, "busy") for i in range(6, 400)]
+    _fill(path, quiet + busy)   # varias compactaciones por el canal con movimiento
+
+    items = Journal(path, keep=30).load()
+    by_channel = {}
+    for it in items:
+        by_channel.setdefault(it["channel"], []).append(it["seq"])
+    assert by_channel["quiet"] == [1, 2, 3, 4, 5]
+    assert by_channel["busy"] == list(range(370, 400))
+    assert [it["seq"] for it in items] == sorted(it["seq"] for it in items)
+    assert read_tail(path, 30) == items
+
+
+def test_compaction_bounds_file_per_channel(tmp_path):
+    path = tmp_path / "fastchat.jsonl"
+    _fill(path, [_msg(i, f"c{i % 3}") for i in range(1, 1000)], keep=10)
+    lines = path.read_bytes().count(b"\n")
+    assert lines <= 10 * 3 * 4 + 1000 // 3   # lo retenido por el factor de compactación, más un lote
+    j = Journal(path, keep=10)
+    assert len(j.load()) == 30
+    # después de recargar sigue reteniendo por canal
+    j.append(_msg(1000, "c0"))
+    j.close()
+    assert sum(it["channel"] == "c1" for it in Journal(path, keep=10).load()) == 10
+
+
+def test_load_skips_truncated_last_line(tmp_path):
+    path = tmp_path / "fastchat.jsonl"
+    _fill(path, [_msg(i, "general") for i in range(1, 4)])
+    with open(path, "ab") as f:
+        f.write(b'{"type": "msg", "seq": 4, "te')   # corte de luz a mitad de la escritura
+    j = Journal(path, keep=30)
+    assert [it["seq"] for it in j.load()] == [1, 2, 3]
+    j.append(_msg(5, "general"))
+    j.close()
+    assert [it["seq"] for it in Journal(path, keep=30).load()] == [1, 2, 3, 5]
+
+
+def test_load_moves_inline_attachments_out_of_the_file(tmp_path):
+    path = tmp_path / "fastchat.jsonl"
+    raw = os.urandom(50_000)
+    old = {"type": "image", "from": "Ana", "seq": 1, "channel": "general",
+           "attachments": [{"type": "image", "name": "a.png", "data": base64.b64encode(raw).decode()}]}
+    path.write_bytes(json.dumps(old).encode() + b"\n" + json.dumps(_msg(2, "general")).encode() + b"\n")
+    blobs = BlobStore(tmp_path / "blobs")
+
+    journal = Journal(path, keep=5, fsync=False, transform=lambda it: externalize(it, blobs))
+    items = journal.load()
+    journal.close()
+    ref = items[0]["attachments"][0]
+    assert blobs.read(ref["hash"]) == raw and "data" not in ref
+    assert path.stat().st_size < 1000   # reescrito con la referencia, no con el base64
+    assert [it["seq"] for it in read_tail(path, 5)] == [1, 2]
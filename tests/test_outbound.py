@@ -0,0 +1,75 @@
+import asyncio
+
+from history import History
+from metrics import ChatMetrics
+from outbound import Outbox
+
+
+class FakeWS:
+    """Websocket que acepta frames; con `stall` cada envío tarda eso."""
+
+    def __init__(self, stall=0.0):
+        self.stall = stall
+        self.frames = []
+        self.closed = False
+        self.remote_address = ("test", 0)
+
+    async def send(self, data, text=None):
+        if self.stall:
+            await asyncio.sleep(self.stall)
+        self.frames.append(data)
+
+    async def close(self, *a):
+        self.closed = True
+
+
+def test_messages_out_counts_each_batched_item():
+    async def main():
+        metrics = ChatMetrics({}, History())
+        ws = FakeWS()
+        box = Outbox(ws, maxsize=100, metrics=metrics, batch_min=4)
+        for i in range(10):
+            box.put(b'{"type":"msg","text":"%d"}' % i, "msg")
+        box.put(b'{"type":"ack","seq":1}', "ack")
+        await box.flushed()
+        box.close()
+        return metrics, ws
+
+    metrics, ws = asyncio.run(main())
+    assert len(ws.frames) == 2   # un batch de 10 + el ack
+    assert metrics.frames_out.value == 2
+    assert metrics.messages_out.value == 10
+    assert metrics.batched.value == 10
+
+
+def test_disconnect_kicks_client_that_never_catches_up():
+    # cada envío tarda menos que slow_timeout, pero la cola nunca baja de la mitad
+    async def main():
+        metrics = ChatMetrics({}, History())
+        ws = FakeWS(stall=0.02)
+        box = Outbox(ws, maxsize=8, policy="disconnect", slow_timeout=0.3, metrics=metrics)
+        for i in range(200):
+            if not box.put(b'{"type":"msg","text":"%d"}' % i, "msg"):
+                break
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0)
+        return metrics, ws, i
+
+    metrics, ws, i = asyncio.run(main())
+    assert ws.closed and metrics.slow_kicks.value == 1
+    assert i < 150
+
+
+def test_disconnect_keeps_client_that_drains():
+    async def main():
+        ws = FakeWS(stall=0.01)
+        box = Outbox(ws, maxsize=8, policy="disconnect", slow_timeout=0.2)
+        for burst in range(6):   # ráfagas que llenan la cola, con tiempo de vaciarla entre una y otra
+            for i in range(12):
+                assert box.put(b'{"type":"msg","text":"%d"}' % i, "msg")
+            await asyncio.sleep(0.15)
+        await box.flushed()
+        box.close()
+        return ws
+
+    assert not asyncio.run(main()).closed
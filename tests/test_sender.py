@@ -0,0 +1,104 @@
+# Cola de envío del cliente contra un servidor que confirma y uno viejo que no.
+import asyncio, json, os, sys, types
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.modules.setdefault("winsound", types.ModuleType("winsound"))   # cliente.py es para Windows
+pytest.importorskip("PyQt6.QtWidgets")
+import cliente  # noqa: E402
+from protocol import acks_advertised, advertise_acks  # noqa: E402
+
+cliente._import_network()
+websockets = cliente.websockets
+
+
+class Sender:
+    """Sólo la cola de envío de TrayClient (sin Qt)."""
+
+    def __init__(self, ws):
+        self.loop = asyncio.get_running_loop()
+        self.ws, self._local = ws, None
+        self._send_lock = asyncio.Lock()
+        self._unacked, self._inflight, self._uploading = {}, {}, set()
+        self._send_wake = asyncio.Event()
+        self._acks = True if acks_advertised(ws) else None
+
+
+for _name in ("_send_ws_payload", "_sender", "_probe_acks", "_acked", "_resend", "_transmit"):
+    setattr(Sender, _name, getattr(cliente.TrayClient, _name))
+
+
+async def _server(received, ack=False):
+    async def handler(ws):
+        async for raw in ws:
+            msg = json.loads(raw)
+            received.append(msg["text"])
+            if ack:
+                await ws.send(json.dumps({"type": "ack", "seq": len(received), "id": msg["id"]}))
+    kwargs = {"process_response": advertise_acks} if ack else {}
+    return await websockets.serve(handler, "127.0.0.1", 0, **kwargs)
+
+
+async def _until(cond, timeout=5.0):
+    async with asyncio.timeout(timeout):
+        while not cond():
+            await asyncio.sleep(0.01)
+
+
+def test_server_without_acks_falls_back_to_send_and_forget(monkeypatch):
+    monkeypatch.setattr(cliente, "ACK_TIMEOUT", 0.2)
+
+    async def main():
+        received = []
+        server = await _server(received)
+        port = server.sockets[0].getsockname()[1]
+        ws = await websockets.connect(f"ws://127.0.0.1:{port}")
+        s = Sender(ws)
+        assert s._acks is None
+        task = asyncio.create_task(s._sender())
+        n = cliente.SEND_WINDOW * 3   # más que la ventana: no se tiene que trabar
+        for i in range(n):
+            await s._send_ws_payload({"from": "me", "text": f"m{i}"})
+        await _until(lambda: not s._unacked)
+        assert s._acks is False
+        s._resend()   # reconexión: nada que reenviar (no duplica)
+        await s._send_ws_payload({"from": "me", "text": "after"})
+        await _until(lambda: not s._unacked)
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await ws.close()
+        server.close()
+        return received, n
+
+    received, n = asyncio.run(main())
+    assert received == [f"m{i}" for i in range(n)] + ["after"]
+
+
+def test_server_with_acks_keeps_queue_until_acked():
+    async def main():
+        received = []
+        server = await _server(received, ack=True)
+        port = server.sockets[0].getsockname()[1]
+        ws = await websockets.connect(f"ws://127.0.0.1:{port}")
+        s = Sender(ws)
+        assert s._acks is True
+        task = asyncio.create_task(s._sender())
+        reader = asyncio.create_task(_read_acks(ws, s))
+        for i in range(10):
+            await s._send_ws_payload({"from": "me", "text": f"m{i}"})
+        await _until(lambda: not s._unacked)
+        task.cancel()
+        reader.cancel()
+        await ws.close()
+        server.close()
+        return received
+
+    assert asyncio.run(main()) == [f"m{i}" for i in range(10)]
+
+
+async def _read_acks(ws, s):
+    async for raw in ws:
+        msg = json.loads(raw)
+        if msg.get("type") == "ack":
+            s._acked(msg.get("id"))
@@ -0,0 +1,78 @@
+import sqlite3
+
+from journal import Journal
+from sqlstore import SqliteStore, _CHANNELS
+
+
+def _msg(seq, channel):
+    return {"type": "msg", "from": "Ana", "text": f"m{seq}", "seq": seq, "channel": channel}
+
+
+def test_load_keeps_last_per_channel(tmp_path):
+    store = SqliteStore(tmp_path / "h.db", keep=5, flush_interval=0.01)
+    assert store.load() == []
+    for i in range(1, 4):
+        store.append(_msg(i, "quiet"))
+    for i in range(4, 100):
+        store.append(_msg(i, "busy"))
+    store.close()
+
+    store = SqliteStore(tmp_path / "h.db", keep=5)
+    items = store.load()
+    store.close()
+    assert [it["seq"] for it in items] == [1, 2, 3, 95, 96, 97, 98, 99]
+    assert store.count == 99
+
+
+def test_startup_queries_do_not_scan(tmp_path):
+    store = SqliteStore(tmp_path / "h.db")
+    store.load()
+    store.close()
+    conn = sqlite3.connect(tmp_path / "h.db")
+    for sql in (_CHANNELS, "SELECT MAX(seq) FROM messages"):
+        plan = " ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+        assert "SCAN messages" not in plan, plan
+
+
+def test_imports_journal_per_channel(tmp_path):
+    journal = Journal(tmp_path / "fastchat.jsonl", keep=5, flush_interval=0.01, fsync=False)
+    journal.load()
+    for i in range(1, 3):
+        journal.append(_msg(i, "quiet"))
+    for i in range(3, 50):
+        journal.append(_msg(i, "busy"))
+    journal.close()
+
+    store = SqliteStore(tmp_path / "h.db", keep=5, import_from=tmp_path / "fastchat.jsonl", log=lambda m: None)
+    items = store.load()
+    store.close()
+    assert [it["seq"] for it in items] == [1, 2, 45, 46, 47, 48, 49]
+
+
+def test_readonly_store_leaves_schema_to_the_writer(tmp_path):
+    db = tmp_path / "h.db"
+    conn = sqlite3.connect(db)   # base de antes de los canales: sin columna channel
+    conn.execute("CREATE TABLE messages (seq INTEGER PRIMARY KEY, ts TEXT NOT NULL, sender TEXT NOT NULL, "
+                 "type TEXT NOT NULL, body TEXT NOT NULL)")
+    conn.execute("""INSERT INTO messages VALUES (1, '', 'Ana', 'msg', '{"seq":1,"text":"hola"}')""")
+    conn.commit()
+    conn.close()
+
+    ro = SqliteStore(db, readonly=True)
+    assert [it["text"] for it in ro.query().result()] == ["hola"]
+    ro.append(_msg(2, "general"))
+    ro.close()
+    conn = sqlite3.connect(db)
+    assert "channel" not in [r[1] for r in conn.execute("PRAGMA table_info(messages)")]
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 1
+    conn.close()
+
+    writer = SqliteStore(db, flush_interval=0.01)
+    writer.load()
+    writer.append(_msg(2, "soporte"))
+    writer.flush()
+    ro = SqliteStore(db, readonly=True)   # con el que escribe abierto (WAL)
+    assert [it["seq"] for it in ro.query(channel="soporte").result()] == [2]
+    ro.close()
+    writer.close()
@@ -0,0 +1,41 @@
+import base64, io
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+import thumbs  # noqa: E402
+
+
+def _png(size, mode="RGB"):
+    out = io.BytesIO()
+    Image.new(mode, size).save(out, "PNG")
+    return out.getvalue()
+
+
+def test_thumb_of_screenshot():
+    t = thumbs.make_thumb(_png((1920, 1080)))
+    assert t["thumb_mime"] == "image/jpeg" and (t["w"], t["h"]) == (1920, 1080)
+    with Image.open(io.BytesIO(base64.b64decode(t["thumb"]))) as im:
+        assert im.size[0] <= thumbs.THUMB_BOX[0] and im.size[1] <= thumbs.THUMB_BOX[1]
+
+
+def test_decompression_bomb_is_refused_before_decoding(caplog):
+    bomb = _png((12000, 12000), "1")   # 144 Mpx en unos pocos KB
+    assert len(bomb) < 64 * 1024
+    assert thumbs.make_thumb(bomb) is None
+    assert "demasiado grande" in caplog.text
+
+
+def test_not_an_image():
+    assert thumbs.make_thumb(b"esto no es una imagen") is None
+
+
+def test_add_thumbs_ignores_the_declared_size(tmp_path):
+    from blobs import BlobStore
+    store = BlobStore(tmp_path)
+    raw = _png((1920, 1080))
+    raw += b"\0" * max(0, thumbs.THUMB_MIN_BYTES + 1 - len(raw))   # bytes de más al final: sigue siendo PNG
+    h = store.put(raw)
+    for size in ("x", None, [1], 1):
+        msg = thumbs.add_thumbs({"attachments": [{"type": "image", "hash": h, "size": size}]}, store)
+        assert msg["attachments"][0]["thumb_mime"] == "image/jpeg"
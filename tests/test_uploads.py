@@ -0,0 +1,39 @@
+import asyncio, base64
+
+from blobs import BlobStore
+from uploads import Uploads, handle_request
+
+
+def step(uploads, ws, **req):
+    return asyncio.run(handle_request(uploads, ws, req))
+
+
+def test_begin_limits_per_connection_and_pending_bytes(tmp_path):
+    blobs = BlobStore(tmp_path / "blobs")
+    up = Uploads(tmp_path / "up", blobs, max_size=1000, per_conn=2, pending_max=2500)
+    a, b = object(), object()
+
+    assert step(up, a, type="upload_begin", upload="a" * 8, size=1000)["offset"] == 0
+    assert step(up, a, type="upload_begin", upload="a" * 8, size=1000)["offset"] == 0   # reanudar no suma
+    assert step(up, a, type="upload_begin", upload="b" * 8, size=1000)["offset"] == 0
+    r = step(up, a, type="upload_begin", upload="c" * 8, size=10)
+    assert "por conexión" in r["error"] and "offset" not in r
+    assert not (tmp_path / "up" / ("c" * 8 + ".part")).exists()
+
+    # otra conexión: entra lo que queda de pending_max
+    assert "error" in step(up, b, type="upload_begin", upload="d" * 8, size=600)
+    assert step(up, b, type="upload_begin", upload="e" * 8, size=500)["offset"] == 0
+    assert up.pending == 2500
+
+    # confirmar libera el cupo
+    assert step(up, b, type="upload_chunk", upload="e" * 8, offset=0, data=base64.b64encode(b"x" * 500).decode())["offset"] == 500
+    assert step(up, b, type="upload_commit", upload="e" * 8)["done"]
+    assert up.pending == 2000
+    assert step(up, b, type="upload_begin", upload="d" * 8, size=400)["offset"] == 0
+
+    # desconectarse también; la parte queda en disco y otra conexión la retoma
+    up.write("a" * 8, 0, b"y" * 100)
+    up.release(a)
+    assert up.pending == 400
+    assert step(up, b, type="upload_begin", upload="a" * 8, size=1000)["offset"] == 100
+    assert up.pending == 1400
@@ -0,0 +1,88 @@
+# thumbs.py — miniaturas de las imágenes adjuntas (opcional: requiere Pillow)
+#
+# Al publicar una imagen, el hub agrega a su referencia una miniatura JPEG chica:
+#   {"type": "image", "hash": h, "name": ..., "mime": ..., "size": n,
+#    "thumb": base64, "thumb_mime": "image/jpeg", "w": ancho, "h": alto}   (w/h del original)
+# Así viaja inline en el broadcast y en el historial; el cliente la muestra sin
+# bajar nada y pide el original (GET /blob/<hash> o {"type": "fetch"}) sólo
+# cuando el usuario lo abre. Sin Pillow los mensajes salen sin "thumb" y los
+# clientes bajan el original como antes (Pillow es una dependencia opcional, ver
+# requirements-extra.txt). Las imágenes vienen de cualquier cliente: antes de
+# decodificar se mira el tamaño declarado en el encabezado, y una imagen de más
+# de THUMB_MAX_PIXELS (bomba de descompresión) se queda sin miniatura.
+import base64, io, logging
+
+THUMB_MAX_PIXELS = 50_000_000   # ~8000×6000; más que cualquier captura de pantalla real
+
+try:
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = THUMB_MAX_PIXELS   # Pillow avisa a partir de acá y falla al doble
+except ImportError:
+    Image = None
+
+THUMB_BOX = (320, 220)          # lo mismo que muestra el cliente
+THUMB_QUALITY = 70
+THUMB_MIN_BYTES = 16 * 1024     # imágenes más chicas: no vale la pena, se baja el original
+THUMB_KEYS = ("thumb", "thumb_mime", "w", "h")
+_BACKGROUND = (0x1A, 0x1D, 0x21)   # fondo del historial del cliente (para las transparencias)
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def make_thumb(raw: bytes, box=THUMB_BOX, quality=THUMB_QUALITY) -> dict | None:
+    """Miniatura JPEG de `raw` como {"thumb", "thumb_mime", "w", "h"}; None si no es una imagen.
+
+    Bloqueante (decodifica y comprime; Pillow suelta el GIL mientras tanto):
+    llamar con `asyncio.to_thread`.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(raw)) as im:   # sólo lee el encabezado
+            w, h = im.size
+            if w * h > THUMB_MAX_PIXELS:
+                raise Image.DecompressionBombError(f"{w}x{h} píxeles")
+            im.draft("RGB", box)   # JPEG: decodifica directamente a escala reducida
+            im.thumbnail(box)
+            if im.mode in ("RGBA", "LA", "P"):
+                rgba = im.convert("RGBA")
+                im = Image.new("RGB", rgba.size, _BACKGROUND)
+                im.paste(rgba, mask=rgba.getchannel("A"))
+            elif im.mode not in ("RGB", "L"):
+                im = im.convert("RGB")
+            out = io.BytesIO()
+            im.save(out, "JPEG", quality=quality, optimize=True)
+    except Image.DecompressionBombError as e:
+        logging.warning(f"Sin miniatura: imagen demasiado grande ({e})")
+        return None
+    except Exception as e:   # no es una imagen, formato no soportado, archivo cortado...
+        logging.debug(f"Sin miniatura: {e!r}")
+        return None
+    return {"thumb": base64.b64encode(out.getvalue()).decode("ascii"), "thumb_mime": "image/jpeg",
+            "w": w, "h": h}
+
+
+def add_thumbs(msg: dict, store, enabled=True) -> dict:
+    """Agrega la miniatura a cada imagen adjunta (leyendo el original de `store`).
+
+    Las miniaturas que mande un cliente se descartan: sólo vale la que genera el hub.
+    Bloqueante: llamar con `asyncio.to_thread`.
+    """
+    atts = msg.get("attachments") or []
+    if not atts:
+        return msg
+    out = []
+    for a in atts:
+        if isinstance(a, dict):
+            a = {k: v for k, v in a.items() if k not in THUMB_KEYS}
+            # el tamaño del blob guardado, no el "size" que declara el cliente
+            if enabled and Image is not None and a.get("type", "image") == "image" \
+                    and (store.size(a.get("hash")) or 0) > THUMB_MIN_BYTES:
+                raw = store.read(a.get("hash"))
+                t = make_thumb(raw) if raw else None
+                if t:
+                    a.update(t)
+        out.append(a)
+    return {**msg, "attachments": out}
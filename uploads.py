@@ -0,0 +1,201 @@
+# uploads.py — subidas de adjuntos por partes, reanudables y directo a disco
+#
+# Protocolo (frames de texto JSON; ver también protocol.py):
+#   {"type": "upload_begin", "upload": id, "size": n}
+#       → {"type": "upload", "upload": id, "offset": k}   (k > 0 si ya había una parte: reanudar desde ahí)
+#   {"type": "upload_chunk", "upload": id, "offset": k, "data": base64}
+#   {"type": "upload_chunk", "upload": id, "offset": k, "binary": 1} + 1 frame binario (modo binario)
+#       → {"type": "upload", "upload": id, "offset": k + len}   (si k no coincide, el offset real)
+#   {"type": "upload_commit", "upload": id}
+#       → {"type": "upload", "upload": id, "done": true, "hash": h, "size": n}
+#   Errores: {"type": "upload", "upload": id, "error": "..."}. Un upload_begin que pasa
+#   los topes (subidas abiertas por conexión, bytes pendientes en total) se rechaza así.
+# El adjunto recién se anuncia cuando el cliente manda el mensaje con la
+# referencia {"hash": h, ...}; mientras tanto los mensajes de texto siguen pasando.
+import asyncio, base64, hashlib, logging, os, pathlib, re, time
+from protocol import recv_attachments
+from codec import dumps, loads
+
+OPS = ("upload_begin", "upload_chunk", "upload_commit")
+UPLOAD_CHUNK = 256 * 1024   # por debajo del max_size (1 MiB) de websockets también en base64
+_ID_RE = re.compile(r"^[0-9A-Za-z_-]{8,64}$")
+
+
+class UploadError(Exception):
+    pass
+
+
+class Uploads:
+    """Subidas en curso como archivos `.part` junto al almacén de blobs.
+
+    Todo el estado está en disco (no en memoria de la conexión): una subida
+    cortada se retoma desde otra conexión, o desde otro worker. Al confirmar,
+    el archivo se hashea por partes y se mueve al `BlobStore` sin copiarlo.
+    Métodos bloqueantes: llamar con `asyncio.to_thread`; salvo `reserve` y
+    `release`, que sólo llevan la cuenta en memoria y corren en el loop.
+
+    Topes (0 = sin tope): `per_conn` subidas abiertas a la vez por conexión y
+    `pending_max` bytes declarados entre todas las abiertas en este proceso.
+    """
+
+    def __init__(self, root, blobs, max_size=64 * 1024 * 1024, ttl=24 * 3600,
+                 per_conn=4, pending_max=512 * 1024 * 1024):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.blobs = blobs
+        self.max_size = max_size
+        self.ttl = ttl
+        self.per_conn = per_conn
+        self.pending_max = pending_max
+        self.pending = 0     # bytes declarados de las subidas abiertas
+        self._open = {}      # id -> [tamaño, conexiones que la tienen abierta]
+        self._conns = {}     # conexión -> ids abiertos desde ahí
+
+    def _paths(self, uid):
+        if not isinstance(uid, str) or not _ID_RE.match(uid):
+            raise UploadError("id de subida inválido")
+        return self.root / f"{uid}.part", self.root / f"{uid}.json"
+
+    def _size(self, meta) -> int:
+        try:
+            return loads(meta.read_bytes())["size"]
+        except (OSError, ValueError, KeyError):
+            raise UploadError("subida desconocida")
+
+    def _check_size(self, size) -> int:
+        size = int(size)
+        if not 0 < size <= self.max_size:
+            raise UploadError(f"tamaño inválido (máximo {self.max_size} bytes)")
+        return size
+
+    def reserve(self, conn, uid, size):
+        """Anota `uid` como abierta por `conn`; UploadError si pasa algún tope."""
+        self._paths(uid)
+        size = self._check_size(size)
+        mine = self._conns.setdefault(conn, set())
+        entry = self._open.get(uid)
+        if uid not in mine and self.per_conn and len(mine) >= self.per_conn:
+            raise UploadError(f"demasiadas subidas a la vez (máximo {self.per_conn} por conexión)")
+        extra = size - (entry[0] if entry else 0)
+        if extra > 0 and self.pending_max and self.pending + extra > self.pending_max:
+            raise UploadError("el servidor tiene demasiadas subidas pendientes; reintentar más tarde")
+        if entry:
+            entry[0] = size
+        else:
+            entry = self._open[uid] = [size, set()]
+        entry[1].add(conn)
+        mine.add(uid)
+        self.pending += extra
+
+    def release(self, conn, uid=None):
+        """Suelta `uid` (todas las de `conn` si es None, al desconectarse). La subida
+        sigue en disco para retomarla, pero deja de contar hasta el próximo begin."""
+        mine = self._conns.get(conn, set())
+        for u in list(mine) if uid is None else [uid]:
+            mine.discard(u)
+            entry = self._open.get(u)
+            if entry:
+                entry[1].discard(conn)
+                if not entry[1]:
+                    self.pending -= entry[0]
+                    del self._open[u]
+        if not mine:
+            self._conns.pop(conn, None)
+
+    def done(self, uid):
+        """Confirmada: deja de contar para todas las conexiones que la tenían abierta."""
+        entry = self._open.get(uid)
+        for conn in list(entry[1]) if entry else ():
+            self.release(conn, uid)
+
+    def begin(self, uid, size: int) -> int:
+        """Crea la subida (o la retoma) y devuelve desde qué offset seguir."""
+        part, meta = self._paths(uid)
+        size = self._check_size(size)
+        if part.exists() and meta.exists() and self._size(meta) == size:
+            return part.stat().st_size
+        meta.write_bytes(dumps({"size": size}))
+        part.write_bytes(b"")
+        return 0
+
+    def write(self, uid, offset: int, data) -> int:
+        """Agrega `data` si `offset` es donde termina la parte; devuelve el offset resultante."""
+        part, meta = self._paths(uid)
+        size = self._size(meta)
+        cur = part.stat().st_size if part.exists() else 0
+        if int(offset) != cur:
+            return cur   # duplicado o hueco: el cliente sigue desde `cur`
+        if cur + len(data) > size:
+            raise UploadError("la subida excede el tamaño declarado")
+        with open(part, "ab") as f:
+            f.write(data)
+        return cur + len(data)
+
+    def commit(self, uid) -> tuple[str, int]:
+        """Verifica que esté completa, la mueve al almacén de blobs y devuelve (hash, tamaño)."""
+        part, meta = self._paths(uid)
+        size = self._size(meta)
+        if not part.exists() or part.stat().st_size != size:
+            raise UploadError("subida incompleta")
+        sha = hashlib.sha256()
+        with open(part, "rb") as f:
+            while block := f.read(1024 * 1024):
+                sha.update(block)
+        h = sha.hexdigest()
+        dest = self.blobs.path(h)
+        if dest.exists():   # deduplicación: ya estaba
+            part.unlink()
+        else:
+            dest.parent.mkdir(exist_ok=True)
+            os.replace(part, dest)
+        meta.unlink(missing_ok=True)
+        return h, size
+
+    def expire(self) -> int:
+        """Borra subidas abandonadas hace más de `ttl` segundos."""
+        limit = time.time() - self.ttl
+        n = 0
+        for p in self.root.glob("*.part"):
+            try:
+                if p.stat().st_mtime < limit:
+                    p.unlink()
+                    p.with_suffix(".json").unlink(missing_ok=True)
+                    n += 1
+            except OSError:
+                pass
+        return n
+
+
+async def handle_request(uploads: Uploads, ws, req: dict) -> dict:
+    """Atiende un paso de subida (`req["type"]` en OPS) y devuelve la respuesta a encolar.
+
+    En modo binario el trozo viene en el frame binario siguiente y se lee de `ws`.
+    El disco se toca en un hilo: el loop sigue atendiendo a los demás. Al
+    desconectarse `ws`, llamar `uploads.release(ws)`.
+    """
+    uid, op = req.get("upload"), req.get("type")
+    reply = {"type": "upload", "upload": uid}
+    try:
+        if op == "upload_begin":
+            uploads.reserve(ws, uid, req.get("size"))
+            try:
+                reply["offset"] = await asyncio.to_thread(uploads.begin, uid, req.get("size"))
+            except OSError:
+                uploads.release(ws, uid)
+                raise
+        elif op == "upload_chunk":
+            if req.get("binary"):
+                data = (await recv_attachments(ws, {"binary": 1}))[0]
+            else:
+                data = base64.b64decode(req.get("data") or "")
+            reply["offset"] = await asyncio.to_thread(uploads.write, uid, req.get("offset"), data)
+        else:
+            h, size = await asyncio.to_thread(uploads.commit, uid)
+            uploads.done(uid)
+            reply.update(done=True, hash=h, size=size)
+    except (UploadError, TypeError, ValueError) as e:
+        reply["error"] = str(e)
+    except OSError as e:
+        logging.warning(f"Error de disco en subida {uid}: {e}")
+        reply["error"] = "error de disco"
+    return reply